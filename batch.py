@@ -0,0 +1,144 @@
+# пакетный режим: выполняет команды эмулятора без GUI (tkinter не импортируется).
+# команды берутся из --startup-script или построчно из stdin, вывод - в stdout,
+# ошибки - в stderr; код возврата: 0 - успех, 1 - были ошибки команд,
+# 2 - VFS или скрипт не удалось загрузить.
+import argparse
+import io
+import sys
+import time
+from handlers import CommandHandler
+from content_cache import DEFAULT_CACHE_BUDGET
+from vfs_mount import DEFAULT_MOUNT_BUDGET
+from profiling import RunProfiler
+
+EXIT_OK = 0
+EXIT_COMMAND_ERRORS = 1
+EXIT_LOAD_ERROR = 2
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Эмулятор терминала: пакетный режим без GUI')
+    parser.add_argument('--vfs-path', type=str, required=True,
+                      help='Путь к XML-файлу с виртуальной файловой системой')
+    parser.add_argument('--startup-script', type=str, default=None,
+                      help='Путь к скрипту (по умолчанию команды читаются из stdin)')
+    parser.add_argument('--cache-budget', type=int, default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+                      help='Бюджет кеша содержимого файлов в МиБ')
+    parser.add_argument('--no-snapshot', action='store_true',
+                      help='Не использовать бинарный снимок VFS (всегда разбирать XML)')
+    parser.add_argument('--journal', action='store_true',
+                      help='Сохранять изменения (mkdir, cp) в журнал рядом с XML и применять его при загрузке')
+    parser.add_argument('--grep-index', action='store_true',
+                      help='Построить при загрузке n-граммный индекс содержимого файлов для grep')
+    parser.add_argument('--mount-budget', type=int, default=DEFAULT_MOUNT_BUDGET,
+                      help='Сколько узлов смонтированных образов держать в памяти (0 - без ограничения)')
+    parser.add_argument('--echo', action='store_true',
+                      help='Печатать каждую команду с промптом перед её выводом')
+    parser.add_argument('--fail-fast', action='store_true',
+                      help='Остановиться на первой ошибке')
+    parser.add_argument('--timing', action='store_true',
+                      help='Вывести в stderr число команд, время и пропускную способность')
+    parser.add_argument('--profile', type=str, default=None, metavar='PREFIX',
+                      help='Профилировать прогон (cProfile, tracemalloc) и записать отчёты в PREFIX.*')
+    return parser.parse_args(argv)
+
+
+def run(args, stdin=None, stdout=None, stderr=None) -> int:
+    stderr = stderr or sys.stderr
+    if not getattr(args, 'profile', None):
+        return _run(args, stdin, stdout, stderr)
+
+    profiler = RunProfiler(args.profile)
+    profiler.start()
+    try:
+        return _run(args, stdin, stdout, stderr, profiler)
+    finally:
+        for path in profiler.stop():
+            print(f"Профиль записан: {path}", file=stderr)
+
+
+def _run(args, stdin, stdout, stderr, profiler=None) -> int:
+    stdin = stdin or io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    stdout = stdout or sys.stdout
+
+    started = time.perf_counter()
+    try:
+        handler = CommandHandler(args.vfs_path, args.cache_budget * 1024 * 1024,
+                                 not args.no_snapshot, args.journal, args.grep_index,
+                                 mount_budget=args.mount_budget)
+    except RuntimeError as e:
+        print(e, file=stderr)
+        return EXIT_LOAD_ERROR
+    load_time = time.perf_counter() - started
+    if profiler is not None:
+        profiler.handler = handler
+
+    # вывод команд пишется блоками по мере выполнения и не собирается целиком
+    if args.startup_script:
+        events = handler.iter_script(args.startup_script, stream=True)
+    else:
+        events = handler.iter_commands(stdin, stream=True)
+
+    exit_code = EXIT_OK
+    commands = 0
+    command_time = 0.0
+    try:
+        for event in events:
+            if event.error:
+                print(f"Ошибка скрипта: {event.error}", file=stderr)
+                # ошибка до первой команды - скрипт не удалось открыть
+                if not event.line_num:
+                    return EXIT_LOAD_ERROR
+                exit_code = EXIT_COMMAND_ERRORS
+                if args.fail_fast:
+                    break
+                continue
+
+            commands += 1
+            if args.echo:
+                stdout.write(f"{event.cwd}$ {event.command}\n")
+            started = time.perf_counter()
+            last = _write_chunks(event.chunks, stdout)
+            command_time += time.perf_counter() - started
+            if last == "EXIT_TERMINAL":
+                break
+            if event.chunks.failed:
+                stderr.write(last)
+                exit_code = EXIT_COMMAND_ERRORS
+                if args.fail_fast:
+                    break
+            else:
+                stdout.write(last)
+    except UnicodeDecodeError:
+        print("Ошибка кодировки входных данных. Используйте UTF-8", file=stderr)
+        return EXIT_LOAD_ERROR
+    finally:
+        stdout.flush()
+
+    if args.timing:
+        rate = commands / command_time if command_time else 0.0
+        print(f"VFS load: {load_time:.3f} s\n"
+              f"Commands: {commands}\n"
+              f"Command time: {command_time:.3f} s\n"
+              f"Throughput: {rate:.0f} commands/s", file=stderr)
+    return exit_code
+
+
+def _write_chunks(chunks, stdout) -> str:
+    # пишет вывод команды в stdout, кроме последнего блока, и возвращает его:
+    # сообщение об ошибке (в том числе посреди вывода) приходит последним блоком,
+    # и если команда завершилась ошибкой (chunks.failed), он идёт в stderr
+    last = ""
+    for chunk in chunks:
+        if last:
+            stdout.write(last)
+        last = chunk
+    return last
+
+
+def main(argv=None) -> int:
+    return run(parse_arguments(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
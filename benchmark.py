@@ -0,0 +1,461 @@
+# набор бенчмарков эмулятора: генерирует синтетический образ VFS заданной формы,
+# замеряет загрузку, задержку команд и пропускную способность execute_script
+# и печатает результат в JSON, чтобы прогоны можно было сравнивать между собой.
+# отдельно замеряется пропускная способность чтения из нескольких потоков, пока
+# другой поток изменяет дерево (читатели работают со своей версией и не ждут писателя).
+#
+#   python benchmark.py --depth 4 --fanout 5 --files 10 --payload-size 4096 --output run.json
+#   python benchmark.py ... --compare run.json      # сравнить с прошлым прогоном
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+from handlers import CommandHandler
+from vfs import VFSManager
+from content_cache import DEFAULT_CACHE_BUDGET
+from session import SessionContext
+from payload_compression import COMPRESSIONS, compress
+
+try:
+    import resource  # нет в Windows
+except ImportError:
+    resource = None
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+# метрики, для которых при сравнении больше - значит хуже
+_LOWER_IS_BETTER = ('_s', '_ms', '_kib')
+
+# во сколько раз запись (mkdir, cp) в крупную директорию может быть медленнее записи
+# в маленькую: новая версия дерева копирует части директории, а не всех её детей
+LARGE_DIR_MAX_RATIO = 20
+
+
+def _dir_name(index: int) -> str:
+    return f"d{index}"
+
+
+def _file_name(index: int) -> str:
+    return f"f{index}.txt"
+
+
+def make_payload(size: int, seed: int) -> str:
+    # детерминированный многострочный текст примерно заданного размера в байтах
+    rng = random.Random(seed)
+    words = ('alpha', 'beta', 'gamma', 'delta', 'omega', 'данные', 'строка', 'файл')
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        total += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines)
+
+
+def generate_vfs_xml(path: str, depth: int, fanout: int, files_per_dir: int,
+                     payload_size: int, encoding: str = 'base64', seed: int = 0) -> Dict[str, int]:
+    # пишет образ потоково: в каждом каталоге files_per_dir файлов и, пока не
+    # достигнута глубина depth, fanout подкаталогов. возвращает число узлов
+    payloads = []
+    for i in range(min(files_per_dir, 16) or 1):
+        text = make_payload(payload_size, seed + i)
+        if encoding == 'base64':
+            payloads.append(base64.b64encode(text.encode('utf-8')).decode('ascii'))
+        elif encoding in COMPRESSIONS:
+            payloads.append(base64.b64encode(compress(text.encode('utf-8'), encoding)).decode('ascii'))
+        else:
+            payloads.append(text.replace('&', '&amp;').replace('<', '&lt;'))
+
+    compression = f' compression="{encoding}"' if encoding in COMPRESSIONS else ''
+    counts = {'dirs': 0, 'files': 0, 'payload_bytes': 0}
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<vfs name="bench_vfs">\n')
+        # явный стек вместо рекурсии: глубина дерева не ограничена стеком Python
+        stack = [('open', 0, 0)]
+        while stack:
+            action, level, index = stack.pop()
+            indent = '    ' * (level + 1)
+            if action == 'close':
+                out.write(f'{indent}</dir>\n')
+                continue
+            if level:
+                out.write(f'{indent}<dir name="{_dir_name(index)}">\n')
+                counts['dirs'] += 1
+                stack.append(('close', level, index))
+            for i in range(files_per_dir):
+                payload = payloads[i % len(payloads)]
+                out.write(f'{indent}    <file name="{_file_name(i)}"{compression}>{payload}</file>\n')
+                counts['files'] += 1
+                counts['payload_bytes'] += len(payload)
+            if level < depth:
+                for i in reversed(range(fanout)):
+                    stack.append(('open', level + 1, i))
+        out.write('</vfs>\n')
+    return counts
+
+
+def _random_dir(rng: random.Random, depth: int, fanout: int) -> str:
+    if not depth or not fanout:
+        return '/'
+    level = rng.randint(1, depth)
+    return '/' + '/'.join(_dir_name(rng.randrange(fanout)) for _ in range(level))
+
+
+def _random_file(rng: random.Random, depth: int, fanout: int, files_per_dir: int) -> str:
+    directory = _random_dir(rng, depth, fanout)
+    return directory.rstrip('/') + '/' + _file_name(rng.randrange(files_per_dir))
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    # ближайший ранг по отсортированной выборке
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000 if samples else 0.0,
+        'p50_ms': _percentile(samples, 50) * 1000,
+        'p95_ms': _percentile(samples, 95) * 1000,
+        'max_ms': max(samples) * 1000 if samples else 0.0,
+    }
+
+
+def _timed(func: Callable[[], object]) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def bench_load(xml_path: str, cache_budget: int) -> Dict[str, float]:
+    # холодный разбор XML, затем загрузка из только что записанного снимка
+    snapshot = xml_path + '.snap'
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+    result = {
+        'xml_s': _timed(lambda: VFSManager(xml_path, cache_budget, use_snapshot=False)),
+        'xml_and_snapshot_write_s': _timed(lambda: VFSManager(xml_path, cache_budget)),
+        'snapshot_s': _timed(lambda: VFSManager(xml_path, cache_budget)),
+    }
+    # пик памяти Python при разборе XML замеряется отдельно: tracemalloc замедляет работу
+    tracemalloc.start()
+    try:
+        VFSManager(xml_path, cache_budget, use_snapshot=False)
+        result['xml_peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def bench_commands(handler: CommandHandler, shape: Dict[str, int], iterations: int,
+                   seed: int) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(seed)
+    depth, fanout, files = shape['depth'], shape['fanout'], shape['files']
+    samples: Dict[str, List[float]] = {name: [] for name in ('cd', 'ls', 'cat', 'cp', 'mkdir', 'find')}
+    # отдельный генератор: пути остальных команд совпадают с прежними прогонами
+    find_rng = random.Random(seed + 1)
+
+    def run(name: str, line: str) -> None:
+        started = time.perf_counter()
+        output = handler.execute(line)
+        samples[name].append(time.perf_counter() - started)
+        if output.startswith('Ошибка'):
+            raise RuntimeError(f"{line}: {output.strip()}")
+
+    for i in range(iterations):
+        run('cd', f'cd {_random_dir(rng, depth, fanout)}')
+        run('ls', 'ls')
+        run('mkdir', f'mkdir /bench_mkdir/{i}/a/b')
+        if files:
+            source = _random_file(rng, depth, fanout, files)
+            run('cat', f'cat {source}')
+            run('cp', f'cp {source} /bench_mkdir/{i}/copy.txt')
+            run('find', f'find {_random_dir(find_rng, depth, fanout)} '
+                        f'-name {_file_name(find_rng.randrange(files))}')
+    return {name: _latency(values) for name, values in samples.items() if values}
+
+
+def bench_script(handler: CommandHandler, shape: Dict[str, int], lines: int,
+                 seed: int, workdir: str) -> Dict[str, float]:
+    # смешанный скрипт только из чтений, чтобы прогон не менял дерево
+    rng = random.Random(seed)
+    depth, fanout, files = shape['depth'], shape['fanout'], shape['files']
+    script_path = os.path.join(workdir, 'bench_script.txt')
+    with open(script_path, 'w', encoding='utf-8') as script:
+        for _ in range(lines):
+            kind = rng.randrange(4)
+            if kind == 0 or not files:
+                script.write(f'cd {_random_dir(rng, depth, fanout)}\n')
+            elif kind == 1:
+                script.write('ls\n')
+            elif kind == 2:
+                script.write('pwd\n')
+            else:
+                script.write(f'cat {_random_file(rng, depth, fanout, files)}\n')
+
+    started = time.perf_counter()
+    executed, errors = handler.execute_script(script_path)
+    elapsed = time.perf_counter() - started
+    return {
+        'commands': len(executed),
+        'errors': len(errors),
+        'elapsed_s': elapsed,
+        'commands_per_s': len(executed) / elapsed if elapsed else 0.0,
+    }
+
+
+def bench_concurrency(handler: CommandHandler, shape: Dict[str, int], thread_counts: List[int],
+                      duration: float, seed: int) -> Dict[str, object]:
+    # T потоков-читателей (cd, ls, cat в своих сессиях) и один писатель (mkdir, cp) над
+    # общей VFS в течение duration секунд для каждого T. при GIL чтения на чистом Python
+    # выполняются по очереди и суммарная пропускная способность растёт слабо; важно, что
+    # она не падает с писателем: читатели не берут его замок
+    depth, fanout, files = shape['depth'], shape['fanout'], shape['files']
+    results: Dict[str, object] = {
+        'gil_enabled': getattr(sys, '_is_gil_enabled', lambda: True)(),
+    }
+    for threads in thread_counts:
+        stop = threading.Event()
+        samples: List[List[float]] = [[] for _ in range(threads)]
+        writes = [0]
+        failures: List[str] = []
+
+        def read_loop(num: int) -> None:
+            rng = random.Random(seed * 1000 + num)
+            reader = CommandHandler(vfs=handler.vfs, context=SessionContext(f"reader{num}"))
+            lines = []
+            while not stop.is_set():
+                if not lines:
+                    lines = [f'cd {_random_dir(rng, depth, fanout)}', 'ls']
+                    if files:
+                        lines.append(f'cat {_random_file(rng, depth, fanout, files)}')
+                line = lines.pop()
+                started = time.perf_counter()
+                output = reader.execute(line)
+                samples[num].append(time.perf_counter() - started)
+                if output.startswith('Ошибка'):
+                    failures.append(f"{line}: {output.strip()}")
+                    return
+
+        def write_loop() -> None:
+            rng = random.Random(seed)
+            writer = CommandHandler(vfs=handler.vfs, context=SessionContext('writer'))
+            while not stop.is_set():
+                target = f'/bench_mvcc/{threads}/{writes[0]}'
+                output = writer.execute(f'mkdir {target}')
+                if files and not output.startswith('Ошибка'):
+                    output = writer.execute(
+                        f'cp {_random_file(rng, depth, fanout, files)} {target}/copy.txt')
+                if output.startswith('Ошибка'):
+                    failures.append(output.strip())
+                    return
+                writes[0] += 1
+
+        workers = [threading.Thread(target=read_loop, args=(num,)) for num in range(threads)]
+        workers.append(threading.Thread(target=write_loop))
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        time.sleep(duration)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        if failures:
+            raise RuntimeError(failures[0])
+
+        reads = [value for values in samples for value in values]
+        results[f'threads_{threads}'] = dict(
+            _latency(reads),
+            reads_per_s=len(reads) / elapsed,
+            writes_per_s=writes[0] / elapsed,
+        )
+    return results
+
+
+def bench_large_dir(workdir: str, entries: int, writes: int) -> Dict[str, object]:
+    # mkdir и cp в директорию из entries файлов и в пустую директорию. первая запись в
+    # крупную директорию замеряется отдельно: она один раз делит детей на части.
+    # запись в крупную директорию, заметно более медленная, чем в маленькую, - ошибка
+    xml_path = os.path.join(workdir, 'large_dir.xml')
+    with open(xml_path, 'w', encoding='utf-8') as out:
+        out.write('<vfs name="large_dir">\n    <file name="source.txt">text</file>\n'
+                  '    <dir name="small"></dir>\n    <dir name="large">\n')
+        for i in range(entries):
+            out.write(f'        <file name="{_file_name(i)}">text</file>\n')
+        out.write('    </dir>\n</vfs>\n')
+    vfs = VFSManager(xml_path, use_snapshot=False)
+    result: Dict[str, object] = {
+        'entries': entries,
+        'first_write_ms': _timed(lambda: vfs.mkdir('/large/first')) * 1000,
+    }
+    for directory in ('small', 'large'):
+        samples: Dict[str, List[float]] = {'mkdir': [], 'cp': []}
+        for i in range(writes):
+            for name, write in (('mkdir', lambda: vfs.mkdir(f'/{directory}/dir{i}')),
+                                ('cp', lambda: vfs.cp('/source.txt', f'/{directory}/copy{i}'))):
+                started = time.perf_counter()
+                output = write()
+                samples[name].append(time.perf_counter() - started)
+                if output:
+                    raise RuntimeError(output.strip())
+        result[directory] = {name: _latency(values) for name, values in samples.items()}
+    for name in ('mkdir', 'cp'):
+        ratio = result['large'][name]['mean_ms'] / max(result['small'][name]['mean_ms'], 1e-6)
+        if ratio > LARGE_DIR_MAX_RATIO:
+            raise RuntimeError(f"{name} в директорию из {entries} имён медленнее в {ratio:.0f} раз, "
+                               f"чем в пустую (допустимо {LARGE_DIR_MAX_RATIO})")
+    return result
+
+
+def _peak_rss_kib() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # в macOS ru_maxrss в байтах, в Linux - в КиБ
+    return peak / 1024 if sys.platform == 'darwin' else float(peak)
+
+
+def run_benchmarks(args) -> Dict[str, object]:
+    shape = {'depth': args.depth, 'fanout': args.fanout, 'files': args.files,
+             'payload_size': args.payload_size, 'encoding': args.encoding}
+    cache_budget = args.cache_budget * 1024 * 1024
+    with tempfile.TemporaryDirectory(prefix='vfs_bench_') as workdir:
+        xml_path = os.path.join(workdir, 'bench_vfs.xml')
+        started = time.perf_counter()
+        counts = generate_vfs_xml(xml_path, args.depth, args.fanout, args.files,
+                                  args.payload_size, args.encoding, args.seed)
+        generate_time = time.perf_counter() - started
+
+        results: Dict[str, object] = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'shape': shape,
+            'image': dict(counts, xml_bytes=os.path.getsize(xml_path),
+                          generate_s=generate_time),
+            'load': bench_load(xml_path, cache_budget),
+        }
+        handler = CommandHandler(xml_path, cache_budget)
+        results['script'] = bench_script(handler, shape, args.script_lines, args.seed, workdir)
+        results['commands'] = bench_commands(handler, shape, args.iterations, args.seed)
+        if args.large_dir:
+            results['large_dir'] = bench_large_dir(workdir, args.large_dir, args.iterations)
+        if args.threads:
+            results['concurrency'] = bench_concurrency(handler, shape, args.threads,
+                                                       args.concurrency_seconds, args.seed)
+        results['peak_rss_kib'] = _peak_rss_kib()
+    return results
+
+
+def _flatten(data: object, prefix: str = '') -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix] = float(data)
+    return flat
+
+
+def compare_results(baseline: Dict[str, object], current: Dict[str, object],
+                    threshold: float) -> List[str]:
+    # сравнивает метрики времени и памяти; возвращает строки отчёта,
+    # регрессии (хуже порога) помечены префиксом REGRESSION
+    old, new = _flatten(baseline), _flatten(current)
+    report = []
+    for key in sorted(old.keys() & new.keys()):
+        if not key.endswith(_LOWER_IS_BETTER) and not key.endswith('_per_s'):
+            continue
+        before, after = old[key], new[key]
+        if not before:
+            continue
+        ratio = after / before
+        worse = ratio > threshold if key.endswith(_LOWER_IS_BETTER) else ratio < 1 / threshold
+        # максимум - единичный выброс, он показывается, но регрессией не считается
+        worse = worse and not key.endswith('max_ms')
+        mark = 'REGRESSION ' if worse else ''
+        report.append(f"{mark}{key}: {before:.4g} -> {after:.4g} (x{ratio:.2f})")
+    return report
+
+
+def _thread_counts(text: str) -> List[int]:
+    try:
+        counts = [int(part) for part in text.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидаются числа через запятую: {text}")
+    if any(count < 1 for count in counts):
+        raise argparse.ArgumentTypeError(f"число потоков должно быть положительным: {text}")
+    return counts
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки эмулятора на синтетическом образе VFS')
+    parser.add_argument('--depth', type=int, default=3,
+                      help='Глубина дерева каталогов')
+    parser.add_argument('--fanout', type=int, default=4,
+                      help='Число подкаталогов в каждом каталоге')
+    parser.add_argument('--files', type=int, default=5,
+                      help='Число файлов в каждом каталоге')
+    parser.add_argument('--payload-size', type=int, default=1024,
+                      help='Размер содержимого файла в байтах (до кодирования)')
+    parser.add_argument('--encoding', choices=('base64', 'text') + COMPRESSIONS, default='base64',
+                      help='Кодировка содержимого файлов в образе (zlib, lzma, bz2 - сжатое в base64)')
+    parser.add_argument('--iterations', type=int, default=200,
+                      help='Число повторов каждой команды при замере задержки')
+    parser.add_argument('--script-lines', type=int, default=5000,
+                      help='Число строк в скрипте для замера execute_script')
+    parser.add_argument('--threads', type=_thread_counts, default=[1, 2, 4, 8],
+                      help='Числа потоков-читателей для замера чтения при записи, через запятую '
+                           '(пусто - не замерять)')
+    parser.add_argument('--large-dir', type=int, default=100000,
+                      help='Число имён в директории для замера mkdir и cp в неё (0 - не замерять)')
+    parser.add_argument('--concurrency-seconds', type=float, default=1.0,
+                      help='Длительность замера для каждого числа потоков (с)')
+    parser.add_argument('--cache-budget', type=int, default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+                      help='Бюджет кеша содержимого файлов в МиБ')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Зерно генератора случайных путей и содержимого')
+    parser.add_argument('--output', type=str, default=None,
+                      help='Записать результат в JSON-файл (по умолчанию - в stdout)')
+    parser.add_argument('--compare', type=str, default=None,
+                      help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                      help='Во сколько раз метрика может ухудшиться без регрессии')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_arguments(argv)
+    results = run_benchmarks(args)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+    if not args.compare:
+        return EXIT_OK
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    report = compare_results(baseline, results, args.threshold)
+    for line in report:
+        print(line, file=sys.stderr)
+    return EXIT_REGRESSION if any(line.startswith('REGRESSION') for line in report) else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import math
+from typing import Dict
+
+# гистограмма задержек: логарифмические корзины, 4 на каждое удвоение времени,
+# поэтому процентиль известен с точностью около 19% при постоянной памяти
+BUCKETS_PER_OCTAVE = 4
+MIN_LATENCY = 1e-6  # всё быстрее микросекунды попадает в первую корзину
+
+
+class LatencyHistogram:
+    # счётчики по корзинам вместо списка замеров: память не растёт с числом вызовов
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        if seconds > MIN_LATENCY:
+            bucket = math.ceil(math.log2(seconds / MIN_LATENCY) * BUCKETS_PER_OCTAVE)
+        else:
+            bucket = 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        # верхняя граница корзины, в которую попадает q-й процентиль (не больше максимума)
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(MIN_LATENCY * 2 ** (bucket / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+
+class CommandStats:
+    # статистика по командам: вызовы, ошибки, байты вывода (UTF-8) и задержки
+
+    def __init__(self):
+        self._latency: Dict[str, LatencyHistogram] = {}
+        self._calls: Dict[str, Dict[str, int]] = {}
+
+    def record(self, name: str, seconds: float, output_bytes: int, error: bool) -> None:
+        histogram = self._latency.get(name)
+        if histogram is None:
+            histogram = self._latency[name] = LatencyHistogram()
+            self._calls[name] = {'errors': 0, 'bytes': 0}
+        histogram.record(seconds)
+        calls = self._calls[name]
+        calls['bytes'] += output_bytes
+        if error:
+            calls['errors'] += 1
+
+    def reset(self) -> None:
+        self._latency.clear()
+        self._calls.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name in sorted(self._latency):
+            histogram = self._latency[name]
+            result[name] = {
+                'count': histogram.count,
+                'errors': self._calls[name]['errors'],
+                'bytes': self._calls[name]['bytes'],
+                'total_ms': histogram.total * 1000,
+                'p50_ms': histogram.percentile(50) * 1000,
+                'p95_ms': histogram.percentile(95) * 1000,
+                'p99_ms': histogram.percentile(99) * 1000,
+                'max_ms': histogram.max * 1000,
+            }
+        return result
@@ -0,0 +1,88 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+# бюджет кеша декодированного содержимого по умолчанию
+DEFAULT_CACHE_BUDGET = 64 * 1024 * 1024
+
+
+class ContentCache:
+    # LRU-кеш декодированного содержимого файлов с ограничением по памяти.
+    # размер записи считается через sys.getsizeof, т.е. реальным объёмом объекта.
+    # кеш общий для потоков-читателей VFS. попадание не берёт замок: get и move_to_end
+    # атомарны сами по себе, а значение записи, вытесненной между ними, всё равно верно.
+    # добавление и вытеснение (несколько шагов со счётчиком объёма) - под замком
+
+    def __init__(self, budget_bytes: int = DEFAULT_CACHE_BUDGET):
+        if budget_bytes < 0:
+            raise ValueError("Бюджет кеша не может быть отрицательным")
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        # возвращает значение и помечает его как недавно использованное
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = sys.getsizeof(value)
+        if size > self.budget_bytes:
+            # объект больше всего бюджета - не кешируем
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= sys.getsizeof(old)
+
+            self._entries[key] = value
+            self.used_bytes += size
+
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        # проверка без влияния на порядок вытеснения и счётчики
+        return key in self._entries
+
+    def discard(self, keys: Iterable[Hashable]) -> None:
+        # удаляет записи по ключам (содержимое выгруженного образа)
+        with self._lock:
+            for key in keys:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.used_bytes -= sys.getsizeof(old)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'used_bytes': self.used_bytes,
+            'budget_bytes': self.budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
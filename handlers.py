@@ -1,26 +1,132 @@
+import json
 import os
 import re
-from typing import List, Tuple
+import time
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from vfs import VFSManager
+from vfs_mount import DEFAULT_MOUNT_BUDGET
+from content_cache import DEFAULT_CACHE_BUDGET
+from shell_parser import parse_cache_info, parse_command
+from command_stats import CommandStats
+from session import SessionContext
+
+# имена в статистике для строк, которые не дошли до обработчика
+UNKNOWN_COMMAND = '<unknown>'
+PARSE_ERROR = '<parse-error>'
+
+# сколько вариантов дополнения по Tab показывается списком
+COMPLETION_LIST_LIMIT = 100
+
+# сколько символов строк grep собирает в один блок вывода
+GREP_CHUNK_SIZE = 64 * 1024
+
+# символы, которые экранируются в подставленном дополнением имени
+_COMPLETION_ESCAPE_RE = re.compile(r'([\\$"\' \t|*?\[])')
+_COMPLETION_UNESCAPE_RE = re.compile(r'\\(.)')
+_COMPLETION_WORD_RE = re.compile(r'(?:\\.|[^\s\\])*\Z')
+
+# escape-последовательности команды echo, обрабатываются за один проход
+_ECHO_ESCAPES = {'n': '\n', 't': '\t', '\\': '\\'}
+_ECHO_ESCAPE_RE = re.compile(r'\\([nt\\])')
+
+
+class CommandError(Exception):
+    # ошибка команды; текст исключения - готовое сообщение для вывода
+    pass
+
+
+class CommandStream:
+    # вывод команды блоками и её итог. failed известен, когда вывод прочитан до конца:
+    # об ошибке сообщает сама команда (CommandError), а не текст вывода, поэтому вывод,
+    # который начинается со слова "Ошибка" (echo, grep по логу), ошибкой не считается.
+    # сообщение об ошибке - последний блок вывода
+
+    def __init__(self):
+        self.failed = False
+        self.chunks: Iterator[str] = iter(())
+
+    def __iter__(self) -> 'CommandStream':
+        return self
+
+    def __next__(self) -> str:
+        return next(self.chunks)
+
+
+def split_pieces(chunks: Iterable[str]) -> Iterator[List[str]]:
+    # режет поток текста на строки так же, как str.split('\n') режет весь текст,
+    # но отдаёт их пачками по блоку и не держит в памяти больше одного блока.
+    # как и у grep (VFSManager._matching_lines), перевод строки в конце потока
+    # завершает последнюю строку, а не начинает пустую
+    tail = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pieces = (tail + chunk).split('\n')
+        tail = pieces.pop()
+        if pieces:
+            yield pieces
+    if tail:
+        yield [tail]
+
+
+def join_lines(lines: Iterable[str], chunk_size: int = GREP_CHUNK_SIZE) -> Iterator[str]:
+    # строки (без перевода строки) блоками примерно по chunk_size символов:
+    # вывод идёт по мере поступления строк, но не по одной строке на блок
+    block: List[str] = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield '\n'.join(block) + "\n"
+            block = []
+            size = 0
+    if block:
+        yield '\n'.join(block) + "\n"
+
+
+class ScriptEvent(NamedTuple):
+    # результат выполнения одной строки скрипта
+    line_num: int          # номер строки (0 - ошибка до начала выполнения)
+    command: str
+    output: str
+    error: Optional[str]
+    elapsed: float         # время выполнения команды в секундах
+    cwd: str               # текущая директория до выполнения (для промпта)
+    chunks: Optional[CommandStream] = None  # вывод блоками (iter_commands с stream=True)
 
 
 class CommandHandler:
-    def __init__(self, vfs_xml_path: str):
+    def __init__(self, vfs_xml_path: Optional[str] = None, cache_budget: int = DEFAULT_CACHE_BUDGET,
+                 use_snapshot: bool = True, journal: bool = False, content_index: bool = False,
+                 vfs: Optional[VFSManager] = None, context: Optional[SessionContext] = None,
+                 mount_budget: int = DEFAULT_MOUNT_BUDGET):
         
         # инициализация обработчика команд с поддержкой VFS.
+        # с vfs - сессия поверх уже загруженной общей VFS (сервер): у каждой сессии
+        # свой контекст (текущая директория, история) и своя статистика команд
         
-        try:
-            self.vfs = VFSManager(vfs_xml_path)
-        except (FileNotFoundError, ValueError) as e:
-            raise RuntimeError(f"Ошибка загрузки VFS: {e}")
+        if vfs is None:
+            try:
+                vfs = VFSManager(vfs_xml_path, cache_budget, use_snapshot, journal, content_index,
+                                 mount_budget)
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"Ошибка загрузки VFS: {e}")
+        self.vfs = vfs
+        self.context = context or SessionContext()
+        self.vfs.context = self.context
 
-        self.history = []
+        self.stats = CommandStats()
         self.command_handlers = {
             'exit': self._handle_exit,
             'ls': self._handle_ls,
             'cd': self._handle_cd,
             'help': self._handle_help,
             'vfs-info': self._handle_vfs_info,
+            'vfs-compact': self._handle_vfs_compact,
+            'vfs-diff': self._handle_vfs_diff,
+            'cache-info': self._handle_cache_info,
             'pwd': self._handle_pwd,
             'cat': self._handle_cat,
             'tac': self._handle_tac,      # новая команда 4
@@ -28,225 +134,668 @@ class CommandHandler:
             'mkdir': self._handle_mkdir,  # Новая команда 5 
             'cp': self._handle_cp,       # Новая команда 5
             'echo': self._handle_echo,    # Новая команда 5
+            'stats': self._handle_stats,
+            'history': self._handle_history,
+            'find': self._handle_find,
+            'grep': self._handle_grep,
+            'mount': self._handle_mount,
+        }
+        # команды-фильтры: читают и выдают поток текста, поэтому работают в конвейерах
+        self.stream_handlers = {
+            'cat': self._stream_cat,
+            'tac': self._stream_tac,
+            'rev': self._stream_rev,
+            'grep': self._stream_grep,
+            'ls': self._stream_ls,
         }
 
-    def execute_script(self, script_path: str) -> Tuple[List[str], List[str]]:
-        executed_commands = []
-        errors = []
-        
+    @property
+    def history(self):
+        return self.context.history
+
+    def _activate(self) -> None:
+        # общая VFS выполняет команды от имени этой сессии
+        self.vfs.context = self.context
+
+    def current_path(self) -> str:
+        self._activate()
+        return self.vfs.get_current_path_str()
+
+    def _failure(self, message: str, line_num: int = 0, command: str = "") -> ScriptEvent:
+        return ScriptEvent(line_num, command, "", message, 0.0, self.current_path())
+
+    def iter_commands(self, lines: Iterable[str], stream: bool = False) -> Iterator[ScriptEvent]:
+        # выполняет команды из любого источника строк (файл, stdin) ровно один раз,
+        # выдавая события по мере выполнения.
+        # stream=True: вывод не собирается в строку - событие выдаётся до выполнения,
+        # а команда выполняется, пока читают event.chunks (до следующего события);
+        # output и elapsed у такого события пустые
+        for line_num, line in enumerate(lines, 1):
+            command = line.strip()
+            
+            # пропускаем пустые строки и комментарии
+            if not command or command.startswith('#'):
+                continue
+            
+            cwd = self.current_path()
+            if stream:
+                finished = []
+                yield ScriptEvent(line_num, command, "", None, 0.0, cwd,
+                                  self._stream_command(command, line_num, finished))
+                if finished:
+                    break
+                continue
+
+            started = time.perf_counter()
+            try:
+                # используем тот же execute(), что и в интерактивном режиме
+                result = self.execute(command)
+            except Exception as e:
+                yield self._failure(f"Строка {line_num}: {str(e)}", line_num, command)
+                continue
+
+            yield ScriptEvent(line_num, command, result, None,
+                              time.perf_counter() - started, cwd)
+            
+            # если команда завершает работу — прерываем скрипт
+            if result == "EXIT_TERMINAL":
+                break
+
+    def _stream_command(self, command: str, line_num: int, finished: List[bool]) -> CommandStream:
+        # вывод команды скрипта блоками; finished - команда завершает работу (exit)
+        stream = CommandStream()
+
+        def run() -> Iterator[str]:
+            try:
+                chunks = self.execute_stream(command)
+                for chunk in chunks:
+                    if chunk == "EXIT_TERMINAL":
+                        finished.append(True)
+                    yield chunk
+                stream.failed = chunks.failed
+            except Exception as e:
+                stream.failed = True
+                yield f"Ошибка: строка {line_num}: {e}\n"
+
+        stream.chunks = run()
+        return stream
+
+    def iter_script(self, script_path: str, stream: bool = False) -> Iterator[ScriptEvent]:
+        # лениво читает скрипт построчно и выполняет его через iter_commands
         if not script_path:
-            errors.append("Путь к скрипту не указан")
-            return executed_commands, errors
+            yield self._failure("Путь к скрипту не указан")
+            return
             
         if not os.path.exists(script_path):
-            errors.append(f"Скрипт '{script_path}' не найден")
-            return executed_commands, errors
+            yield self._failure(f"Скрипт '{script_path}' не найден")
+            return
         
         if not os.path.isfile(script_path):
-            errors.append(f"'{script_path}' не является файлом")
-            return executed_commands, errors
+            yield self._failure(f"'{script_path}' не является файлом")
+            return
             
         try:
             with open(script_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            for line_num, line in enumerate(lines, 1):
-                command = line.strip()
-                
-                # пропускаем пустые строки и комментарии
-                if not command or command.startswith('#'):
-                    continue
-                
-                try:
-                    # используем тот же execute(), что и в интерактивном режиме
-                    result = self.execute(command)
-                    executed_commands.append(command)
-                    
-                    # если команда завершает работу — прерываем скрипт
-                    if result == "EXIT_TERMINAL":
-                        break
+                yield from self.iter_commands(f, stream)
                         
-                except Exception as e:
-                    error_msg = f"Строка {line_num}: {str(e)}"
-                    errors.append(error_msg)
-                    
         except UnicodeDecodeError:
-            errors.append(f"Ошибка кодировки файла '{script_path}'. Используйте UTF-8")
+            yield self._failure(f"Ошибка кодировки файла '{script_path}'. Используйте UTF-8")
         except Exception as e:
-            errors.append(f"Ошибка чтения скрипта: {str(e)}")
-            
+            yield self._failure(f"Ошибка чтения скрипта: {str(e)}")
+
+    def execute_script(self, script_path: str) -> Tuple[List[str], List[str]]:
+        # выполняет скрипт целиком; возвращает выполненные команды и ошибки
+        executed_commands = []
+        errors = []
+        for event in self.iter_script(script_path):
+            if event.error:
+                errors.append(event.error)
+            else:
+                executed_commands.append(event.command)
         return executed_commands, errors
 
-    def expand_environment_variables(self, text: str) -> str:
-        if not text:
-            return text
+    def execute(self, command: str) -> str:
+        return ''.join(self.execute_stream(command))
 
-        def replace_var(match: re.Match) -> str:
-            var_name = match.group(1) or match.group(2)
-            if value := os.environ.get(var_name):
-                return value
-            raise ValueError(f"Переменная окружения ${var_name} не найдена")
+    def execute_stream(self, command: str) -> CommandStream:
+        # выполняет команду или конвейер (cmd1 | cmd2 ...) и отдаёт вывод блоками;
+        # команда работает, пока вывод читают, её итог - в failed
+        stream = CommandStream()
+        if not (clean_cmd := command.strip()):
+            return stream
 
-        pattern = r'\$([A-Za-z_]\w*)|\$\{([A-Za-z_]\w*)\}'
-        return re.sub(pattern, replace_var, text)
+        started = time.perf_counter()
+        self.context.history.append(clean_cmd)
+        self._activate()
+        name, start = self._dispatch(clean_cmd)
+        stream.chunks = self._measure(name, self._in_context(self._guard_stream(start, stream)),
+                                      started, stream)
+        return stream
 
-    def execute(self, command: str) -> str:
-        if not (clean_cmd := command.strip()):
-            return ""
+    def _in_context(self, stream: Iterator[str]) -> Iterator[str]:
+        # потоковая команда работает, пока её вывод читают, а между блоками общая VFS
+        # могла выполнять команды других сессий - перед каждым блоком контекст
+        # этой сессии активируется снова
+        while True:
+            self._activate()
+            try:
+                chunk = next(stream)
+            except StopIteration:
+                return
+            yield chunk
+
+    def _command_name(self, cmd: str) -> str:
+        # имя для статистики: произвольные неизвестные команды не раздувают таблицу
+        if cmd in self.command_handlers or cmd in self.stream_handlers:
+            return cmd
+        return UNKNOWN_COMMAND
 
+    def _dispatch(self, clean_cmd: str) -> Tuple[str, Callable[[], Iterator[str]]]:
+        # имя команды для статистики и запуск её вывода; ошибка - CommandError при запуске
+        # или посреди вывода. разбор строки кешируется, переменные окружения
+        # подставляются при каждом выполнении
         try:
-            expanded_cmd = self.expand_environment_variables(clean_cmd).strip()
-            if not expanded_cmd:
-                return ""
+            parsed = parse_command(clean_cmd)
+            stages = parsed.expand(os.environ)
+            if parsed.glob_words:
+                stages = self._expand_globs(parsed, stages)
         except ValueError as e:
-            return f"Ошибка: {e}\n"
+            return PARSE_ERROR, partial(self._fail, f"Ошибка: {e}\n")
 
-        parts = expanded_cmd.split()
-        if not parts:
-            return ""
+        if len(stages) > 1:
+            name = ' | '.join(self._command_name(parts[0]) for parts in stages)
+            return name, lambda: self._pipeline(stages)
 
+        parts = stages[0]
         cmd = parts[0]
         args = parts[1:]
+        name = self._command_name(cmd)
 
+        if stream_handler := self.stream_handlers.get(cmd):
+            return name, lambda: stream_handler(args, None)
         if handler := self.command_handlers.get(cmd):
             if cmd == 'exit':
                 if args:
-                    return "Ошибка: команда exit не принимает аргументов\n"
-                return handler()
+                    return name, partial(self._fail, "Ошибка: команда exit не принимает аргументов\n")
+                return name, lambda: iter((handler(),))
+            return name, lambda: iter((handler(args),))
+        return name, partial(self._fail, f"Ошибка: неизвестная команда '{cmd}'\n")
+
+    @staticmethod
+    def _fail(message: str) -> Iterator[str]:
+        raise CommandError(message)
+
+    def _expand_globs(self, parsed, stages: List[List[str]]) -> List[List[str]]:
+        # слова-шаблоны вне кавычек заменяются совпавшими путями VFS; шаблон без
+        # совпадений остаётся как есть, как в shell
+        expanded = [list(stage) for stage in stages]
+        # с конца: замена слова списком путей не сдвигает ещё не обработанные позиции
+        for stage, word in reversed(parsed.glob_words):
+            paths = self.vfs.glob(parsed.glob_pattern(stage, word, os.environ))
+            if paths:
+                expanded[stage][word:word + 1] = paths
+        return expanded
+
+    def complete(self, line: str) -> Tuple[int, str, List[str], int]:
+        # дополнение по Tab для строки ввода до курсора: (начало дополняемого слова,
+        # замена слова, варианты для показа, всего вариантов). первое слово стадии
+        # дополняется именами команд, остальные - путями VFS
+        self._activate()
+        word = _COMPLETION_WORD_RE.search(line).group()
+        start = len(line) - len(word)
+        before = line[:start].rstrip()
+        raw = _COMPLETION_UNESCAPE_RE.sub(r'\1', word)
+        if not before or before.endswith('|'):
+            commands = sorted(name for name in self.command_handlers.keys() | self.stream_handlers.keys()
+                              if name.startswith(raw))
+            if not commands:
+                return start, word, [], 0
+            if len(commands) == 1:
+                return start, commands[0] + ' ', commands, 1
+            return start, os.path.commonprefix(commands), commands[:COMPLETION_LIST_LIMIT], len(commands)
+        common, shown, total = self.vfs.complete(raw, COMPLETION_LIST_LIMIT)
+        replacement = _COMPLETION_ESCAPE_RE.sub(r'\\\1', common)
+        if total == 1 and not common.endswith('/'):
+            replacement += ' '
+        return start, replacement, shown, total
+
+    def _measure(self, name: str, chunks: Iterator[str], started: float,
+                 stream: CommandStream) -> Iterator[str]:
+        # задержка считается до конца вывода: потоковые команды работают, пока их читают
+        output_bytes = 0
+        try:
+            for chunk in chunks:
+                output_bytes += len(chunk.encode('utf-8'))
+                yield chunk
+        finally:
+            self.stats.record(name, time.perf_counter() - started, output_bytes, stream.failed)
+
+    def get_stats(self) -> dict:
+        # все счётчики сеанса: команды, VFS, кеш содержимого и кеш разбора
+        return {
+            'commands': self.stats.stats(),
+            'vfs': self.vfs.get_stats(),
+            'content_cache': self.vfs.get_content_cache_stats(),
+            'parse_cache': parse_command.cache_info()._asdict(),
+        }
+
+    @staticmethod
+    def _guard_stream(start: Callable[[], Iterator[str]],
+                      stream: Optional[CommandStream] = None) -> Iterator[str]:
+        # ошибка команды (в том числе посреди вывода) становится последним блоком
+        # и отмечается в stream
+        try:
+            yield from start()
+            return
+        except CommandError as e:
+            message = str(e)
+        except Exception as e:
+            message = f"Ошибка: {e}\n"
+        if stream is not None:
+            stream.failed = True
+        yield message
+
+    def _pipeline(self, stages: List[List[str]]) -> Iterator[str]:
+        # связывает стадии ленивыми итераторами: данные идут блоками от стадии к стадии
+        stream = None
+        for parts in stages:
+            cmd = parts[0]
+            args = parts[1:]
+            if stream_handler := self.stream_handlers.get(cmd):
+                stream = stream_handler(args, stream)
+            elif cmd == 'exit':
+                raise CommandError("Ошибка: команда exit не может быть частью конвейера\n")
+            elif handler := self.command_handlers.get(cmd):
+                # обычная команда не читает вход и выдаёт весь результат одним блоком
+                result = handler(args)
+                stream = iter((result,) if result else ())
             else:
-                return handler(args)
-        else:
-            return f"Ошибка: неизвестная команда '{cmd}'\n"
+                raise CommandError(f"Ошибка: неизвестная команда '{cmd}'\n")
+        return stream
+
+    def _text_source(self, name: str, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
+        # источник текста фильтра: файл из аргумента или вывод предыдущей стадии
+        if not args and stdin is not None:
+            return stdin
+        if not args:
+            raise CommandError(f"Ошибка: команда {name} требует хотя бы один аргумент (имя файла)\n")
+        return self._file_chunks(args)
+
+    def _file_chunks(self, paths: List[str]) -> Iterator[str]:
+        # содержимое нескольких файлов подряд, как у cat; каждый файл открывается
+        # только после того, как прочитан предыдущий. файл, как и вывод cat, завершается
+        # переводом строки, поэтому последняя строка не склеивается с первой строкой следующего
+        last = "\n"
+        for path in paths:
+            if not last.endswith('\n'):
+                yield "\n"
+                last = "\n"
+            try:
+                chunks = self.vfs.iter_file_chunks(path)
+            except Exception as e:
+                raise CommandError(f"Ошибка: {e}\n")
+            for chunk in chunks:
+                if chunk:
+                    last = chunk
+                    yield chunk
 
     def _handle_exit(self) -> str:
         return "EXIT_TERMINAL"
     
     def _handle_ls(self, args: List[str]) -> str:
-        if len(args) > 1:
-            return "Ошибка: команда ls принимает не более одного аргумента (путь)\n"
-        
-        try:
-            if args:
-                # сохраняет текущий путь
-                original_path = self.vfs._current_path.copy()
-                
-                # пробует перейти по указанному пути
-                result = self.vfs.cd(args[0])
-                if result:  # Если ошибка - возвращаем её
-                    return result
-                
-                # получаетм список файлов
-                ls_result = self.vfs.ls()
-                
-                # возвращается обратно
-                self.vfs._current_path = original_path
-                return ls_result
+        return ''.join(self._stream_ls(args, None))
+
+    def _stream_ls(self, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
+        # ls [-R] [--limit N] [--after имя] [путь ...]; вход конвейера не читает
+        recursive = False
+        limit = after = None
+        paths = []
+        pos = 0
+        while pos < len(args):
+            arg = args[pos]
+            if arg == '-R':
+                recursive = True
+            elif arg in ('--limit', '--after'):
+                if pos + 1 == len(args):
+                    raise CommandError(f"Ошибка: параметр ls {arg} требует значение\n")
+                value = args[pos + 1]
+                pos += 1
+                if arg == '--after':
+                    after = value
+                elif value.isdigit() and int(value) > 0:
+                    limit = int(value)
+                else:
+                    raise CommandError(f"Ошибка: --limit ожидает положительное число: {value}\n")
             else:
-                # ls без аргументов = текущая директория
-                return self.vfs.ls()
-        except Exception as e:
-            return f"Ошибка при выполнении ls: {e}\n"
+                paths.append(arg)
+            pos += 1
+        if recursive and (limit is not None or after is not None):
+            raise CommandError("Ошибка: ls -R не совмещается с --limit и --after\n")
+
+        # ls без аргументов = текущая директория; несколько путей - с заголовками, как в ls
+        # (у ls -R заголовок есть у каждой директории)
+        for index, path in enumerate(paths or [None]):
+            header = ""
+            if len(paths) > 1:
+                header = ("\n" if index else "") + ("" if recursive else f"{path}:\n")
+            try:
+                if recursive:
+                    listing = self.vfs.iter_ls_recursive(path)
+                else:
+                    try:
+                        listing = iter((self.vfs.ls(path, limit, after),))
+                    except FileNotFoundError as e:
+                        raise CommandError(f"Ошибка: {e}\n")
+            except CommandError:
+                raise
+            except Exception as e:
+                raise CommandError(f"Ошибка при выполнении ls: {e}\n")
+            if header:
+                yield header
+            yield from listing
 
     def _handle_cd(self, args: List[str]) -> str:
         if len(args) == 0:
             # cd без аргументов -> корень VFS
-            return self.vfs.cd("/")
+            args = ["/"]
         if len(args) > 1:
-            return "Ошибка: команда cd принимает не более одного аргумента\n"
-        return self.vfs.cd(args[0])
+            raise CommandError("Ошибка: команда cd принимает не более одного аргумента\n")
+        # методы VFS, изменяющие состояние, возвращают пустую строку или сообщение об ошибке
+        if error := self.vfs.cd(args[0]):
+            raise CommandError(error)
+        return ""
 
     def _handle_help(self, args: List[str] = None) -> str:
         return """Доступные команды:
-ls                - список файлов и директорий в текущей папке
+ls [-R] [--limit N] [--after имя] [путь ...] - список файлов и директорий
+                    (-R - с поддиректориями, --limit/--after - постранично)
 cd <путь>         - перейти в директорию (поддерживает .. и /)
 pwd               - показать текущую директорию
-cat <файл>        - вывести содержимое файла
-tac <файл>        - вывести содержимое файла в обратном порядке строк
-rev <файл>        - перевернуть каждую строку файла задом наперёд
+cat <файл> ...    - вывести содержимое файлов подряд
+tac <файл> ...    - вывести содержимое файлов в обратном порядке строк
+rev <файл> ...    - перевернуть каждую строку файла задом наперёд
 mkdir <путь>      - создать новую директорию
 cp <src> <dest>   - скопировать файл
-vfs-info          - информация о загруженной VFS
+cp -r <src> <dest> - скопировать директорию (копия разделяет данные с источником)
+find [путь] [-name шаблон] [-type f|d] - найти файлы и директории по имени
+                    (шаблон - имя или glob: *, ?, [...]) и типу
+grep <шаблон> <путь> - строки, подходящие под регулярное выражение, в файле
+                    или во всех файлах директории (без пути - во входе конвейера)
+vfs-info [--hash] - информация о загруженной VFS (--hash - текущий хеш Меркла)
+vfs-diff <a.xml> [<b.xml>] - различия текущей VFS и образа (или двух образов):
+                    + добавлено, - удалено, M изменено
+vfs-compact       - записать текущее состояние VFS в XML-образ и очистить журнал
+mount [<xml> <путь>] - смонтировать XML-образ в директорию (только для чтения,
+                    образ разбирается при первом входе); без аргументов - таблица
+mount -u          - выгрузить загруженные смонтированные образы
+cache-info        - статистика кеша содержимого файлов
+stats [--json] [--reset] - задержки и объём вывода команд, счётчики VFS
+history [N]       - история команд сессии (последние N)
 help              - показать эту справку
+*, ?, [...]       - шаблоны имён вне кавычек раскрываются в пути VFS
+                    (cat /var/log/*.log); Tab дополняет команды и пути
+cmd1 | cmd2       - конвейер: вывод cmd1 передаётся на вход cmd2 (cat, tac, rev
+                    без аргумента и grep без пути читают вход)
 exit              - выйти из терминала
 """
 
     def _handle_vfs_info(self, args: List[str] = None) -> str:
-        if args:
-            return "Ошибка: команда vfs-info не принимает аргументов\n"
+        if args and args != ['--hash']:
+            raise CommandError("Ошибка: команда vfs-info принимает только параметр --hash\n")
         try:
-            return self.vfs.get_vfs_info()
+            return self.vfs.get_vfs_info(with_hash=bool(args))
         except Exception as e:
-            return f"Ошибка получения информации о VFS: {e}\n"
+            raise CommandError(f"Ошибка получения информации о VFS: {e}\n")
+
+    def _handle_vfs_diff(self, args: List[str]) -> str:
+        # сравнивает текущую VFS с XML-образом или два образа между собой
+        if len(args) not in (1, 2):
+            raise CommandError("Ошибка: команда vfs-diff требует один или два аргумента (пути к XML-образам)\n")
+        try:
+            # образ нужен только для сравнения: без снимка на диске и без индексов
+            images = [VFSManager(path, use_snapshot=False, index=False) for path in args]
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Ошибка загрузки образа: {e}\n")
+        old, new = (images[0], self.vfs) if len(images) == 1 else images
+        lines = [f"{status} {path}" for status, path in old.diff(new)]
+        if not lines:
+            return "Образы совпадают\n"
+        return '\n'.join(lines) + f"\nРазличий: {len(lines)}\n"
+
+    def _handle_vfs_compact(self, args: List[str] = None) -> str:
+        if args:
+            raise CommandError("Ошибка: команда vfs-compact не принимает аргументов\n")
+        try:
+            return self.vfs.compact()
+        except OSError as e:
+            raise CommandError(f"Ошибка: {e}\n")
+
+    def _handle_cache_info(self, args: List[str] = None) -> str:
+        if args:
+            raise CommandError("Ошибка: команда cache-info не принимает аргументов\n")
+        return self.vfs.get_cache_info() + parse_cache_info()
         
+    def _handle_stats(self, args: List[str] = None) -> str:
+        args = args or []
+        unknown = [arg for arg in args if arg not in ('--json', '--reset')]
+        if unknown:
+            raise CommandError(f"Ошибка: неизвестный параметр команды stats: {unknown[0]}\n")
+        if '--json' in args:
+            output = json.dumps(self.get_stats(), indent=2, ensure_ascii=False) + "\n"
+        else:
+            output = self._format_stats(self.get_stats())
+        if '--reset' in args:
+            self.stats.reset()
+        return output
+
+    @staticmethod
+    def _format_stats(stats: dict) -> str:
+        lines = ["Команда          вызовы ошибки      байты    p50 мс    p95 мс    p99 мс"]
+        for name, row in stats['commands'].items():
+            lines.append(f"{name:<16} {row['count']:>6} {row['errors']:>6} {row['bytes']:>10} "
+                         f"{row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+        vfs = stats['vfs']
+        lines.append(f"VFS load: {vfs['load_ms']:.1f} ms ({vfs['loaded_from']})")
+        lines.append(f"Nodes: {vfs['dirs']} dirs, {vfs['files']} files")
+        lines.append(f"Resolve: {vfs['resolve_calls']} calls, {vfs['resolve_cache_hits']} cache hits, "
+                     f"depth avg {vfs['resolve_depth_avg']:.1f}, max {vfs['resolve_depth_max']}")
+        mounts = vfs['mounts']
+        if mounts['mounts']:
+            lines.append(f"Mounts: {mounts['mounts']} ({mounts['loaded']} loaded, "
+                         f"{mounts['loaded_nodes']} nodes), loads {mounts['loads']}, "
+                         f"unloads {mounts['unloads']}")
+        return '\n'.join(lines) + "\n"
+
     def _handle_pwd(self, args: List[str] = None) -> str:
         if args:
-            return "Ошибка: команда pwd не принимает аргументов\n"
+            raise CommandError("Ошибка: команда pwd не принимает аргументов\n")
         return self.vfs.get_current_path_str() + "\n"
 
+    def _handle_history(self, args: List[str] = None) -> str:
+        # история команд сессии, history N - последние N
+        args = args or []
+        if len(args) > 1:
+            raise CommandError("Ошибка: использование: history [N]\n")
+        history = list(self.context.history)
+        first = 0
+        if args:
+            if not args[0].isdigit():
+                raise CommandError(f"Ошибка: history: ожидается число: {args[0]}\n")
+            first = max(0, len(history) - int(args[0]))
+        return ''.join(f"{num:>5}  {cmd}\n" for num, cmd in enumerate(history[first:], first + 1))
+
     def _handle_cat(self, args: List[str]) -> str:
-        if len(args) != 1:
-            return "Ошибка: команда cat требует ровно один аргумент (имя файла)\n"
-        
-        try:
-            content = self.vfs.read_file(args[0])
-            return content + ("\n" if not content.endswith('\n') else "")
-        except Exception as e:
-            return f"Ошибка: {e}\n"
+        return ''.join(self._stream_cat(args, None))
+
+    def _stream_cat(self, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
+        source = self._text_source('cat', args, stdin)
+        # вывод всегда завершается переводом строки
+        last = ""
+        for chunk in source:
+            if chunk:
+                last = chunk
+                yield chunk
+        if not last.endswith('\n'):
+            yield "\n"
         
     #-----------------------------------------------------4444444-------------------------------------
 
     def _handle_tac(self, args: List[str]) -> str:
+        return ''.join(self._stream_tac(args, None))
+
+    def _stream_tac(self, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
         # выводит содержимое файла в обратном порядке строк
-        if len(args) != 1:
-            return "Ошибка: команда tac требует ровно один аргумент (имя файла)\n"
+        if args or stdin is None:
+            # каждый файл переворачивается отдельно, файлы идут в порядке аргументов;
+            # файл читается блоками с конца, память не зависит от его размера
+            if not args:
+                raise CommandError("Ошибка: команда tac требует хотя бы один аргумент (имя файла)\n")
+            for path in args:
+                try:
+                    batches = self.vfs.iter_file_lines_reversed(path)
+                except Exception as e:
+                    raise CommandError(f"Ошибка: {e}\n")
+                for num, batch in enumerate(batches):
+                    if not num and batch and not batch[0]:
+                        # файл завершается переводом строки: пустой строки после него нет
+                        # (как у split_pieces), поэтому tac файла совпадает с cat | tac
+                        batch = batch[1:]
+                    if batch:
+                        yield '\n'.join(batch) + "\n"
+            return
+        # поток предыдущей стадии нельзя прочитать с конца, поэтому он накапливается
+        lines = [line for batch in split_pieces(stdin) for line in batch]
+        if lines:
+            lines.reverse()  # обратный порядок строк
+            yield '\n'.join(lines) + "\n"
+
+    def _handle_rev(self, args: List[str]) -> str:
+        return ''.join(self._stream_rev(args, None))
+
+    def _stream_rev(self, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
+        # переворачивает каждую строку файла задом наперёд, блок за блоком
+        source = self._text_source('rev', args, stdin)
+        for batch in split_pieces(source):
+            yield '\n'.join([line[::-1] for line in batch]) + "\n"
         
+    def _handle_find(self, args: List[str]) -> str:
+        # find [путь] [-name шаблон] [-type f|d]
+        path = pattern = kind = None
+        pos = 0
+        if args and not args[0].startswith('-'):
+            path = args[0]
+            pos = 1
+        while pos < len(args):
+            option = args[pos]
+            if option not in ('-name', '-type') or pos + 1 == len(args):
+                raise CommandError("Ошибка: использование: find [путь] [-name шаблон] [-type f|d]\n")
+            value = args[pos + 1]
+            if option == '-name':
+                pattern = value
+            elif value in ('f', 'd'):
+                kind = value
+            else:
+                raise CommandError(f"Ошибка: неизвестный тип для find -type: {value} (ожидается f или d)\n")
+            pos += 2
+
+        started = time.perf_counter()
         try:
-            content = self.vfs.read_file(args[0])
-            lines = content.split('\n')
-            reversed_lines = lines[::-1]  # обратный порядок строк
-            return '\n'.join(reversed_lines) + ("\n" if content else "")
+            paths = self.vfs.find(path, pattern, kind)
         except Exception as e:
-            return f"Ошибка: {e}\n"
+            raise CommandError(f"Ошибка: {e}\n")
+        elapsed = (time.perf_counter() - started) * 1000
+        lines = paths + [f"Найдено: {len(paths)} ({elapsed:.2f} мс)"]
+        return '\n'.join(lines) + "\n"
 
-    def _handle_rev(self, args: List[str]) -> str:
-        # переворачивает каждую строку файла задом наперёд
-        if len(args) != 1:
-            return "Ошибка: команда rev требует ровно один аргумент (имя файла)\n"
-        
+    def _handle_grep(self, args: List[str]) -> str:
+        return ''.join(self._stream_grep(args, None))
+
+    def _stream_grep(self, args: List[str], stdin: Optional[Iterator[str]]) -> Iterator[str]:
+        # grep <шаблон> [путь]: без пути фильтрует вход конвейера
+        if not args or len(args) > 2:
+            raise CommandError("Ошибка: команда grep требует шаблон и путь (без пути - вход конвейера)\n")
+        if len(args) == 1:
+            if stdin is None:
+                raise CommandError("Ошибка: команда grep требует путь к файлу или директории\n")
+            try:
+                regex = re.compile(args[0])
+            except re.error as e:
+                raise CommandError(f"Ошибка: неверный шаблон: {e}\n")
+            for batch in split_pieces(stdin):
+                lines = [line for line in batch if regex.search(line)]
+                if lines:
+                    yield '\n'.join(lines) + "\n"
+            return
+
+        started = time.perf_counter()
         try:
-            content = self.vfs.read_file(args[0])
-            lines = content.split('\n')
-            reversed_lines = [line[::-1] for line in lines]  # каждая строка перевёрнута
-            return '\n'.join(reversed_lines) + ("\n" if content else "")
+            result = self.vfs.grep(args[1], args[0])
         except Exception as e:
-            return f"Ошибка: {e}\n"
-        
+            raise CommandError(f"Ошибка: {e}\n")
+        if not result.recursive:
+            # строки выводятся по мере просмотра файла, без накопления
+            yield from join_lines(line for _, line in result.matches)
+            return
+        matches = 0
+        files = set()
+
+        def prefixed() -> Iterator[str]:
+            nonlocal matches
+            for path, line in result.matches:
+                matches += 1
+                files.add(path)
+                yield f"{path}:{line}"
+
+        yield from join_lines(prefixed())
+        elapsed = (time.perf_counter() - started) * 1000
+        yield (f"Совпадений: {matches} в файлах: {len(files)} "
+               f"(просмотрено файлов: {result.scanned}, {elapsed:.2f} мс)\n")
+
     #--------------------------------------------5555555--------------------------
     def _handle_mkdir(self, args: List[str]) -> str:
         # оздает новую директорию
         if len(args) != 1:
-            return "Ошибка: команда mkdir требует ровно один аргумент (путь)\n"
+            raise CommandError("Ошибка: команда mkdir требует ровно один аргумент (путь)\n")
         
         try:
-            result = self.vfs.mkdir(args[0])
-            return result if result else "Директория создана успешно\n"
+            error = self.vfs.mkdir(args[0])
         except Exception as e:
-            return f"Ошибка при выполнении mkdir: {e}\n"
+            raise CommandError(f"Ошибка при выполнении mkdir: {e}\n")
+        if error:
+            raise CommandError(error)
+        return "Директория создана успешно\n"
 
     def _handle_cp(self, args: List[str]) -> str:
-        # копирует файл
+        # копирует файл; с -r (-R) - директорию вместе с содержимым
+        recursive = bool(args) and args[0] in ('-r', '-R')
+        if recursive:
+            args = args[1:]
         if len(args) != 2:
-            return "Ошибка: команда cp требует два аргумента (источник и назначение)\n"
+            raise CommandError("Ошибка: команда cp требует два аргумента (источник и назначение)\n")
         
         try:
-            result = self.vfs.cp(args[0], args[1])
-            return result if result else "Файл скопирован успешно\n"
+            error = self.vfs.cp(args[0], args[1], recursive)
         except Exception as e:
-            return f"Ошибка при выполнении cp: {e}\n"
+            raise CommandError(f"Ошибка при выполнении cp: {e}\n")
+        if error:
+            raise CommandError(error)
+        return "Копирование выполнено успешно\n" if recursive else "Файл скопирован успешно\n"
         
 
+    def _handle_mount(self, args: List[str]) -> str:
+        # таблица монтирования, монтирование образа или выгрузка образов (-u)
+        if not args:
+            return self.vfs.mount_table() or "Смонтированных образов нет\n"
+        if args == ['-u']:
+            return f"Выгружено образов: {self.vfs.unload_mounts()}\n"
+        if len(args) != 2:
+            raise CommandError("Ошибка: использование: mount [<xml> <путь>] | mount -u\n")
+        if error := self.vfs.mount(args[0], args[1]):
+            raise CommandError(error)
+        return "Образ смонтирован успешно\n"
+
     def _handle_echo(self, args: List[str]) -> str:
-        # выводит текст в консоль, поддерживает переменные окружения и специальные символы"""
+        # выводит текст в консоль; переменные окружения уже подставлены при разборе команды
         if not args:
             return "\n"  # echo без аргументов - просто пустая строка
         
@@ -254,28 +803,10 @@ exit              - выйти из терминала
         text = ' '.join(args)
         
         # обрабатывает специальные символы
-        processed_text = self._process_echo_special_chars(text)
-        
-        # подставляет переменные окружения
-        try:
-            processed_text = self.expand_environment_variables(processed_text)
-        except ValueError as e:
-            return f"Ошибка: {e}\n"
-        
-        return processed_text + "\n"
+        return self._process_echo_special_chars(text) + "\n"
     
     def _process_echo_special_chars(self, text: str) -> str:
-        #Обрабатывает специальные символы в команде echo
-        # заменяет escape-последовательности
-        replacements = {
-            '\\n': '\n',
-            '\\t': '\t',
-            '\\\\': '\\',
-            '\\$': '$'
-        }
-        
-        result = text
-        for esc, char in replacements.items():
-            result = result.replace(esc, char)
-        
-        return result
\ No newline at end of file
+        # заменяет escape-последовательности \n, \t и \\ за один проход
+        if '\\' not in text:
+            return text
+        return _ECHO_ESCAPE_RE.sub(lambda m: _ECHO_ESCAPES[m.group(1)], text)
\ No newline at end of file
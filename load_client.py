@@ -0,0 +1,135 @@
+# нагрузочный клиент сервера оболочки: открывает N одновременных сессий, каждая
+# выполняет M команд по кругу из сценария и ждёт ответа перед следующей командой.
+# выводит пропускную способность, число ошибок и процентили задержки ответа
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import List
+from command_stats import LatencyHistogram
+from shell_protocol import DEFAULT_HOST, DEFAULT_PORT, read_frame, read_response
+
+# сценарий по умолчанию: навигация и чтение, без изменений общей VFS
+DEFAULT_SCRIPT = ['pwd', 'ls', 'ls /', 'cd /', 'vfs-info', 'cd ..', 'history 5']
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный клиент сервера эмулятора терминала')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST,
+                      help='Адрес сервера')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                      help='Порт сервера')
+    parser.add_argument('--unix', type=str, default=None, metavar='PATH',
+                      help='Подключаться к Unix-сокету PATH вместо TCP')
+    parser.add_argument('--sessions', type=int, default=100,
+                      help='Число одновременных сессий')
+    parser.add_argument('--commands', type=int, default=100,
+                      help='Число команд в каждой сессии')
+    parser.add_argument('--script', type=str, default=None,
+                      help='Файл с командами сценария, по одной в строке (по умолчанию - навигация и ls)')
+    parser.add_argument('--json', action='store_true',
+                      help='Вывести итоги в JSON')
+    return parser.parse_args(argv)
+
+
+class LoadStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.commands = 0
+        self.errors = 0
+        self.output_bytes = 0
+        self.failed_sessions = 0
+
+
+async def _session(args, script: List[str], stats: LoadStats) -> None:
+    try:
+        if args.unix:
+            reader, writer = await asyncio.open_unix_connection(args.unix)
+        else:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+    except OSError:
+        stats.failed_sessions += 1
+        return
+    try:
+        # приветствие сервера
+        if await read_frame(reader) is None:
+            stats.failed_sessions += 1
+            return
+        for num in range(args.commands):
+            command = script[num % len(script)]
+            started = time.perf_counter()
+            writer.write(command.encode('utf-8') + b"\n")
+            await writer.drain()
+            response = await read_response(reader)
+            if response is None:
+                stats.failed_sessions += 1
+                return
+            output, status = response
+            stats.latency.record(time.perf_counter() - started)
+            stats.commands += 1
+            stats.output_bytes += len(output.encode('utf-8'))
+            if status['error']:
+                stats.errors += 1
+            if status['exit']:
+                return
+    except (OSError, asyncio.IncompleteReadError):
+        stats.failed_sessions += 1
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def run_load(args, script: List[str]) -> dict:
+    stats = LoadStats()
+    started = time.perf_counter()
+    await asyncio.gather(*(_session(args, script, stats) for _ in range(args.sessions)))
+    elapsed = time.perf_counter() - started
+    return {
+        'sessions': args.sessions,
+        'failed_sessions': stats.failed_sessions,
+        'commands': stats.commands,
+        'errors': stats.errors,
+        'output_bytes': stats.output_bytes,
+        'elapsed_s': round(elapsed, 3),
+        'commands_per_s': round(stats.commands / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(stats.latency.percentile(50) * 1000, 3),
+        'p95_ms': round(stats.latency.percentile(95) * 1000, 3),
+        'p99_ms': round(stats.latency.percentile(99) * 1000, 3),
+        'max_ms': round(stats.latency.max * 1000, 3),
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_arguments(argv)
+    script = DEFAULT_SCRIPT
+    if args.script:
+        try:
+            with open(args.script, 'r', encoding='utf-8') as f:
+                script = [line.strip() for line in f
+                          if line.strip() and not line.lstrip().startswith('#')]
+        except OSError as e:
+            print(f"Ошибка чтения сценария: {e}", file=sys.stderr)
+            return 2
+        if not script:
+            print("Ошибка: сценарий пуст", file=sys.stderr)
+            return 2
+
+    result = asyncio.run(run_load(args, script))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Sessions: {result['sessions']} (failed: {result['failed_sessions']})\n"
+              f"Commands: {result['commands']} (errors: {result['errors']})\n"
+              f"Time: {result['elapsed_s']:.3f} s\n"
+              f"Throughput: {result['commands_per_s']:.0f} commands/s\n"
+              f"Latency: p50 {result['p50_ms']:.3f} ms, p95 {result['p95_ms']:.3f} ms, "
+              f"p99 {result['p99_ms']:.3f} ms, max {result['max_ms']:.3f} ms")
+    return 1 if result['failed_sessions'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,32 @@ import tkinter as tk
 from tkinter import scrolledtext
 from handlers import CommandHandler
 from vfs import VFSManager
+from content_cache import DEFAULT_CACHE_BUDGET
+from vfs_mount import DEFAULT_MOUNT_BUDGET
+from profiling import RunProfiler
 import os
 import socket
 import argparse
 import sys
+import queue
+import threading
+from collections import deque
+
+# период опроса очереди вывода (мс): накопленный вывод вставляется за один кадр
+OUTPUT_FLUSH_MS = 16
+# сколько символов вывода вставляется в окно за один кадр
+RENDER_CHUNK_CHARS = 64 * 1024
+# сколько блоков вывода может ждать отрисовки (в очереди и в окне): дальше фоновый
+# поток ждёт окно, и вывод команды не накапливается в памяти быстрее, чем рисуется
+OUTPUT_QUEUE_SIZE = 64
+# как часто фоновый поток, ждущий место в очереди, проверяет, не закрыто ли окно (с)
+OUTPUT_PUT_TIMEOUT = 0.1
+# объём истории окна по умолчанию (в строках)
+DEFAULT_SCROLLBACK = 10000
+
+PAGER_STATUS = "\n-- далее: Enter/пробел, q - пропустить --"
+# сколько ждать фоновый поток, чтобы он записал профиль при выходе (с)
+PROFILE_STOP_TIMEOUT = 10
 
 
 def parse_arguments():
@@ -14,6 +36,22 @@ def parse_arguments():
                       help='Путь к XML-файлу с виртуальной файловой системой')
     parser.add_argument('--startup-script', type=str, default=None,
                       help='Путь к стартовому скрипту')
+    parser.add_argument('--cache-budget', type=int, default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+                      help='Бюджет кеша содержимого файлов в МиБ')
+    parser.add_argument('--no-snapshot', action='store_true',
+                      help='Не использовать бинарный снимок VFS (всегда разбирать XML)')
+    parser.add_argument('--journal', action='store_true',
+                      help='Сохранять изменения (mkdir, cp) в журнал рядом с XML и применять его при загрузке')
+    parser.add_argument('--grep-index', action='store_true',
+                      help='Построить при загрузке n-граммный индекс содержимого файлов для grep')
+    parser.add_argument('--mount-budget', type=int, default=DEFAULT_MOUNT_BUDGET,
+                      help='Сколько узлов смонтированных образов держать в памяти (0 - без ограничения)')
+    parser.add_argument('--scrollback', type=int, default=DEFAULT_SCROLLBACK,
+                      help='Максимум строк в окне терминала (0 - без ограничения)')
+    parser.add_argument('--pager', action='store_true',
+                      help='Выводить длинные результаты постранично')
+    parser.add_argument('--profile', type=str, default=None, metavar='PREFIX',
+                      help='Профилировать сеанс (cProfile, tracemalloc) и записать отчёты в PREFIX.*')
     
     args = parser.parse_args()
     
@@ -23,6 +61,12 @@ def parse_arguments():
     
     if args.startup_script and not os.path.exists(args.startup_script):
         raise FileNotFoundError(f"Стартовый скрипт не найден: {args.startup_script}")
+
+    if args.cache_budget < 0:
+        raise ValueError("Бюджет кеша не может быть отрицательным")
+
+    if args.scrollback < 0:
+        raise ValueError("Объём истории не может быть отрицательным")
     
     return args
 
@@ -35,20 +79,51 @@ class ShellEmulator:
             
             self.vfs_path = args.vfs_path
             self.startup_script = args.startup_script
+            self.cache_budget = args.cache_budget * 1024 * 1024
+            self.use_snapshot = not args.no_snapshot
+            self.scrollback = args.scrollback
+            self.pager = args.pager
+            self.profiler = RunProfiler(args.profile) if args.profile else None
+            if self.profiler:
+                self.profiler.start_memory()
             
             # инициализация GUI
             self.root = tk.Tk()
-            username = os.getlogin()
-            hostname = socket.gethostname()
-            self.root.title(f"Эмулятор - [{username}@{hostname}] - VFS: {self.vfs_path}")
+            self.username = os.getlogin()
+            self.hostname = socket.gethostname()
+            self.root.title(f"Эмулятор - [{self.username}@{self.hostname}] - VFS: {self.vfs_path}")
             self.root.geometry("800x600")
             
-            self.command_handler = CommandHandler(self.vfs_path)
+            self.command_handler = CommandHandler(self.vfs_path, self.cache_budget, self.use_snapshot,
+                                                  args.journal, args.grep_index,
+                                                  mount_budget=args.mount_budget)
+            if self.profiler:
+                self.profiler.handler = self.command_handler
+
+            # команды выполняются в фоновом потоке; GUI получает вывод через очередь
+            # и применяет его в главном цикле Tk раз в кадр
+            self._tasks: queue.Queue = queue.Queue()
+            self._output_queue: queue.Queue = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+            self._pending = deque()  # вывод, ещё не вставленный в окно
+            self._closed = False  # окно закрыто: вывод фонового потока отбрасывается
+            self._busy = False
+            self._paging = False
+            self._page_used = 0  # строк текущей страницы, уже выведенных командой
+            self._skip_output = False  # 'q' в пейджере: вывод до следующего промпта отбрасывается
+            self._worker = threading.Thread(target=self._worker_loop, daemon=True)
+            self._worker.start()
+
             self.setup_gui()
             
             # выполнение стартового скрипта
+            current_dir = self.command_handler.current_path()
             if self.startup_script:
+                self.display_output(f"{self._prompt(current_dir)} ")
                 self.execute_startup_script()
+            else:
+                self._post_prompt(current_dir, "")
+
+            self.root.after(OUTPUT_FLUSH_MS, self._drain_output)
                 
         except Exception as e:
             print(f"Критическая ошибка инициализации: {e}")
@@ -61,6 +136,7 @@ class ShellEmulator:
         print(f"VFS Path: {os.path.abspath(args.vfs_path)}")
         print(f"VFS Exists: {os.path.exists(args.vfs_path)}")
         print(f"Startup Script: {args.startup_script}")
+        print(f"Cache Budget: {args.cache_budget} MiB")
         if args.startup_script:
             print(f"Script Exists: {os.path.exists(args.startup_script)}")
             print(f"Script is file: {os.path.isfile(args.startup_script)}")
@@ -80,57 +156,239 @@ class ShellEmulator:
         )
         self.output_text.pack(fill=tk.BOTH, expand=True)
         
-        # берём текущий путь из VFS для промпта
-        username = os.getlogin()
-        hostname = socket.gethostname()
-        current_dir = self.command_handler.vfs.get_current_path_str()
-        self.display_output(f"Terminal emulator v1.0\nType 'help' for available commands.\n\n{username}@{hostname}:{current_dir}$ ")
-
-        self.output_text.see(tk.END)
-        self.input_start = self.output_text.index("end-1c")
+        # промпт выводится после баннера, когда GUI готов принимать ввод.
+        # начало ввода хранится меткой: она сдвигается при удалении старых строк
+        self.display_output("Terminal emulator v1.0\nType 'help' for available commands.\n\n")
+        self.output_text.mark_set('input_start', "end-1c")
+        self.output_text.mark_gravity('input_start', tk.LEFT)
+        self.page_lines = max(int(self.output_text.cget('height')) - 1, 1)
         
         # привязывает обработчики событий клавиш
         self.output_text.bind('<Key>', self.on_key)
         self.output_text.bind('<BackSpace>', self.on_backspace)
         self.output_text.bind('<Return>', self.on_enter)
         self.output_text.bind('<Delete>', self.on_delete)
+        self.output_text.bind('<Tab>', self.on_tab)
         
         self.output_text.focus_set()
         self.output_text.mark_set(tk.INSERT, tk.END)
 
     def display_output(self, text):
-        # универсальный метод для вывода текста
-        self.output_text.insert(tk.END, text)
+        # универсальный метод для вывода текста; потокобезопасен,
+        # сам вывод происходит в _drain_output
+        self._put(('text', text))
+
+    def _prompt(self, current_dir):
+        return f"{self.username}@{self.hostname}:{current_dir}$"
+
+    def _post_prompt(self, current_dir, prefix="\n"):
+        # новый промпт завершает выполнение задачи и снова открывает ввод
+        self._put(('prompt', f"{prefix}{self._prompt(current_dir)} "))
+
+    def _put(self, item):
+        # очередь ограничена: фоновый поток ждёт, пока окно отрисует накопленный вывод
+        while not self._closed:
+            try:
+                self._output_queue.put(item, timeout=OUTPUT_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def _submit(self, kind, payload):
+        self._busy = True
+        self._tasks.put((kind, payload))
+
+    def _worker_loop(self):
+        # фоновый поток: выполняет команды по очереди, вывод отправляет в GUI
+        if self.profiler:
+            # команды выполняются здесь, поэтому cProfile включается в этом потоке
+            self.profiler.enable()
+        while True:
+            kind, payload = self._tasks.get()
+            if kind == 'profile':
+                payload.extend(self.profiler.stop())
+                return
+            try:
+                if kind == 'script':
+                    self._run_startup_script(payload)
+                else:
+                    self._run_command(payload)
+            except Exception as e:
+                self.display_output(f"\nОшибка: {e}")
+                self._post_prompt(self.command_handler.current_path())
+
+    def _drain_output(self):
+        # забирает накопленный вывод из очереди и вставляет его одним обновлением виджета.
+        # пока неотрисованного вывода много (или ждёт пейджер), очередь не разбирается:
+        # она заполняется, и фоновый поток останавливается до отрисовки
+        try:
+            while len(self._pending) < OUTPUT_QUEUE_SIZE:
+                kind, text = self._output_queue.get_nowait()
+                if kind == 'prompt':
+                    self._skip_output = False
+                elif kind == 'text' and self._skip_output:
+                    continue
+                if (kind == 'text' and not self.pager and self.scrollback
+                        and text.count('\n') > self.scrollback):
+                    # голова всё равно была бы сразу вытеснена из истории - не рисуем её
+                    text = self._tail_lines(text, self.scrollback)
+                self._pending.append((kind, text))
+        except queue.Empty:
+            pass
+
+        if self._render_pending():
+            self.root.after(OUTPUT_FLUSH_MS, self._drain_output)
+
+    def _render_pending(self):
+        # вставляет не более RENDER_CHUNK_CHARS символов за кадр: огромный вывод
+        # отрисовывается по частям, и окно не замирает. в режиме пейджера строки
+        # считаются по всем блокам вывода команды: заполненная страница ждёт клавишу
+        budget = RENDER_CHUNK_CHARS
+        pieces = []
+        while self._pending and budget > 0 and not self._paging:
+            kind, text = self._pending[0]
+            if kind == 'exit':
+                self.root.quit()
+                return False
+            rest = ""
+            if len(text) > budget:
+                text, rest = text[:budget], text[budget:]
+            page_full = False
+            if kind == 'text' and self.pager:
+                text, over = self._split_page(text, self.page_lines - self._page_used)
+                if over:
+                    rest = over + rest
+                    page_full = True
+                self._page_used += text.count('\n')
+            pieces.append(text)
+            budget -= len(text)
+            if rest:
+                self._pending[0] = (kind, rest)
+            else:
+                self._pending.popleft()
+            if page_full:
+                self._flush_output(pieces)
+                pieces = []
+                self._page_used = 0
+                self._show_pager_status()
+            elif rest:
+                break
+            elif kind == 'prompt':
+                self._flush_output(pieces)
+                pieces = []
+                self._page_used = 0
+                self.output_text.mark_set('input_start', "end-1c")
+                self.output_text.mark_set(tk.INSERT, tk.END)
+                self._busy = False
+
+        self._flush_output(pieces)
+        return True
+
+    def _flush_output(self, pieces):
+        if pieces:
+            self.output_text.insert(tk.END, ''.join(pieces))
+            self._trim_scrollback()
+            self.output_text.see(tk.END)
+
+    def _trim_scrollback(self):
+        # удаляет самые старые строки сверх лимита истории
+        if not self.scrollback:
+            return
+        lines = int(self.output_text.index("end-1c").split('.')[0])
+        excess = lines - self.scrollback
+        if excess > 0:
+            self.output_text.delete("1.0", f"{excess + 1}.0")
+
+    @staticmethod
+    def _tail_lines(text, count):
+        # последние count строк текста без разбиения его на список строк
+        pos = len(text)
+        for _ in range(count):
+            pos = text.rfind('\n', 0, pos)
+            if pos < 0:
+                return text
+        return text[pos + 1:]
+
+    @staticmethod
+    def _split_page(text, count):
+        # первые count строк текста (остаток страницы) и то, что за ними
+        pos = -1
+        for _ in range(max(count, 0)):
+            pos = text.find('\n', pos + 1)
+            if pos < 0:
+                return text, ""
+        return text[:pos + 1], text[pos + 1:]
+
+    def _show_pager_status(self):
+        self._paging = True
+        self.output_text.insert(tk.END, PAGER_STATUS, 'pager')
         self.output_text.see(tk.END)
 
+    def _pager_key(self, key):
+        # обработка клавиш в режиме постраничного вывода
+        if key in ('Return', 'space'):
+            pass
+        elif key == 'q':
+            # остаток длинного вывода пропускается, в том числе ещё не полученные блоки
+            while self._pending and self._pending[0][0] == 'text':
+                self._pending.popleft()
+            self._pending.appendleft(('text', "[вывод пропущен]\n"))
+            self._skip_output = not any(kind == 'prompt' for kind, _ in self._pending)
+        else:
+            return "break"
+        self.output_text.delete('pager.first', 'pager.last')
+        self._paging = False
+        self._render_pending()
+        return "break"
+
     def execute_startup_script(self):
-        # выполнение стартового скрипта
-        executed_commands, errors = self.command_handler.execute_script(self.startup_script)
-        
-        # обрабатывает ошибки выполнения скрипта
-        if errors:
-            for error in errors:
-                self.display_output(f"\nОшибка скрипта: {error}")
+        # выполнение стартового скрипта в фоновом потоке
+        self._submit('script', self.startup_script)
+
+    def _run_startup_script(self, script_path):
+        # каждая команда выполняется один раз, результат выводится по мере поступления
+        for event in self.command_handler.iter_script(script_path, stream=True):
+            # обрабатывает ошибки выполнения скрипта
+            if event.error:
+                self.display_output(f"\nОшибка скрипта: {event.error}")
+                continue
+            self.display_output(f"\n{self._prompt(event.cwd)} {event.command}")
+            first = True
+            for chunk in event.chunks:
+                if chunk == "EXIT_TERMINAL":
+                    continue
+                if first:
+                    first = False
+                    self.display_output("\n")
+                self.display_output(chunk)
+        self._post_prompt(self.command_handler.current_path())
+
+    def _run_command(self, command):
+        # вывод передаётся в GUI блоками по мере выполнения, не собираясь целиком
+        first = True
+        for chunk in self.command_handler.execute_stream(command):
+            if first:
+                if chunk == "EXIT_TERMINAL":
+                    self._put(('exit', None))
+                    return
+                first = False
+                self.display_output("\n")
+            self.display_output(chunk)
         
-        # имитируем выполнение команд для отображения в интерфейсе
-        for command in executed_commands:
-            username = os.getlogin()
-            hostname = socket.gethostname()
-            current_dir = self.command_handler.vfs.get_current_path_str()
-            prompt = f"{username}@{hostname}:{current_dir}$"
-            self.display_output(f"\n{prompt} {command}")
-            
-            result = self.command_handler.execute(command)
-            if result and result != "EXIT_TERMINAL":
-                self.display_output(f"\n{result}")
-            
-            self.output_text.update()
+        # обновляет промпт с учётом возможного изменения директории (например, после cd)
+        self._post_prompt(self.command_handler.current_path())
 
     def on_key(self, event):
         # обработчик нажатия клавиш с символами
+        if self._paging:
+            return self._pager_key(event.keysym)
+        if self._busy:
+            # пока выполняется команда, ввод не принимается
+            return "break"
+
         current_pos = self.output_text.index(tk.INSERT)
         
-        if self.output_text.compare(current_pos, "<", self.input_start):
+        if self.output_text.compare(current_pos, "<", 'input_start'):
             self.output_text.mark_set(tk.INSERT, tk.END)
             return "break"
         
@@ -140,9 +398,12 @@ class ShellEmulator:
         return "break"
 
     def on_backspace(self, event):
+        if self._busy:
+            return "break"
+
         current_pos = self.output_text.index(tk.INSERT)
         
-        if self.output_text.compare(current_pos, "<=", self.input_start):
+        if self.output_text.compare(current_pos, "<=", 'input_start'):
             return "break"
         
         if self.output_text.compare(current_pos, ">", "1.0"):
@@ -151,9 +412,12 @@ class ShellEmulator:
         return "break"
 
     def on_delete(self, event):
+        if self._busy:
+            return "break"
+
         current_pos = self.output_text.index(tk.INSERT)
         
-        if self.output_text.compare(current_pos, "<", self.input_start):
+        if self.output_text.compare(current_pos, "<", 'input_start'):
             return "break"
         
         if self.output_text.compare(tk.INSERT, "<", tk.END):
@@ -161,40 +425,68 @@ class ShellEmulator:
         
         return "break"
 
+    def on_tab(self, event):
+        # дополнение команды или пути по Tab. выполняется в потоке GUI: пока ввод
+        # открыт, фоновый поток команд не выполняет и дерево VFS не меняется
+        if self._paging or self._busy:
+            return "break"
+        if self.output_text.compare(tk.INSERT, "<", 'input_start'):
+            self.output_text.mark_set(tk.INSERT, tk.END)
+
+        line = self.output_text.get('input_start', tk.INSERT)
+        start, replacement, shown, total = self.command_handler.complete(line)
+        word = line[start:]
+        if replacement != word and (total == 1 or len(replacement) > len(word)):
+            self.output_text.delete(f"input_start+{len(line) - len(word)}c", tk.INSERT)
+            self.output_text.insert(tk.INSERT, replacement)
+        elif total > 1:
+            # общего продолжения нет - варианты выводятся под строкой ввода
+            self._show_completions(shown, total)
+        return "break"
+
+    def _show_completions(self, shown, total):
+        # список вариантов, затем новый промпт с тем же вводом и позицией курсора
+        command = self.output_text.get('input_start', "end-1c")
+        cursor = len(self.output_text.get('input_start', tk.INSERT))
+        listing = '  '.join(shown)
+        if total > len(shown):
+            listing += f"  ... (ещё {total - len(shown)})"
+        prompt = self._prompt(self.command_handler.current_path())
+        self.output_text.delete('input_start', tk.END)
+        self.output_text.insert(tk.END, f"{command}\n{listing}\n{prompt} ")
+        self.output_text.mark_set('input_start', "end-1c")
+        self.output_text.insert(tk.END, command)
+        self.output_text.mark_set(tk.INSERT, f"input_start+{cursor}c")
+        self._trim_scrollback()
+        self.output_text.see(tk.END)
+
     def on_enter(self, event):
-        command_line = self.output_text.get(self.input_start, tk.END).strip()
-        
-        username = os.getlogin()
-        hostname = socket.gethostname()
-        current_dir = self.command_handler.vfs.get_current_path_str()
-        prompt = f"{username}@{hostname}:{current_dir}$"
-        
-        if command_line.startswith(prompt):
-            command = command_line[len(prompt):].strip()
-        else:
-            command = command_line
-        
-        result = self.command_handler.execute(command)
-        
-        if result == "EXIT_TERMINAL":
-            self.root.quit()
+        if self._paging:
+            return self._pager_key('Return')
+        if self._busy:
             return "break"
+
+        # ввод начинается сразу после промпта
+        command = self.output_text.get('input_start', tk.END).strip()
         
-        if result:
-            self.output_text.insert(tk.END, f"\n{result}")
-        
-        # обновляет промпт с учётом возможного изменения директории (например, после cd)
-        new_current_dir = self.command_handler.vfs.get_current_path_str()
-        new_prompt = f"{username}@{hostname}:{new_current_dir}$"
-        self.output_text.insert(tk.END, f"\n{new_prompt} ")
-        self.input_start = self.output_text.index("end-1c")
-        self.output_text.mark_set(tk.INSERT, tk.END)
-        self.output_text.see(tk.END)
+        # выполнение в фоновом потоке; результат и новый промпт придут через очередь
+        self._submit('command', command)
         return "break"
     
     def run(self):
         # запуск главного цикла обработки событий
         self.root.mainloop()
+        self._closed = True
+        if self.profiler:
+            self._stop_profiler()
+
+    def _stop_profiler(self):
+        # профиль пишет фоновый поток после текущей команды
+        paths = []
+        self._tasks.put(('profile', paths))
+        self._worker.join(PROFILE_STOP_TIMEOUT)
+        for path in paths:
+            print(f"Профиль записан: {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+import bz2
+import lzma
+import zlib
+from typing import Iterable, Iterator
+
+# сжатое содержимое файлов: <file compression="zlib|lzma|bz2"> хранит base64 сжатых
+# данных. способ сжатия становится кодировкой содержимого (Blob.encoding), в памяти
+# и в снимке держатся сжатые байты. распаковка потоковая: на вход - блоки сжатых
+# байтов, на выход - блоки не больше заданного размера, поэтому даже файл с высокой
+# степенью сжатия не распаковывается в память целиком
+
+COMPRESSIONS = ('zlib', 'lzma', 'bz2')
+
+_ERRORS = (zlib.error, lzma.LZMAError, OSError, EOFError)
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == 'zlib':
+        return zlib.compress(data, 9)
+    if compression == 'lzma':
+        return lzma.compress(data)
+    if compression == 'bz2':
+        return bz2.compress(data)
+    raise ValueError(f"неизвестный способ сжатия: {compression}")
+
+
+def _decompressor(compression: str):
+    if compression == 'zlib':
+        return zlib.decompressobj()
+    if compression == 'lzma':
+        return lzma.LZMADecompressor()
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    raise ValueError(f"неизвестный способ сжатия: {compression}")
+
+
+def iter_decompressed(chunks: Iterable[bytes], compression: str,
+                      chunk_size: int) -> Iterator[bytes]:
+    # распакованные блоки (не больше chunk_size байт) по блокам сжатых данных.
+    # данные после конца сжатого потока игнорируются
+    decompressor = _decompressor(compression)
+    try:
+        if compression == 'zlib':
+            yield from _iter_zlib(decompressor, chunks, chunk_size)
+        else:
+            yield from _iter_buffered(decompressor, chunks, chunk_size)
+    except _ERRORS as e:
+        raise ValueError(f"повреждённое сжатое содержимое ({compression}): {e}")
+    if not decompressor.eof:
+        raise ValueError(f"сжатое содержимое обрезано ({compression})")
+
+
+def _iter_zlib(decompressor, chunks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    # не поместившийся в блок вход остаётся в unconsumed_tail
+    for data in chunks:
+        while data and not decompressor.eof:
+            block = decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+            if block:
+                yield block
+        if decompressor.eof:
+            break
+    block = decompressor.flush()
+    if block:
+        yield block
+
+
+def _iter_buffered(decompressor, chunks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    # lzma и bz2 держат не поместившийся в блок выход у себя: needs_input=False
+    for data in chunks:
+        while not decompressor.eof:
+            block = decompressor.decompress(data, chunk_size)
+            data = b''
+            if block:
+                yield block
+            if decompressor.needs_input:
+                break
+        if decompressor.eof:
+            break
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    return b''.join(iter_decompressed((data,), compression, 1 << 20))
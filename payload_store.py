@@ -0,0 +1,90 @@
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from vfs_nodes import Blob, FileNode, PayloadSegment
+
+# хранилище содержимого файлов с адресацией по SHA-256: одинаковое содержимое
+# (типовые конфиги, пустые логи) хранится одним Blob, файлы держат ссылку на него.
+# тот же хеш служит хешем файла в дереве Меркла.
+#
+# при загрузке из XML содержимое не хешируется: новое содержимое побайтово
+# сравнивается с уже загруженным того же размера (сравнение дешевле SHA-256).
+# хеш вычисляется при первом обращении (дерево Меркла, снимок, кеш содержимого,
+# индекс grep) либо когда содержимого одного размера становится больше COMPARE_LIMIT
+
+# сколько разных Blob одного размера сравниваются побайтово, прежде чем их хешировать
+COMPARE_LIMIT = 4
+
+SizeKey = Tuple[str, bool, int]
+
+
+class PayloadStore:
+    # Blob по хешу содержимого; Blob удаляется, когда на него не остаётся ссылок
+
+    def __init__(self):
+        self._blobs: Dict[bytes, Blob] = {}
+        self._by_size: Dict[SizeKey, List[Blob]] = {}  # ещё не хешированные Blob по размеру
+        self._hashed_sizes: Set[SizeKey] = set()  # размеры, содержимое которых хешируется
+
+    @staticmethod
+    def _size_key(blob: Blob) -> SizeKey:
+        # одинаковое содержимое хранится одинаково (строкой или в отображении),
+        # поэтому размеры строк и отображений не сравниваются между собой
+        return blob.encoding, isinstance(blob.content, str), blob.size
+
+    def add(self, content: Union[str, PayloadSegment], encoding: str,
+            digest: Optional[bytes] = None) -> FileNode:
+        # файл с этим содержимым; digest известен при загрузке из снимка
+        blob = Blob(content, encoding, digest)
+        if digest is None:
+            key = self._size_key(blob)
+            if key not in self._hashed_sizes:
+                bucket = self._by_size.setdefault(key, [])
+                for candidate in bucket:
+                    if candidate.same_content(blob):
+                        return FileNode(candidate)
+                if len(bucket) < COMPARE_LIMIT:
+                    bucket.append(blob)
+                    return FileNode(blob)
+                # слишком много разного содержимого этого размера: дальше - по хешу
+                del self._by_size[key]
+                self._hashed_sizes.add(key)
+                for candidate in bucket:
+                    self._blobs[candidate.digest] = candidate
+        existing = self._blobs.get(blob.digest)
+        if existing is None:
+            existing = self._blobs[blob.digest] = blob
+        return FileNode(existing)
+
+    def release(self, node: FileNode) -> None:
+        # файл удалён: содержимое без ссылок покидает хранилище
+        blob = node.blob
+        blob.refs -= 1
+        if not blob.refs:
+            bucket = self._by_size.get(self._size_key(blob), ())
+            for pos, candidate in enumerate(bucket):
+                if candidate is blob:
+                    del bucket[pos]
+                    return
+            self._blobs.pop(blob.digest, None)
+
+    def __iter__(self) -> Iterator[Blob]:
+        return chain(self._blobs.values(), *self._by_size.values())
+
+    def __len__(self) -> int:
+        return len(self._blobs) + sum(map(len, self._by_size.values()))
+
+    def stats(self) -> Dict[str, int]:
+        # размеры - в единицах исходного содержимого (байты отображения или символы строки)
+        files = stored = logical = 0
+        for blob in self:
+            size = blob.size
+            files += blob.refs
+            stored += size
+            logical += size * blob.refs
+        return {
+            'files': files,
+            'unique': len(self),
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'saved_bytes': logical - stored,
+        }
@@ -0,0 +1,78 @@
+# профилирование прогона эмулятора (--profile): cProfile собирает время по функциям,
+# tracemalloc - распределение памяти. результаты пишутся в файлы с общим префиксом:
+#   <prefix>.prof        - данные cProfile для pstats/snakeviz
+#   <prefix>.prof.txt    - топ функций по суммарному времени
+#   <prefix>.mem.txt     - пик памяти и топ мест выделения
+#   <prefix>.stats.json  - статистика команд и VFS (как stats --json)
+import cProfile
+import io
+import json
+import pstats
+import tracemalloc
+from typing import List
+
+# сколько строк попадает в текстовые отчёты
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 30
+
+
+class RunProfiler:
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.handler = None  # CommandHandler, чья статистика попадёт в отчёт
+        self._profile = cProfile.Profile()
+        self._enabled = False
+
+    def start_memory(self) -> None:
+        # вызывается до загрузки VFS, чтобы в пик памяти попало дерево
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def enable(self) -> None:
+        # cProfile собирает данные только того потока, в котором включён
+        self._profile.enable()
+        self._enabled = True
+
+    def start(self) -> None:
+        self.start_memory()
+        self.enable()
+
+    def stop(self) -> List[str]:
+        # выключает профилирование (в потоке, где оно включено) и пишет отчёты
+        if self._enabled:
+            self._profile.disable()
+            self._enabled = False
+        paths = [self._write_profile()]
+        if tracemalloc.is_tracing():
+            paths.append(self._write_memory())
+            tracemalloc.stop()
+        if self.handler is not None:
+            paths.append(self._write_stats())
+        return paths
+
+    def _write_profile(self) -> str:
+        path = self.prefix + '.prof'
+        self._profile.dump_stats(path)
+        text = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+        return path
+
+    def _write_memory(self) -> str:
+        path = self.prefix + '.mem.txt'
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Current: {current} bytes\nPeak: {peak} bytes\n\n")
+            for stat in top:
+                f.write(f"{stat}\n")
+        return path
+
+    def _write_stats(self) -> str:
+        path = self.prefix + '.stats.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.handler.get_stats(), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        return path
@@ -0,0 +1,5 @@
+@echo off
+chcp 65001 >nul
+echo Запуск стартового скрипта в пакетном режиме (без GUI)...
+python batch.py --vfs-path vfs_test.xml --startup-script startup_script.txt --echo --timing
+pause
\ No newline at end of file
@@ -0,0 +1,192 @@
+# сервер оболочки: одна загруженная VFS обслуживает много клиентов одновременно.
+# у каждого соединения своя сессия (SessionContext: текущая директория, история) и свой
+# CommandHandler, дерево, кеш содержимого и индексы общие. цикл asyncio только читает
+# команды и пишет вывод, а сами команды выполняются в пуле потоков блоками вывода:
+# долгая команда (vfs-compact, vfs-diff, первая загрузка образа, grep по большому
+# дереву) не задерживает остальные сессии. общая VFS это допускает: читатели работают
+# со своей версией дерева (MVCC), писатели выполняются по одному под её замком,
+# контекст сессии хранится для каждого потока и активируется перед каждым блоком.
+# протокол - в shell_protocol.py, нагрузочный клиент - load_client.py
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from handlers import CommandHandler, CommandStream
+from content_cache import DEFAULT_CACHE_BUDGET
+from session import SessionContext
+from shell_protocol import DEFAULT_HOST, DEFAULT_PORT, encode_done, encode_output
+from vfs import VFSManager
+from vfs_mount import DEFAULT_MOUNT_BUDGET
+
+# очередь ещё не принятых соединений: сотни клиентов подключаются почти одновременно
+LISTEN_BACKLOG = 1024
+
+# потоков, выполняющих команды
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# сколько символов вывода поток пула собирает за один переход: короткая команда
+# выполняется целиком за один переход, длинный вывод отправляется частями
+OUTPUT_BATCH_CHARS = 64 * 1024
+
+EXIT_OK = 0
+EXIT_LOAD_ERROR = 2
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Эмулятор терминала: сервер для многих клиентов над общей VFS')
+    parser.add_argument('--vfs-path', type=str, required=True,
+                      help='Путь к XML-файлу с виртуальной файловой системой')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST,
+                      help='Адрес TCP-сокета')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                      help='Порт TCP-сокета')
+    parser.add_argument('--unix', type=str, default=None, metavar='PATH',
+                      help='Слушать Unix-сокет PATH вместо TCP')
+    parser.add_argument('--cache-budget', type=int, default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+                      help='Бюджет кеша содержимого файлов в МиБ')
+    parser.add_argument('--no-snapshot', action='store_true',
+                      help='Не использовать бинарный снимок VFS (всегда разбирать XML)')
+    parser.add_argument('--journal', action='store_true',
+                      help='Сохранять изменения (mkdir, cp) в журнал рядом с XML и применять его при загрузке')
+    parser.add_argument('--grep-index', action='store_true',
+                      help='Построить при загрузке n-граммный индекс содержимого файлов для grep')
+    parser.add_argument('--mount-budget', type=int, default=DEFAULT_MOUNT_BUDGET,
+                      help='Сколько узлов смонтированных образов держать в памяти (0 - без ограничения)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                      help='Сколько потоков выполняют команды')
+    return parser.parse_args(argv)
+
+
+class ShellServer:
+    def __init__(self, vfs: VFSManager, workers: int = DEFAULT_WORKERS):
+        self.vfs = vfs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='command')
+        self.sessions = 0  # открытые соединения
+        self.total_sessions = 0
+        self.commands = 0
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.total_sessions += 1
+        self.sessions += 1
+        peer = writer.get_extra_info('peername')
+        peer = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else 'unix'
+        handler = CommandHandler(vfs=self.vfs,
+                                 context=SessionContext(f"{peer}#{self.total_sessions}"))
+        try:
+            writer.write(encode_done(handler.current_path()))
+            await writer.drain()
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # строка длиннее буфера потока - клиент нарушает протокол
+                    break
+                if not line:
+                    break
+                if not await self._run_command(handler, line, writer):
+                    break
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _run_command(self, handler: CommandHandler, line: bytes,
+                           writer: asyncio.StreamWriter) -> bool:
+        # выполняет одну команду и отправляет её вывод кадрами; False - сессия завершена
+        started = time.perf_counter()
+        self.commands += 1
+        failed = finished = False
+        loop = asyncio.get_running_loop()
+        try:
+            command = line.decode('utf-8')
+            chunks, done = None, False
+            while not done:
+                chunks, batch, done = await loop.run_in_executor(
+                    self._executor, self._produce, handler, command, chunks)
+                for chunk in batch:
+                    if chunk == "EXIT_TERMINAL":
+                        finished = True
+                        continue
+                    writer.write(encode_output(chunk))
+                await writer.drain()
+            failed = chunks.failed
+        except UnicodeDecodeError:
+            failed = True
+            writer.write(encode_output("Ошибка кодировки входных данных. Используйте UTF-8\n"))
+        except Exception as e:
+            failed = True
+            writer.write(encode_output(f"Ошибка: {e}\n"))
+        writer.write(encode_done(handler.current_path(), failed, finished,
+                                 (time.perf_counter() - started) * 1000))
+        await writer.drain()
+        return not finished
+
+    @staticmethod
+    def _produce(handler: CommandHandler, command: str, chunks: Optional[CommandStream]
+                 ) -> Tuple[CommandStream, List[str], bool]:
+        # в потоке пула: запускает команду (chunks is None) и собирает блоки её вывода,
+        # пока их не наберётся OUTPUT_BATCH_CHARS; (вывод, блоки, команда завершена)
+        if chunks is None:
+            chunks = handler.execute_stream(command)
+        batch = []
+        size = 0
+        for chunk in chunks:
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= OUTPUT_BATCH_CHARS:
+                return chunks, batch, False
+        return chunks, batch, True
+
+    def close(self) -> None:
+        # останавливает пул: команды, ещё не начатые, отменяются
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def serve(self, host: str, port: int, unix_path: str = None) -> None:
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path,
+                                                     backlog=LISTEN_BACKLOG)
+            address = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port,
+                                                backlog=LISTEN_BACKLOG)
+            address = ', '.join(f"{sock.getsockname()[0]}:{sock.getsockname()[1]}"
+                                for sock in server.sockets)
+        print(f"Сервер слушает {address}", file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+            if unix_path and os.path.exists(unix_path):
+                os.unlink(unix_path)
+
+
+def main(argv=None) -> int:
+    args = parse_arguments(argv)
+    started = time.perf_counter()
+    try:
+        vfs = VFSManager(args.vfs_path, args.cache_budget * 1024 * 1024,
+                         not args.no_snapshot, args.journal, args.grep_index, args.mount_budget)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка загрузки VFS: {e}", file=sys.stderr)
+        return EXIT_LOAD_ERROR
+    print(f"VFS загружена за {time.perf_counter() - started:.3f} s", file=sys.stderr)
+
+    server = ShellServer(vfs, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    print(f"Сессий: {server.total_sessions}, команд: {server.commands}", file=sys.stderr)
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+from collections import deque
+from typing import Deque, Tuple
+
+# сколько последних команд хранится в истории сессии
+HISTORY_LIMIT = 1000
+
+PathParts = Tuple[str, ...]
+
+
+class SessionContext:
+    # состояние одного пользователя поверх общей VFS: текущая директория и история.
+    # дерево, кеши и индексы живут в VFSManager и разделяются всеми сессиями,
+    # поэтому сотни сессий не загружают образ заново
+    __slots__ = ('name', 'cwd', 'history')
+
+    def __init__(self, name: str = 'local'):
+        self.name = name
+        self.cwd: PathParts = ()  # текущий путь как кортеж имён (например: ('home', 'user'))
+        self.history: Deque[str] = deque(maxlen=HISTORY_LIMIT)
@@ -0,0 +1,180 @@
+import re
+from functools import lru_cache
+from typing import List, Mapping, NamedTuple, Tuple, Union
+
+# сколько разобранных строк команд хранится в кеше
+PARSE_CACHE_SIZE = 4096
+
+# вне кавычек экранируются только символы, значимые для разбора и шаблонов имён;
+# остальные последовательности (\n, \t) остаются как есть для echo
+_ESCAPABLE = frozenset('\\$"\' \t|*?[')
+# внутри двойных кавычек - как в POSIX shell
+_DQ_ESCAPABLE = frozenset('\\$"')
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | '(?P<single>[^']*)'
+  | "(?P<double>(?:[^"\\]|\\.)*)"
+  | \\(?P<esc>.)
+  | \$\{(?P<bvar>[A-Za-z_]\w*)\}
+  | \$(?P<var>[A-Za-z_]\w*)
+  | (?P<pipe>\|)
+  | (?P<lit>[^\s'"\\$|]+|\$|\\\Z)
+''', re.VERBOSE | re.DOTALL)
+
+_DQ_TOKEN_RE = re.compile(r'''
+    \\(?P<esc>.)
+  | \$\{(?P<bvar>[A-Za-z_]\w*)\}
+  | \$(?P<var>[A-Za-z_]\w*)
+  | (?P<lit>[^\\$]+|[\\$])
+''', re.VERBOSE | re.DOTALL)
+
+
+# символы шаблонов имён файлов (glob) вне кавычек
+_GLOB_RE = re.compile(r'[*?[]')
+
+
+class VarRef(NamedTuple):
+    # ссылка на переменную окружения, подставляется при выполнении
+    name: str
+
+
+class GlobText(str):
+    # литерал вне кавычек с символами *, ? или [: часть шаблона имён файлов.
+    # литералы в кавычках и значения переменных остаются обычными строками
+    __slots__ = ()
+
+
+# слово команды: последовательность литералов и ссылок на переменные
+Word = Tuple[Union[str, VarRef], ...]
+
+
+class ParsedCommand(NamedTuple):
+    # разобранная строка команды; не зависит от окружения и поэтому кешируется.
+    # stages - команды конвейера (cmd1 | cmd2 ...), у простой команды одна стадия
+    stages: Tuple[Tuple[Word, ...], ...]
+    static_stages: Tuple[Tuple[str, ...], ...]  # готовые аргументы, если переменных нет
+    has_vars: bool
+    glob_words: Tuple[Tuple[int, int], ...] = ()  # (стадия, слово) слов-шаблонов
+
+    def expand(self, environ: Mapping[str, str]) -> List[List[str]]:
+        # подставляет переменные окружения; отсутствующая переменная - ошибка
+        if not self.has_vars:
+            return [list(argv) for argv in self.static_stages]
+        return [[_expand_word(word, environ) for word in stage] for stage in self.stages]
+
+    def glob_pattern(self, stage: int, word: int, environ: Mapping[str, str]) -> str:
+        # шаблон fnmatch для слова из glob_words: символы шаблона действуют только
+        # вне кавычек, остальные части слова экранируются
+        parts = []
+        for part in self.stages[stage][word]:
+            if isinstance(part, GlobText):
+                parts.append(part)
+            else:
+                text = _expand_word((part,), environ) if isinstance(part, VarRef) else part
+                parts.append(_GLOB_RE.sub(lambda m: f'[{m.group()}]', text))
+        return ''.join(parts)
+
+
+def _expand_word(word: Word, environ: Mapping[str, str]) -> str:
+    parts = []
+    for part in word:
+        if isinstance(part, VarRef):
+            value = environ.get(part.name)
+            if value is None:
+                raise ValueError(f"Переменная окружения ${part.name} не найдена")
+            parts.append(value)
+        else:
+            parts.append(part)
+    return ''.join(parts)
+
+
+def _append(word: list, part: Union[str, VarRef]) -> None:
+    # соседние литералы одного вида склеиваются
+    if word and isinstance(part, str) and type(word[-1]) is type(part):
+        word[-1] = type(part)(word[-1] + part)
+    else:
+        word.append(part)
+
+
+def _parse_double_quoted(text: str, word: list) -> None:
+    for m in _DQ_TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == 'esc':
+            char = m.group('esc')
+            _append(word, char if char in _DQ_ESCAPABLE else '\\' + char)
+        elif kind in ('var', 'bvar'):
+            _append(word, VarRef(m.group(kind)))
+        else:
+            _append(word, m.group('lit'))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_command(line: str) -> ParsedCommand:
+    # разбивает строку на стадии конвейера и слова с учётом кавычек,
+    # экранирования, $VAR и ${VAR}.
+    # :raises ValueError: при незакрытой кавычке или пустой стадии конвейера
+    stages = []
+    words = []
+    word = None  # None - между словами; [] - начато (возможно пустое, как "")
+    pos = 0
+    while pos < len(line):
+        m = _TOKEN_RE.match(line, pos)
+        if m is None:
+            raise ValueError(f"незакрытая кавычка в позиции {pos + 1}")
+        pos = m.end()
+        kind = m.lastgroup
+
+        if kind in ('ws', 'pipe'):
+            if word is not None:
+                words.append(tuple(word))
+                word = None
+            if kind == 'pipe':
+                if not words:
+                    raise ValueError("пустая команда в конвейере")
+                stages.append(words)
+                words = []
+            continue
+
+        if word is None:
+            word = []
+        if kind == 'single':
+            word.append(m.group('single'))
+        elif kind == 'double':
+            word.append('')  # "" - пустой, но существующий аргумент
+            _parse_double_quoted(m.group('double'), word)
+        elif kind == 'esc':
+            char = m.group('esc')
+            _append(word, char if char in _ESCAPABLE else '\\' + char)
+        elif kind in ('var', 'bvar'):
+            _append(word, VarRef(m.group(kind)))
+        else:
+            literal = m.group('lit')
+            _append(word, GlobText(literal) if _GLOB_RE.search(literal) else literal)
+
+    if word is not None:
+        words.append(tuple(word))
+    if stages and not words:
+        raise ValueError("пустая команда в конвейере")
+    stages.append(words)
+
+    stages = tuple(
+        tuple(tuple(p for p in w if p != '') or ('',) for w in stage)
+        for stage in stages
+    )
+    has_vars = any(isinstance(p, VarRef) for stage in stages for w in stage for p in w)
+    static_stages = () if has_vars else tuple(
+        tuple(''.join(w) for w in stage) for stage in stages
+    )
+    # имя команды шаблоном не считается
+    glob_words = tuple((i, j) for i, stage in enumerate(stages) for j, w in enumerate(stage)
+                       if j and any(isinstance(p, GlobText) for p in w))
+    return ParsedCommand(stages, static_stages, has_vars, glob_words)
+
+
+def parse_cache_info() -> str:
+    info = parse_command.cache_info()
+    return (
+        f"Parse cache: {info.currsize} / {info.maxsize} entries, "
+        f"hits: {info.hits}, misses: {info.misses}\n"
+    )
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import struct
+from typing import Optional, Tuple
+
+# протокол сервера оболочки: клиент отправляет команду строкой UTF-8 с '\n',
+# сервер отвечает кадрами "тип (1 байт) + длина (4 байта, little-endian) + данные":
+# кадры вывода идут по мере выполнения команды (потоковый вывод не копится целиком),
+# завершающий кадр содержит JSON с текущей директорией сессии и итогом команды.
+# первым сервер отправляет завершающий кадр приветствия с директорией новой сессии
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8022
+
+FRAME_OUTPUT = 1  # блок вывода команды (текст UTF-8)
+FRAME_DONE = 2    # конец команды: {"cwd", "error", "exit", "elapsed_ms"}
+
+_HEADER = struct.Struct('<BI')
+
+# защита от испорченного потока: кадр больше этого размера не принимается
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def encode_frame(kind: int, payload: bytes) -> bytes:
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+def encode_output(chunk: str) -> bytes:
+    return encode_frame(FRAME_OUTPUT, chunk.encode('utf-8'))
+
+
+def encode_done(cwd: str, error: bool = False, exit: bool = False,
+                elapsed_ms: float = 0.0) -> bytes:
+    status = {'cwd': cwd, 'error': error, 'exit': exit, 'elapsed_ms': round(elapsed_ms, 3)}
+    return encode_frame(FRAME_DONE, json.dumps(status, ensure_ascii=False).encode('utf-8'))
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Tuple[int, bytes]]:
+    # следующий кадр (тип, данные); None - сервер закрыл соединение
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    kind, size = _HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"слишком большой кадр: {size} байт")
+    return kind, await reader.readexactly(size)
+
+
+async def read_response(reader: asyncio.StreamReader) -> Optional[Tuple[str, dict]]:
+    # весь вывод команды и итог из завершающего кадра; None - соединение закрыто
+    chunks = []
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            return None
+        kind, payload = frame
+        if kind == FRAME_DONE:
+            return ''.join(chunks), json.loads(payload)
+        chunks.append(payload.decode('utf-8'))
@@ -0,0 +1,111 @@
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+import batch
+from handlers import CommandHandler
+
+# размер файла для проверок потокового вывода: намного больше блока чтения
+LARGE_FILE_BYTES = 32 * 1024 * 1024
+
+
+class _CountingOutput:
+    # stdout, который не хранит вывод, а только считает строки
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+
+    def flush(self):
+        pass
+
+
+class BatchStreamingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        line = 'строка журнала 0123456789\n'
+        cls.line_count = LARGE_FILE_BYTES // len(line.encode('utf-8'))
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="batch_test"><file name="big.log">')
+            out.write(line * cls.line_count)
+            out.write('</file></vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def _run(self, command):
+        def commands():
+            # VFS уже загружена: пик памяти считается только для выполнения команды
+            tracemalloc.reset_peak()
+            yield command + '\n'
+
+        args = batch.parse_arguments(['--vfs-path', self.xml_path, '--no-snapshot'])
+        stdout, stderr = _CountingOutput(), io.StringIO()
+        tracemalloc.start()
+        try:
+            code = batch.run(args, commands(), stdout, stderr)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return code, stdout, stderr.getvalue(), peak
+
+    def test_pipeline_output_is_not_materialized(self):
+        code, stdout, errors, peak = self._run('cat /big.log | grep журнала')
+        self.assertEqual((code, errors), (batch.EXIT_OK, ''))
+        self.assertEqual(stdout.lines, self.line_count)
+        self.assertLess(peak, LARGE_FILE_BYTES // 4)
+
+    def test_error_in_pipeline_goes_to_stderr(self):
+        code, stdout, errors, _ = self._run('cat /missing.log | grep журнала')
+        self.assertEqual(code, batch.EXIT_COMMAND_ERRORS)
+        self.assertEqual(stdout.lines, 0)
+        self.assertTrue(errors.startswith('Ошибка'))
+
+
+class ErrorLikeOutputTest(unittest.TestCase):
+    # вывод, который сам начинается со слова "Ошибка", - не ошибка команды
+    COMMANDS = ('tac /app.log', 'grep Ошибка /app.log', 'echo Ошибка тест')
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        self.xml_path = os.path.join(self.workdir.name, 'vfs.xml')
+        with open(self.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="errors_test"><file name="app.log">'
+                      'сервис запущен\nОшибка: диск заполнен</file></vfs>\n')
+
+    def _run(self, *commands):
+        args = batch.parse_arguments(['--vfs-path', self.xml_path, '--no-snapshot'])
+        stdout, stderr = io.StringIO(), io.StringIO()
+        code = batch.run(args, [command + '\n' for command in commands], stdout, stderr)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_output_starting_with_error_word_is_success(self):
+        code, output, errors = self._run(*self.COMMANDS)
+        self.assertEqual((code, errors), (batch.EXIT_OK, ''))
+        self.assertEqual(output, 'Ошибка: диск заполнен\nсервис запущен\n'
+                                 'Ошибка: диск заполнен\n'
+                                 'Ошибка тест\n')
+
+    def test_real_error_still_fails(self):
+        code, output, errors = self._run('echo Ошибка тест', 'cat /missing.log')
+        self.assertEqual(code, batch.EXIT_COMMAND_ERRORS)
+        self.assertEqual(output, 'Ошибка тест\n')
+        self.assertTrue(errors.startswith('Ошибка: '))
+
+    def test_stats_count_only_real_errors(self):
+        handler = CommandHandler(self.xml_path, use_snapshot=False)
+        for command in self.COMMANDS + ('cd /missing', 'grep Ошибка'):
+            handler.execute(command)
+        commands = handler.get_stats()['commands']
+        self.assertEqual({name: row['errors'] for name, row in commands.items()},
+                         {'tac': 0, 'grep': 1, 'echo': 0, 'cd': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import base64
+import os
+import tempfile
+import unittest
+import zlib
+from vfs import ENCODING_BASE64, ENCODING_TEXT, STREAM_THRESHOLD, VFSManager, detect_encoding
+
+TEXT = 'строка текста needle\n' * 200
+
+
+def wrap(payload: bytes, width: int = 76) -> str:
+    # base64 с переносом строк, как его пишут MIME и PEM
+    encoded = base64.b64encode(payload).decode('ascii')
+    return '\n'.join(encoded[pos:pos + width] for pos in range(0, len(encoded), width))
+
+
+class DetectEncodingTest(unittest.TestCase):
+    def test_wrapped_base64(self):
+        self.assertEqual(detect_encoding(wrap(TEXT.encode())), ENCODING_BASE64)
+        self.assertEqual(detect_encoding('QUJD\r\n    REVG'), ENCODING_BASE64)
+
+    def test_words_are_text(self):
+        for content in ('port 8080', 'QUJD\n\nREVG', '====', 'пример'):
+            self.assertEqual(detect_encoding(content), ENCODING_TEXT, content)
+
+
+class WrappedPayloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        # текст, похожий на base64, но не декодируемый в UTF-8, - крупнее порога потокового чтения
+        cls.looks_like_base64 = 'abcd' * (STREAM_THRESHOLD // 4 + 1)
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="encoding_test">'
+                      f'<file name="wrapped.txt">\n    {wrap(TEXT.encode())}\n</file>'
+                      f'<file name="big.txt">{wrap((TEXT * 100).encode())}</file>'
+                      f'<file name="packed.txt" compression="zlib">{wrap(zlib.compress(TEXT.encode()))}</file>'
+                      f'<file name="plain.txt">{cls.looks_like_base64}</file>'
+                      '</vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.vfs = VFSManager(self.xml_path, use_snapshot=False, content_index=True)
+
+    def _read_all_ways(self, path):
+        whole = self.vfs.read_file(path)
+        self.assertEqual(''.join(self.vfs.iter_file_chunks(path)), whole)
+        reversed_lines = [line for batch in self.vfs.iter_file_lines_reversed(path) for line in batch]
+        self.assertEqual(reversed_lines, whole.split('\n')[::-1])
+        return whole
+
+    def test_wrapped_base64_is_decoded(self):
+        self.assertEqual(self._read_all_ways('/wrapped.txt'), TEXT)
+        self.assertEqual(self._read_all_ways('/big.txt'), TEXT * 100)
+
+    def test_wrapped_compressed_payload(self):
+        self.assertEqual(self._read_all_ways('/packed.txt'), TEXT)
+
+    def test_large_base64_lookalike_streams_as_text(self):
+        self.assertEqual(self._read_all_ways('/plain.txt'), self.looks_like_base64)
+
+    def test_grep_finds_wrapped_content(self):
+        matches = self.vfs.grep('/', 'needle').matches
+        self.assertEqual({path for path, _ in matches}, {'/wrapped.txt', '/big.txt', '/packed.txt'})
+
+
+if __name__ == '__main__':
+    unittest.main()
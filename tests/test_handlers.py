@@ -0,0 +1,165 @@
+import base64
+import os
+import tempfile
+import unittest
+from handlers import GREP_CHUNK_SIZE, CommandHandler
+from vfs import VFSManager
+
+
+class MultipleOperandsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="handlers_test"><dir name="var"><dir name="log">'
+                      '<file name="a.log">a1\na2\n</file>'
+                      '<file name="b.log">b1\nb2\n</file>'
+                      '<file name="c.txt">c1\n</file>'
+                      '</dir></dir></vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.handler = CommandHandler(self.xml_path, use_snapshot=False)
+
+    def test_cat_concatenates_glob_matches(self):
+        self.assertEqual(self.handler.execute('cat /var/log/*.log'), 'a1\na2\nb1\nb2\n')
+
+    def test_cat_keeps_operand_order(self):
+        self.assertEqual(self.handler.execute('cat /var/log/c.txt /var/log/a.log'), 'c1\na1\na2\n')
+
+    def test_tac_reverses_each_file(self):
+        self.assertEqual(self.handler.execute('tac /var/log/*.log'), 'a2\na1\nb2\nb1\n')
+
+    def test_rev_reads_all_operands(self):
+        self.assertEqual(self.handler.execute('rev /var/log/*.log'), '1a\n2a\n1b\n2b\n')
+
+    def test_missing_operand_is_reported(self):
+        output = self.handler.execute('cat /var/log/a.log /var/log/missing.log')
+        self.assertEqual(output, 'a1\na2\nОшибка: Файл не найден: /var/log/missing.log\n')
+
+    def test_no_operands_is_an_error(self):
+        self.assertTrue(self.handler.execute('cat').startswith('Ошибка'))
+
+
+class PipelineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        # файл в base64 сохраняет перевод строки в конце, текст в XML - нет
+        ending = base64.b64encode('x1\nx2\n'.encode()).decode('ascii')
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="pipeline_test"><dir name="home"><dir name="admin"/>'
+                      '<dir name="user"/></dir>'
+                      '<file name="plain.txt">a1\na2\na3</file>'
+                      f'<file name="ending.txt">{ending}</file></vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.handler = CommandHandler(self.xml_path, use_snapshot=False)
+
+    def test_piped_filters_add_no_blank_line(self):
+        self.assertEqual(self.handler.execute('echo hi | rev'), 'ih\n')
+        self.assertEqual(self.handler.execute('ls /home | tac'), 'user\nadmin\n')
+
+    def test_cat_pipe_matches_file_operand(self):
+        for path in ('/plain.txt', '/ending.txt'):
+            for command in ('tac', 'rev'):
+                self.assertEqual(self.handler.execute(f'cat {path} | {command}'),
+                                 self.handler.execute(f'{command} {path}'), f'{command} {path}')
+        self.assertEqual(self.handler.execute('tac /ending.txt'), 'x2\nx1\n')
+
+    def test_blank_lines_inside_are_kept(self):
+        self.assertEqual(self.handler.execute('echo "a\\n\\nb" | tac'), 'b\n\na\n')
+
+
+class GrepStreamingTest(unittest.TestCase):
+    LINES = 200_000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="grep_test"><dir name="logs"><file name="big.log">')
+            for num in range(cls.LINES):
+                out.write(f'line {num:07d} match\n')
+            out.write('</file></dir></vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.handler = CommandHandler(self.xml_path, use_snapshot=False)
+        self.vfs = self.handler.vfs
+
+    def _count_chunks(self):
+        # сколько блоков содержимого файлов прочитал grep
+        consumed = []
+        node_chunks = self.vfs._node_chunks
+
+        def counting(node):
+            for chunk in node_chunks(node):
+                consumed.append(len(chunk))
+                yield chunk
+
+        self.vfs._node_chunks = counting
+        return consumed
+
+    def test_matches_are_consumed_lazily(self):
+        consumed = self._count_chunks()
+        matches = self.vfs.grep('/logs/big.log', 'match').matches
+        self.assertEqual(next(matches), ('/logs/big.log', 'line 0000000 match'))
+        self.assertEqual(len(consumed), 1)
+        self.assertLess(consumed[0], os.path.getsize(self.xml_path) // 10)
+
+    def test_output_starts_before_file_is_read(self):
+        consumed = self._count_chunks()
+        first = next(self.handler.execute_stream('grep match /logs/big.log'))
+        self.assertTrue(first.startswith('line 0000000 match\n'))
+        self.assertLess(len(first), GREP_CHUNK_SIZE * 2)
+        self.assertLess(len(consumed), 5)
+
+    def test_copies_report_the_same_lines(self):
+        self.assertEqual(self.handler.execute('cp /logs/big.log /logs/copy.log'), 'Файл скопирован успешно\n')
+        output = self.handler.execute('grep 0000042 /logs')
+        self.assertTrue(output.startswith('/logs/big.log:line 0000042 match\n'
+                                          '/logs/copy.log:line 0000042 match\n'), output[:200])
+        self.assertIn('Совпадений: 2 в файлах: 2', output)
+
+
+class VfsDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        self.paths = []
+        for name, extra in (('old.xml', ''), ('new.xml', '<file name="added.txt">x</file>')):
+            path = os.path.join(self.workdir.name, name)
+            with open(path, 'w', encoding='utf-8') as out:
+                out.write(f'<vfs name="diff_test"><dir name="etc">{extra}'
+                          '<file name="app.conf">port=8080</file></dir></vfs>\n')
+            self.paths.append(path)
+
+    def test_diff_leaves_no_snapshot(self):
+        handler = CommandHandler(self.paths[0], use_snapshot=False)
+        output = handler.execute(f'vfs-diff {self.paths[0]} {self.paths[1]}')
+        self.assertIn('/etc/added.txt', output)
+        self.assertEqual(sorted(os.listdir(self.workdir.name)), ['new.xml', 'old.xml'])
+
+    def test_find_without_index_matches_indexed(self):
+        indexed = VFSManager(self.paths[1], use_snapshot=False)
+        light = VFSManager(self.paths[1], use_snapshot=False, index=False)
+        for pattern in ('app.conf', '*.txt', 'e*', 'missing'):
+            self.assertEqual(light.find('/', pattern), indexed.find('/', pattern))
+
+
+if __name__ == '__main__':
+    unittest.main()
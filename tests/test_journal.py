@@ -0,0 +1,173 @@
+import base64
+import os
+import tempfile
+import unittest
+from unittest import mock
+from vfs import STREAM_THRESHOLD, VFSManager
+from vfs_journal import OP_CP, OP_MKDIR, iter_records, journal_path, read_header
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.xml_path = os.path.join(self.workdir.name, 'vfs.xml')
+        with open(self.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="journal_test"><dir name="etc">'
+                      '<file name="app.conf">port=8080</file></dir></vfs>\n')
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def _open(self, **kwargs):
+        vfs = VFSManager(self.xml_path, use_snapshot=False, **kwargs)
+        self.addCleanup(lambda: vfs._journal and vfs._journal.close())
+        return vfs
+
+
+class AbortedTransactionTest(JournalTestCase):
+    def test_index_changes_are_dropped_on_abort(self):
+        vfs = self._open(content_index=True)
+        with self.assertRaises(RuntimeError):
+            with vfs._transaction():
+                vfs._create_directory_recursive(('ghost',))
+                vfs._copy_file(('etc', 'app.conf'), ('ghost', 'copy.conf'),
+                               vfs._get_node_at_path(('etc', 'app.conf')))
+                raise RuntimeError("abort")
+        self.assertEqual(vfs._name_index.find('ghost'), set())
+        self.assertEqual(vfs._name_index.find('copy.conf'), set())
+        _, entries = vfs._content_index.candidates('port')
+        self.assertEqual([vfs._name_index.path(entry) for entry in entries], [('etc', 'app.conf')])
+
+    def test_index_changes_are_applied_on_commit(self):
+        vfs = self._open()
+        self.assertEqual(vfs.mkdir('/data/logs'), '')
+        self.assertEqual(vfs.cp('/etc/app.conf', '/data/app.conf'), '')
+        self.assertEqual(vfs.find('/', 'logs'), ['/data/logs'])
+        self.assertEqual(vfs.find('/', 'app.conf'), ['/data/app.conf', '/etc/app.conf'])
+
+
+class JournalTailTest(JournalTestCase):
+    def _write_journal(self, *commands):
+        vfs = self._open(journal=True)
+        for command in commands:
+            command(vfs)
+        vfs._journal.close()
+        vfs._journal = None
+
+    def _stale_records(self):
+        with open(journal_path(self.xml_path) + '.stale', 'rb') as f:
+            self.assertIsNotNone(read_header(f))
+            return [record.op for record in iter_records(f)]
+
+    def test_damaged_record_keeps_tail(self):
+        self._write_journal(lambda vfs: vfs.mkdir('/a'), lambda vfs: vfs.mkdir('/b'),
+                            lambda vfs: vfs.mkdir('/c'))
+        path = journal_path(self.xml_path)
+        with open(path, 'r+b') as f:
+            # последний байт второй записи: её CRC больше не сходится
+            read_header(f)
+            records = list(iter_records(f))
+            f.seek(records[1].end - 1)
+            f.write(b'#')
+        size = os.path.getsize(path)
+        vfs = self._open(journal=True)
+        self.assertEqual(vfs.find('/', 'a'), ['/a'])
+        self.assertEqual(vfs.find('/', 'c'), [])
+        info = vfs.get_vfs_info()
+        self.assertIn('damaged record after record 1', info)
+        self.assertIn(path + '.stale', info)
+        # отложенный журнал - всё, что шло после первой записи; сам журнал обрезан по ней
+        with open(path + '.stale', 'rb') as f:
+            read_header(f)
+            self.assertEqual(len(f.read()), size - records[0].end)
+        self.assertEqual(os.path.getsize(path), records[0].end)
+
+    def test_inconsistent_record_keeps_tail(self):
+        def bad_copy(vfs):
+            vfs._journal.append(OP_CP, ('missing.conf',), ('copy.conf',))
+
+        self._write_journal(lambda vfs: vfs.mkdir('/a'), bad_copy, lambda vfs: vfs.mkdir('/b'))
+        vfs = self._open(journal=True)
+        self.assertIn('replay stopped at record 2', vfs.get_vfs_info())
+        self.assertEqual(self._stale_records(), [OP_CP, OP_MKDIR])
+        self.assertEqual(vfs.find('/', 'b'), [])
+
+    def test_second_stale_journal_gets_own_name(self):
+        self._write_journal(lambda vfs: vfs.mkdir('/a'))
+        path = journal_path(self.xml_path)
+        with open(path + '.stale', 'wb') as f:
+            f.write(b'older')
+        with open(path, 'ab') as f:
+            f.write(b'\x01')
+        vfs = self._open(journal=True)
+        self.assertIn('vfs.xml.1.journal.stale', vfs.get_vfs_info())
+        with open(path + '.stale', 'rb') as f:
+            self.assertEqual(f.read(), b'older')
+
+
+class CompactTest(JournalTestCase):
+    LOG = 'запись журнала 0123456789\n' * (STREAM_THRESHOLD // 20)
+    # '>' в XML можно не экранировать: такой файл отображается из исходного образа,
+    # но в новый образ записывается экранированным
+    SCRIPT = ('if [ $a -gt 1 ]; then echo ok > /dev/null; fi\n' * 20).strip()
+
+    def setUp(self):
+        super().setUp()
+        with open(self.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="compact_test"><dir name="var">'
+                      f'<file name="app.log">{base64.b64encode(self.LOG.encode()).decode()}</file>'
+                      f'<file name="run.sh">{self.SCRIPT}</file>'
+                      '<file name="small.txt">port=8080</file></dir></vfs>\n')
+
+    def _open(self, **kwargs):
+        kwargs.setdefault('use_snapshot', False)
+        vfs = VFSManager(self.xml_path, **kwargs)
+        self.addCleanup(lambda: vfs._journal and vfs._journal.close())
+        return vfs
+
+    def _assert_contents(self, vfs):
+        self.assertEqual(vfs.read_file('/var/app.log'), self.LOG)
+        self.assertEqual(''.join(vfs.iter_file_chunks('/var/app.log')), self.LOG)
+        self.assertEqual(vfs.read_file('/var/run.sh'), self.SCRIPT)
+        self.assertEqual(vfs.read_file('/var/small.txt'), 'port=8080')
+        self.assertEqual(vfs.read_file('/var/copy.log'), self.LOG)
+
+    def _compact_and_read_back(self, **kwargs):
+        vfs = self._open(journal=True, **kwargs)
+        self.assertEqual(vfs.cp('/var/app.log', '/var/copy.log'), '')
+        mapping = vfs._mapping
+        self.assertIsNotNone(mapping)
+        vfs.compact()
+        # отображение прежнего образа закрыто до замены файлов, содержимое читается из нового
+        self.assertTrue(mapping.closed)
+        self.assertIsNot(vfs._mapping, mapping)
+        self._assert_contents(vfs)
+        self._assert_contents(self._open(**kwargs))
+
+    def test_compact_from_xml(self):
+        self._compact_and_read_back()
+
+    def test_compact_from_snapshot(self):
+        self._open(use_snapshot=True)
+        self.assertEqual(self._open(use_snapshot=True)._loaded_from, 'snapshot')
+        self._compact_and_read_back(use_snapshot=True)
+
+    def test_reader_continues_across_compact(self):
+        vfs = self._open()
+        chunks = vfs.iter_file_chunks('/var/app.log')
+        first = next(chunks)
+        vfs.compact()
+        self.assertEqual(first + ''.join(chunks), self.LOG)
+
+    def test_failed_replace_keeps_image_mapped(self):
+        vfs = self._open(journal=True)
+        self.assertEqual(vfs.cp('/var/app.log', '/var/copy.log'), '')
+        with mock.patch('os.replace', side_effect=PermissionError("файл занят")):
+            with self.assertRaises(OSError):
+                vfs.compact()
+        self._assert_contents(vfs)
+        self.assertEqual(vfs._journal.records, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
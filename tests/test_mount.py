@@ -0,0 +1,116 @@
+import base64
+import gc
+import os
+import tempfile
+import threading
+import tracemalloc
+import unittest
+import weakref
+from vfs import VFSManager
+
+# файлов в смонтированном образе; содержимое каждого больше порога отображения
+IMAGE_FILES = 2000
+
+
+class MountEvictionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="mount_test"><dir name="data"/>'
+                      '<include name="img" src="img.xml"/></vfs>\n')
+        payload = base64.b64encode(os.urandom(768)).decode('ascii')
+        with open(os.path.join(cls.workdir.name, 'img.xml'), 'w', encoding='utf-8') as out:
+            out.write('<vfs name="img">')
+            for num in range(IMAGE_FILES):
+                out.write(f'<file name="f{num}.bin" encoding="base64">{payload}{num:08d}</file>')
+            out.write('</vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.vfs = VFSManager(self.xml_path, use_snapshot=False, content_index=True)
+
+    def _use_image(self):
+        # загружает образ и заполняет кеши путей и содержимого и индексы
+        self.assertEqual(len(self.vfs.find('/img', 'f*.bin')), IMAGE_FILES)
+        for num in range(0, IMAGE_FILES, 10):
+            self.vfs.read_file(f'/img/f{num}.bin')
+
+    def _mapping(self):
+        # слабая ссылка на отображение образа: жива, пока на него ссылаются узлы
+        (_, mount), = self.vfs._mounts.entries()
+        return weakref.ref(mount.mapping)
+
+    def test_unload_releases_image_memory(self):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            self._use_image()
+            loaded = tracemalloc.get_traced_memory()[0]
+            mapping = self._mapping()
+            self.assertEqual(self.vfs.unload_mounts(), 1)
+            # индексы чистятся следующим писателем или поиском
+            self.vfs.mkdir('/data/after')
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertIsNone(mapping())
+        self.assertEqual(self.vfs.get_content_cache_stats()['entries'], 0)
+        self.assertLess(after - before, (loaded - before) // 5)
+
+    def test_image_is_found_again_after_unload(self):
+        self._use_image()
+        self.vfs.unload_mounts()
+        self._use_image()
+        self.assertEqual(self.vfs.find('/img', 'f1.bin'), ['/img/f1.bin'])
+
+    def test_copied_file_keeps_mapping(self):
+        expected = self.vfs.read_file('/img/f7.bin')
+        self.assertEqual(self.vfs.cp('/img/f7.bin', '/data/f7.bin'), '')
+        mapping = self._mapping()
+        self.vfs.unload_mounts()
+        gc.collect()
+        self.assertIsNotNone(mapping())
+        self.assertEqual(self.vfs.read_file('/data/f7.bin'), expected)
+
+
+class MountThrashTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        self.xml_path = os.path.join(self.workdir.name, 'vfs.xml')
+        with open(self.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="thrash_test"><include name="a" src="a.xml"/>'
+                      '<include name="b" src="b.xml"/></vfs>\n')
+        for name in ('a', 'b'):
+            with open(os.path.join(self.workdir.name, f'{name}.xml'), 'w', encoding='utf-8') as out:
+                out.write(f'<vfs name="{name}"><file name="{name}.txt">{name}</file>'
+                          f'<file name="{name}2.txt">{name}</file></vfs>\n')
+
+    def test_find_sees_all_mounts_under_budget_thrash(self):
+        # бюджет меньше двух образов: индексация одного выгружает другой
+        vfs = VFSManager(self.xml_path, use_snapshot=False, mount_budget=3)
+        expected = ['/a/a.txt', '/a/a2.txt', '/b/b.txt', '/b/b2.txt']
+        results = []
+
+        def search():
+            for _ in range(200):
+                results.append(vfs.find('/', '*.txt'))
+                vfs.read_file('/a/a.txt' if len(results) % 2 else '/b/b.txt')
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([found for found in results if found != expected], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
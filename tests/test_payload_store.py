@@ -0,0 +1,37 @@
+import hashlib
+import unittest
+from payload_store import COMPARE_LIMIT, PayloadStore
+
+
+class LazyDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.store = PayloadStore()
+
+    def test_unique_content_is_not_hashed(self):
+        nodes = [self.store.add('x' * size, 'text') for size in range(1, 10)]
+        self.assertFalse(any(node.blob.hashed for node in nodes))
+        self.assertEqual(nodes[2].digest, hashlib.sha256(b'txxx').digest())
+
+    def test_equal_content_is_shared_without_hashing(self):
+        first = self.store.add('port=8080', 'text')
+        second = self.store.add('port=8080', 'text')
+        self.assertIs(first.blob, second.blob)
+        self.assertFalse(first.blob.hashed)
+        self.assertIsNot(self.store.add('port=8080', 'base64').blob, first.blob)
+
+    def test_same_size_overflow_falls_back_to_digest(self):
+        payloads = [f'{num:04d}' for num in range(COMPARE_LIMIT + 2)]
+        nodes = [self.store.add(payload, 'text') for payload in payloads]
+        self.assertTrue(all(node.blob.hashed for node in nodes))
+        self.assertIs(self.store.add('0001', 'text').blob, nodes[1].blob)
+        self.assertEqual(len(self.store), len(payloads))
+
+    def test_release_forgets_unhashed_content(self):
+        node = self.store.add('port=8080', 'text')
+        self.store.release(node)
+        self.assertEqual(len(self.store), 0)
+        self.assertIsNot(self.store.add('port=8080', 'text').blob, node.blob)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from server import ShellServer
+from shell_protocol import read_frame, read_response
+from vfs import VFSManager
+
+# файлов в смонтированном образе: его первая загрузка заметно дольше команды pwd
+IMAGE_FILES = 100_000
+
+
+class BlockingCommandTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.xml_path = os.path.join(cls.workdir.name, 'vfs.xml')
+        with open(cls.xml_path, 'w', encoding='utf-8') as out:
+            out.write('<vfs name="server_test"><include name="big" src="big.xml"/></vfs>\n')
+        with open(os.path.join(cls.workdir.name, 'big.xml'), 'w', encoding='utf-8') as out:
+            out.write('<vfs name="big">')
+            for num in range(IMAGE_FILES):
+                out.write(f'<file name="f{num}.txt">{num}</file>')
+            out.write('</vfs>\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workdir.cleanup()
+
+    async def _scenario(self):
+        vfs = VFSManager(self.xml_path, use_snapshot=False)
+        shell = ShellServer(vfs, workers=2)
+        server = await asyncio.start_server(shell.handle_client, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        finished = []
+
+        async def session(command, delay):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await read_frame(reader)
+            await asyncio.sleep(delay)
+            writer.write(command.encode('utf-8') + b'\n')
+            await writer.drain()
+            output, status = await read_response(reader)
+            finished.append(command)
+            writer.close()
+            await writer.wait_closed()
+            return output, status
+
+        async with server:
+            # первая загрузка образа выполняется в пуле: pwd другой сессии не ждёт её
+            slow, fast = await asyncio.gather(session('ls /big --limit 1', 0),
+                                              session('pwd', 0.05))
+        shell.close()
+        return finished, slow, fast
+
+    def test_slow_command_does_not_block_other_sessions(self):
+        finished, slow, fast = asyncio.run(self._scenario())
+        self.assertEqual(finished, ['pwd', 'ls /big --limit 1'])
+        self.assertEqual(fast[0], '/\n')
+        self.assertIn('f0.txt', slow[0])
+
+
+class DoneFrameTest(unittest.TestCase):
+    async def _scenario(self, commands):
+        with tempfile.TemporaryDirectory() as workdir:
+            xml_path = os.path.join(workdir, 'vfs.xml')
+            with open(xml_path, 'w', encoding='utf-8') as out:
+                out.write('<vfs name="done_test"><file name="app.log">Ошибка: диск заполнен</file></vfs>\n')
+            shell = ShellServer(VFSManager(xml_path, use_snapshot=False), workers=1)
+            server = await asyncio.start_server(shell.handle_client, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                await read_frame(reader)
+                results = []
+                for command in commands:
+                    writer.write(command.encode('utf-8') + b'\n')
+                    await writer.drain()
+                    output, status = await read_response(reader)
+                    results.append((output, status['error']))
+                writer.close()
+                await writer.wait_closed()
+            shell.close()
+        return results
+
+    def test_error_flag_does_not_depend_on_output_text(self):
+        results = asyncio.run(self._scenario(['cat /app.log', 'echo Ошибка', 'cat /missing.log']))
+        self.assertEqual(results[:2], [('Ошибка: диск заполнен\n', False), ('Ошибка\n', False)])
+        self.assertTrue(results[2][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,339 +1,1551 @@
-import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
 import hashlib
 import base64
-from typing import Optional, List, Dict, Any
+import bisect
+import codecs
+import fnmatch
+import mmap
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, List, Dict, Sequence, Set, Tuple
+from content_cache import ContentCache, DEFAULT_CACHE_BUDGET
+from vfs_nodes import MAP_THRESHOLD, Blob, DirNode, FileNode, Node, PayloadSegment, remap_lock
+from payload_compression import COMPRESSIONS, decompress, iter_decompressed
+from vfs_mount import (DEFAULT_MOUNT_BUDGET, MountDir, MountTable, relative_source,
+                       resolve_source)
+from payload_store import PayloadStore
+from session import SessionContext
+from vfs_snapshot import read_snapshot, snapshot_path, write_snapshot
+from vfs_journal import (OP_CP, OP_CP_DIR, OP_MKDIR, OP_MOUNT, JournalRecord, JournalWriter,
+                         iter_records, journal_path, read_header, save_tail, stale_path)
+from vfs_writer import write_vfs_xml
+from vfs_merkle import diff_trees, tree_digest
+from vfs_index import ContentIndex, NameIndex, is_glob, literal_pattern
+
+# размер блока при потоковом чтении XML-образа
+XML_READ_CHUNK_SIZE = 1 << 20
+
+# размер блока при потоковом чтении содержимого файла (кратен 4 для base64)
+STREAM_CHUNK_SIZE = 64 * 1024
+# файлы меньше этого размера читаются потоково через read_file (целиком, с кешем)
+STREAM_THRESHOLD = 1 << 20
+
+# grep берёт пути файлов-кандидатов из индекса, если их не больше этой доли
+# записей индекса имён, иначе обходит поддерево и отсеивает файлы по хешу содержимого
+GREP_SELECTIVE_RATIO = 8
+# сколько символов совпавших строк grep держит для повторяющегося содержимого
+GREP_MEMO_LIMIT = 1 << 20
+
+# максимальное число записей в кеше разрешения путей
+RESOLVE_CACHE_SIZE = 4096
+# после транзакции, изменившей больше путей (применение журнала), кеш разрешения
+# путей не переносится в новую версию: проверка записей стоила бы дороже
+RESOLVE_CARRY_LIMIT = 64
+
+# способ хранения содержимого файла, определяется один раз при загрузке.
+# сжатое содержимое (атрибут compression) - base64 сжатых данных, его кодировка -
+# способ сжатия из COMPRESSIONS
+ENCODING_TEXT = 'text'
+ENCODING_BASE64 = 'base64'
+
+_BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+_XML_WHITESPACE = b' \t\r\n'
+
+
+def detect_encoding(content: str) -> str:
+    # base64 определяется по алфавиту и длине, без декодирования. base64 в XML часто
+    # перенесён по строкам (по 76 символов): пробельные символы допускаются только
+    # на переносах, иначе обычный текст из слов ("port 8080") сошёл бы за base64
+    if not content or not content.isascii():
+        return ENCODING_TEXT
+    data = content.encode('ascii')
+    if b'\n' in data:
+        lines = data.split()
+        if len(lines) != data.count(b'\n') + 1:
+            return ENCODING_TEXT
+        data = b''.join(lines)
+    body = data.rstrip(b'=')
+    if (len(data) % 4 == 0 and len(data) - len(body) <= 2
+            and not body.translate(None, _BASE64_ALPHABET)):
+        return ENCODING_BASE64
+    return ENCODING_TEXT
+
+
+def _base64_blocks(chunks: Iterable[bytes], validate: bool = False) -> Iterator[bytes]:
+    # декодирует base64 по блокам исходного содержимого: переносы строк убираются,
+    # а хвост блока, не кратный 4 символам, переходит в следующий
+    carry = b''
+    for raw in chunks:
+        data = carry + raw.translate(None, _XML_WHITESPACE)
+        size = len(data) - len(data) % 4
+        carry = data[size:]
+        if size:
+            yield base64.b64decode(data[:size], validate=validate)
+    if carry:
+        # неполная группа в конце - ошибка декодирования, как у b64decode
+        yield base64.b64decode(carry, validate=validate)
+
+
+class _VFSTreeBuilder:
+    # строит дерево VFS по событиям expat по мере закрытия элементов.
+    # XML-элементы не материализуются: в памяти держится только стек открытых
+    # узлов, поэтому глубина дерева не ограничена лимитом рекурсии.
+    # крупное содержимое файлов, записанное в XML буквально, не копируется
+    # в память, а хранится ссылкой на диапазон байтов отображённого XML.
+    # <include name="..." src="..."/> - точка монтирования другого образа:
+    # make_mount(путь образа, путь в дереве) создаёт её, образ не читается.
+    # <file compression="zlib|lzma|bz2"> - содержимое в base64 сжатых данных
+
+    def __init__(self, source, parser=None,
+                 make_mount: Optional[Callable[[str, Tuple[str, ...]], DirNode]] = None,
+                 base_dir: str = ''):
+        self.source = source   # отображённый в память XML (mmap) или bytes
+        self.parser = parser   # нужен для позиции конца элемента в байтах
+        self.make_mount = make_mount
+        self.base_dir = base_dir  # src в <include> - относительно директории XML
+        self.mapped_files = 0
+        self.store = PayloadStore()  # одинаковое содержимое файлов хранится один раз
+        self.root_name: Optional[str] = None
+        self.tree: Optional[DirNode] = None
+        # кадры стека: (тип, имя, данные); тип 'dir' и 'mount' -> узел, 'file' -> список
+        # фрагментов текста, 'skip' -> игнорируемое поддерево
+        self._stack: List[tuple] = []
+        self._compression: Optional[str] = None  # способ сжатия открытого файла
+
+    def start(self, tag: str, attrs: Dict[str, str]) -> None:
+        stack = self._stack
+        if not stack:
+            if tag != 'vfs':
+                raise ValueError("Корневой элемент XML должен быть <vfs>")
+            self.root_name = attrs.get('name', 'unnamed_vfs')
+            stack.append(('dir', None, DirNode()))
+            return
+
+        kind = stack[-1][0]
+        name = attrs.get('name')
+        if kind == 'file':
+            # как и ElementTree.text: текст файла - только до первого вложенного элемента
+            stack[-1] = ('file_done',) + stack[-1][1:]
+            stack.append(('skip', None, None))
+        elif kind != 'dir' or not name:
+            stack.append(('skip', None, None))
+        elif tag == 'dir':
+            stack.append(('dir', name, DirNode()))
+        elif tag == 'file':
+            compression = attrs.get('compression')
+            if compression is not None and compression not in COMPRESSIONS:
+                raise ValueError(f"Неизвестный способ сжатия файла {name}: {compression}")
+            self._compression = compression
+            stack.append(('file', name, []))
+        elif tag == 'include' and attrs.get('src') and self.make_mount is not None:
+            parts = tuple(frame[1] for frame in stack[1:]) + (name,)
+            stack.append(('mount', name, self.make_mount(
+                resolve_source(self.base_dir, attrs['src']), parts)))
+        else:
+            stack.append(('skip', None, None))
+
+    def end(self, tag: str) -> None:
+        kind, name, data = self._stack.pop()
+        if not self._stack:
+            self.tree = data
+            return
+        if kind == 'skip':
+            return
+
+        parent = self._stack[-1][2]
+        if kind in ('dir', 'mount'):
+            parent.add(name, data)
+        else:
+            # данные файла могут быть в base64 (или пустыми)
+            content = ''.join(data).strip()
+            encoding = detect_encoding(content)
+            if self._compression is not None:
+                if encoding != ENCODING_BASE64:
+                    raise ValueError(f"Сжатое содержимое файла {name} должно быть в base64")
+                encoding = self._compression
+            if kind == 'file' and len(content) >= MAP_THRESHOLD and isinstance(self.source, mmap.mmap):
+                segment = self._locate(content)
+                if segment is not None:
+                    self.mapped_files += 1
+                    parent.add(name, self.store.add(segment, encoding))
+                    return
+            parent.add(name, self.store.add(content, encoding))
+
+    def _locate(self, content: str) -> Optional[PayloadSegment]:
+        # ищет содержимое непосредственно перед закрывающим тегом </file>.
+        # если в XML оно записано не буквально (сущности, CDATA, \r\n),
+        # байты не совпадут, и содержимое останется в памяти строкой
+        end = self.parser.CurrentByteIndex
+        source = self.source
+        while end > 0 and source[end - 1] in _XML_WHITESPACE:
+            end -= 1
+        data = content.encode('utf-8')
+        start = end - len(data)
+        if start < 0 or source[start:end] != data:
+            return None
+        return PayloadSegment(source, start, len(data))
+
+    def data(self, text: str) -> None:
+        top = self._stack[-1] if self._stack else None
+        if top is not None and top[0] == 'file':
+            top[2].append(text)
+
+
+# путь внутри VFS как кортеж имён от корня (например: ('home', 'user'))
+PathParts = Tuple[str, ...]
+
+
+class ResolvedPath(NamedTuple):
+    # результат разрешения пути: нормализованный путь и узел (None, если не существует)
+    parts: PathParts
+    node: Optional[Node]
+
+
+class TreeVersion(NamedTuple):
+    # опубликованная версия дерева. узлы версии не изменяются: читатель, взявший версию,
+    # видит согласованное дерево до конца операции, даже если писатель уже опубликовал
+    # следующую. кеш разрешения путей принадлежит версии; записи кеша предыдущей
+    # версии (base_cache) берутся в него, если путь не связан с изменёнными в этой
+    # версии путями (changed): остальное дерево у версий общее
+    number: int
+    root: DirNode
+    resolve_cache: Dict[Tuple[PathParts, str], ResolvedPath]
+    base_cache: Optional[Dict[Tuple[PathParts, str], ResolvedPath]] = None
+    changed: Tuple[PathParts, ...] = ()
+
+
+class LoadedImage(NamedTuple):
+    # разобранный XML-образ: основной или смонтированный
+    root_name: str
+    sha256: str
+    tree: DirNode
+    store: PayloadStore
+    loaded_from: str  # 'xml' или 'snapshot'
+    mapping: Optional[mmap.mmap] = None  # отображение, на которое ссылаются файлы образа
+
+
+class GrepResult(NamedTuple):
+    recursive: bool                      # поиск по директории: строки выводятся с путём
+    scanned: int                         # сколько файлов просматривается
+    matches: Iterator[Tuple[str, str]]   # (путь, строка) по мере просмотра
+
 
 class VFSManager:
-    def __init__(self, vfs_xml_path: str):
+    def __init__(self, vfs_xml_path: str, cache_budget: int = DEFAULT_CACHE_BUDGET,
+                 use_snapshot: bool = True, journal: bool = False, content_index: bool = False,
+                 mount_budget: int = DEFAULT_MOUNT_BUDGET, index: bool = True):
         """
         Инициализирует VFS из XML-файла.
         
         :param vfs_xml_path: Путь к XML-файлу с описанием VFS.
+        :param cache_budget: Бюджет кеша декодированного содержимого файлов (в байтах).
+        :param use_snapshot: Загружать VFS из бинарного снимка рядом с XML, если он актуален,
+                             и записывать снимок после разбора XML.
+        :param journal: Применить журнал изменений рядом с XML и записывать в него
+                        каждое изменение (mkdir, cp), чтобы оно сохранялось между сеансами.
+        :param content_index: Построить n-граммный индекс содержимого для grep.
+        :param mount_budget: Сколько узлов смонтированных образов держать в памяти
+                             (0 - без ограничения); давно не использованные выгружаются.
+        :param index: Строить индекс имён для find. Без него (образ, загруженный только
+                      для сравнения) find -name обходит поддерево.
         :raises FileNotFoundError: если файл не найден.
         :raises ValueError: если XML повреждён или не соответствует ожидаемой структуре.
         """
         self._vfs_xml_path = vfs_xml_path
         self._root_name: str = ""
-        self._vfs_tree: Dict[str, Any] = {}  # внутреннее представление VFS
-        self._current_path: List[str] = []   # текущий путь как список имён (например: ['home', 'user'])
+        self._version = TreeVersion(0, DirNode(), {})  # внутреннее представление VFS
+        # изменения дерева: писатели по очереди собирают новую версию в черновике
+        # (_draft - корень, _owned - id директорий, скопированных или созданных в нём)
+        self._write_lock = threading.Lock()
+        self._draft: Optional[DirNode] = None
+        self._owned: Set[int] = set()
+        self._changed: List[PathParts] = []  # пути, изменённые в черновике
+        self._on_commit: List[Callable[[], None]] = []  # обновления индексов черновика
+        # текущая директория принадлежит сессии: сервер переключает контекст перед
+        # каждой командой, и одна загруженная VFS обслуживает много пользователей.
+        # контекст хранится для каждого потока, без своего - общий по умолчанию
+        self._local = threading.local()
+        self._default_context = SessionContext()
         self._xml_sha256: str = ""
+        self._use_snapshot = use_snapshot
+        self._loaded_from = ""  # 'xml' или 'snapshot'
+        # отображение основного образа (XML или снимка), на которое ссылается содержимое файлов
+        self._mapping: Optional[mmap.mmap] = None
+        self._mapping_path = ""
+        self._content_cache = ContentCache(cache_budget)  # декодированное содержимое base64- и сжатых файлов
+        self._load_time = 0.0
+        # счётчики разрешения путей для команды stats
+        self._resolve_calls = 0
+        self._resolve_hits = 0
+        self._resolve_depth_total = 0
+        self._resolve_depth_max = 0
+
+        self._store = PayloadStore()  # содержимое файлов с адресацией по хешу
+        self._load_dedup: Dict[str, int] = {}  # статистика дедупликации при загрузке
+        self._journal: Optional[JournalWriter] = None
+        self._journal_note = ""  # что произошло с журналом при загрузке
+        self._name_index = NameIndex()                        # для find
+        self._content_index: Optional[ContentIndex] = None    # для grep
+        self._index_time = 0.0
+        # смонтированные образы (<include>, mount) загружаются при первом входе
+        self._mounts = MountTable(self._load_mount, mount_budget, self._evict_mount)
+        self._evicted: List[PathParts] = []  # выгруженные образы, ещё не убранные из индексов
 
+        started = time.perf_counter()
         self._load_vfs()
+        self._load_dedup = self._store.stats()
+        # индексы строятся по образу до журнала: записи журнала обновляют их как команды
+        self._indexed = index or content_index
+        if self._indexed:
+            self._build_indexes(content_index)
+        if journal:
+            self._open_journal()
+        self._load_time = time.perf_counter() - started
 
+    @property
+    def context(self) -> SessionContext:
+        return getattr(self._local, 'context', self._default_context)
 
-    # загружает и парсит XML-файл VFS.
+    @context.setter
+    def context(self, context: SessionContext) -> None:
+        self._local.context = context
+
+    # текущая опубликованная версия дерева: читатель работает с ней до конца операции
+    # и не ждёт писателей, а писатели не ждут читателей.
+    def pin(self) -> TreeVersion:
+        
+        return self._version
+
+    # транзакция изменения дерева (path copying): писатели выполняются по одному,
+    # директории на изменяемых путях заменяются копиями, остальное дерево общее с
+    # опубликованной версией. новая версия публикуется одним присваиванием, поэтому
+    # читатель видит либо старое дерево, либо новое целиком. при исключении
+    # черновик отбрасывается и версия не меняется. индексы поиска только дописываются,
+    # поэтому их обновления копятся в _on_commit и применяются после публикации:
+    # у отменённой транзакции они не остаются
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        
+        with self._write_lock:
+            self._apply_evictions()
+            self._draft = self._version.root
+            try:
+                yield
+                if self._draft is not self._version.root:
+                    version = self._version
+                    carry = len(self._changed) <= RESOLVE_CARRY_LIMIT
+                    self._version = TreeVersion(version.number + 1, self._draft, {},
+                                                version.resolve_cache if carry else None,
+                                                tuple(self._changed) if carry else ())
+                    for update in self._on_commit:
+                        update()
+            finally:
+                self._draft = None
+                self._owned.clear()
+                self._changed.clear()
+                self._on_commit.clear()
+
+    # директория черновика, которую можно изменять: опубликованная или разделённая
+    # через cp -r в этой же транзакции заменяется копией.
+    def _own(self, node: DirNode) -> DirNode:
+        
+        if id(node) in self._owned and node.refs == 1:
+            return node
+        clone = node.clone()
+        self._owned.add(id(clone))
+        return clone
+
+
+    # загружает основной образ VFS.
     def _load_vfs(self):
         
+        image = self._load_image(self._vfs_xml_path)
+        self._root_name, self._xml_sha256, tree, self._store, self._loaded_from, self._mapping = image
+        self._mapping_path = snapshot_path(self._vfs_xml_path) if self._loaded_from == 'snapshot' \
+            else self._vfs_xml_path
+        self._version = TreeVersion(0, tree, {})
+
+    # загружает XML-образ из актуального снимка, иначе разбирает XML и сохраняет снимок.
+    # mount_path - где образ смонтирован: от него отсчитываются пути вложенных <include>
+    def _load_image(self, xml_path: str, mount_path: PathParts = ()) -> LoadedImage:
+        
         try:
-            with open(self._vfs_xml_path, 'rb') as f:
-                xml_data = f.read()
+            xml_stat = os.stat(xml_path)
         except FileNotFoundError:
-            raise FileNotFoundError(f"VFS XML файл не найден: {self._vfs_xml_path}")
+            raise FileNotFoundError(f"VFS XML файл не найден: {xml_path}")
+
+        def make_mount(source: str, parts: PathParts) -> MountDir:
+            mount = self._mounts.create(source, mount_path + parts)
+            self._mounts.register(mount)
+            return mount
+
+        snap_path = snapshot_path(xml_path)
+        if self._use_snapshot:
+            snapshot = read_snapshot(snap_path, xml_stat, make_mount)
+            if snapshot is not None:
+                root_name, sha256, tree, store, mapping = snapshot
+                return LoadedImage(root_name, sha256, tree, store, 'snapshot', mapping)
+
+        image = self._parse_xml(xml_path, make_mount)
+
+        if self._use_snapshot:
+            try:
+                write_snapshot(snap_path, image.tree, image.root_name, image.sha256, xml_stat)
+            except OSError:
+                # снимок - только ускорение; без прав на запись работаем с XML
+                pass
+        return image
+
+    # загружает смонтированный образ при первом входе в точку монтирования (MountTable).
+    def _load_mount(self, mount: MountDir) -> Tuple[DirNode, int, Optional[mmap.mmap]]:
+        
+        image = self._load_image(mount.source, mount.path)
+        dirs, files = self.count_nodes(image.tree)
+        return image.tree, dirs + files, image.mapping
+
+    # выгруженный образ (MountTable): записи кеша путей и кеша содержимого, ссылающиеся
+    # на его дерево, удаляются сразу, а индексы поиска дописываются только писателем,
+    # поэтому образ ставится в очередь _apply_evictions. индекс образа, из которого
+    # cp скопировал узлы, остаётся: по нему находятся и копии
+    def _evict_mount(self, mount: MountDir, tree: DirNode) -> None:
+        
+        prefixes = self._name_index.copies(mount.path)
+        version = self._version
+        for cache in (version.resolve_cache, version.base_cache):
+            if not cache:
+                continue
+            # копия: другие потоки в это время дописывают кеш
+            for key, cached in list(cache.items()):
+                parts = cached.parts
+                if any(len(parts) > len(prefix) and parts[:len(prefix)] == prefix
+                       for prefix in prefixes):
+                    cache.pop(key, None)
+        self._content_cache.discard(self._file_digests(tree))
+        if not mount.pinned:
+            self._evicted.append(mount.path)
+
+    # хеши содержимого файлов дерева; в точки монтирования не спускается.
+    @staticmethod
+    def _file_digests(root: DirNode) -> Set[bytes]:
+        
+        digests = set()
+        stack = [root]
+        while stack:
+            for _, child in stack.pop().items():
+                if not child.is_dir:
+                    # нехешированное содержимое ещё не читалось и в кеше его нет
+                    if child.blob.hashed:
+                        digests.add(child.digest)
+                elif not isinstance(child, MountDir):
+                    stack.append(child)
+        return digests
+
+    # убирает выгруженные образы из индекса имён и индекса содержимого;
+    # вызывается под блокировкой писателей
+    def _apply_evictions(self) -> None:
+        
+        while self._evicted:
+            dropped = self._name_index.evict(self._evicted.pop())
+            if self._content_index is not None:
+                self._content_index.discard(dropped)
 
+    # строит индекс имён и, при content_index=True, индекс содержимого одним обходом дерева.
+    def _build_indexes(self, content_index: bool) -> None:
         
-        self._xml_sha256 = hashlib.sha256(xml_data).hexdigest()# SHA-256 хеш содержимого файла
+        started = time.perf_counter()
+        on_file = None
+        if content_index:
+            self._content_index = ContentIndex(self._decode_chunks)
+            on_file = self._content_index.add_file
+        self._name_index = NameIndex.build(self._version.root, on_file)
+        self._index_time = time.perf_counter() - started
 
+    # применяет журнал изменений поверх загруженного образа и открывает его для дописывания.
+    def _open_journal(self):
+        
+        path = journal_path(self._vfs_xml_path)
+        valid_end = None
+        replayed = 0
+        stale = False
         try:
-            root = ET.fromstring(xml_data)
-        except ET.ParseError as e:
-            raise ValueError(f"Неверный формат XML: {e}")
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            with f:
+                if read_header(f) == self._xml_sha256:
+                    valid_end = f.tell()
+                    # весь журнал применяется одной транзакцией: путь копируется один раз
+                    with self._transaction():
+                        for record in iter_records(f):
+                            try:
+                                self._apply_record(record)
+                            except ValueError as e:
+                                # журнал не согласуется с образом: остаток отбрасывается
+                                self._journal_note = f"replay stopped at record {replayed + 1}: {e}"
+                                break
+                            valid_end = record.end
+                            replayed += 1
+                    # остаток после последней применённой записи (обрезанная или
+                    # повреждённая запись, или запись, не согласующаяся с образом)
+                    # будет отрезан писателем: сохраняем его рядом
+                    tail = save_tail(f, valid_end, self._xml_sha256, path)
+                    if tail is not None:
+                        if not self._journal_note:
+                            self._journal_note = f"damaged record after record {replayed}"
+                        self._journal_note += f"; unapplied tail ({tail[1]} bytes) saved to {tail[0]}"
+                else:
+                    stale = True
+        if stale:
+            # журнал записан для другого образа (XML изменён вне эмулятора):
+            # применять его нельзя, но и терять нельзя - откладываем в сторону
+            target = stale_path(path)
+            os.replace(path, target)
+            self._journal_note = f"journal of another image moved to {target}"
 
-        if root.tag != 'vfs':
-            raise ValueError("Корневой элемент XML должен быть <vfs>")
+        self._journal = JournalWriter(path, self._xml_sha256, valid_end)
+        self._journal.records = replayed
 
-        self._root_name = root.get('name', 'unnamed_vfs')
-        self._vfs_tree = self._parse_node(root)
+    # повторяет одно изменение из журнала.
+    def _apply_record(self, record: JournalRecord) -> None:
+        
+        if record.op == OP_MKDIR:
+            self._create_directory_recursive(record.paths[0])
+        elif record.op in (OP_CP, OP_CP_DIR):
+            source, dest = record.paths
+            node = self._get_node_at_path(source, self._draft)
+            if node is None or node.is_dir != (record.op == OP_CP_DIR):
+                raise ValueError(f"источник не найден: {self._format_path(source)}")
+            self._copy_file(source, dest, node)
+        elif record.op == OP_MOUNT:
+            target, source = record.paths
+            base_dir = os.path.dirname(os.path.abspath(self._vfs_xml_path))
+            self._mounts.register(self._attach(target, resolve_source(base_dir, '/'.join(source))))
+        else:
+            raise ValueError(f"неизвестная операция {record.op}")
 
-    def _parse_node(self, element: ET.Element) -> Dict[str, Any]:
+    # дописывает изменение в журнал, если он включён.
+    def _journal_append(self, op: int, *paths: PathParts) -> None:
         
-        # рекурсивно парсит XML-элемент в словарь.
+        if self._journal is not None:
+            self._journal.append(op, *paths)
+
+    # записывает текущее дерево в XML-образ вместо исходного и начинает журнал заново.
+    # писатели ждут окончания записи, чтобы журнал не потерял изменения; читатели - нет.
+    # образ не удалось записать - OSError, журнал при этом сохраняется
+    def compact(self) -> str:
         
-        node = {'type': 'dir', 'children': {}}
+        with self._write_lock:
+            return self._compact(self._version.root)
 
-        for child in element:
-            name = child.get('name')
-            if not name:
-                continue
+    # в Windows файл, отображённый в память, нельзя заменить, поэтому отображение
+    # основного образа закрывается перед заменой XML: содержимое, записанное в новый
+    # образ байт в байт, затем отображается из него, остальное копируется в память.
+    # читатели, попавшие на закрытое отображение, ждут переноса (remap_lock)
+    def _compact(self, root: DirNode) -> str:
+        folded = self._journal.records if self._journal is not None else 0
+        mapping = self._mapping
+        placed: Dict[Blob, int] = {}  # смещения содержимого в новом образе
+        moved: List[Blob] = []        # содержимое из закрытого отображения, которое отобразится снова
+        replaced = False
+
+        def replace(tmp_path: str, path: str) -> None:
+            nonlocal replaced
+            if mapping is not None:
+                for blob in self._store:
+                    content = blob.content
+                    if isinstance(content, str) or content.source is not mapping:
+                        continue
+                    if blob in placed:
+                        moved.append(blob)
+                    else:
+                        blob.content = PayloadSegment(content.read(), 0, content.length)
+                mapping.close()
+            os.replace(tmp_path, path)
+            replaced = True
 
-            if child.tag == 'dir':
-                node['children'][name] = self._parse_node(child)
-            elif child.tag == 'file':
-                # данные файла могут быть в base64 (или пустыми)
-                content = child.text.strip() if child.text else ""
+        try:
+            with remap_lock:
                 try:
-                    if content:
-                        base64.b64decode(content, validate=True)
-                except Exception:
-                    pass
-                node['children'][name] = {'type': 'file', 'content': content}
-            
+                    sha = write_vfs_xml(self._vfs_xml_path, root, self._root_name, placed, replace)
+                finally:
+                    if mapping is not None and mapping.closed:
+                        # содержимое отображается из нового образа, а если замена
+                        # не удалась - снова из прежнего файла по прежним смещениям
+                        if replaced:
+                            self._mapping_path = self._vfs_xml_path
+                        self._mapping = self._map_segments(self._mapping_path, moved,
+                                                           placed if replaced else None)
+        except OSError as e:
+            raise OSError(f"не удалось записать образ: {e}")
+        # до сброса журнала образ уже содержит его изменения, а старый журнал
+        # привязан к прежнему SHA-256 и при сбое здесь не будет применён повторно
+        self._xml_sha256 = sha
+        if self._journal is not None:
+            self._journal.reset(sha)
+        if self._use_snapshot:
+            try:
+                write_snapshot(snapshot_path(self._vfs_xml_path), root,
+                               self._root_name, sha, os.stat(self._vfs_xml_path))
+            except OSError:
+                pass
+        return f"Образ записан: {self._vfs_xml_path} (записей журнала: {folded})\n"
 
-        return node
-    
-    # возвращает информацию о VFS для команды vfs-info.
-    def get_vfs_info(self) -> str:
+    # отображает файл в память и переводит на него содержимое blobs: по смещениям
+    # offsets или, без них, по прежним смещениям их сегментов.
+    @staticmethod
+    def _map_segments(path: str, blobs: List[Blob],
+                      offsets: Optional[Dict[Blob, int]]) -> Optional[mmap.mmap]:
+        
+        if not blobs:
+            return None
+        with open(path, 'rb') as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for blob in blobs:
+            content = blob.content
+            offset = content.offset if offsets is None else offsets[blob]
+            blob.content = PayloadSegment(source, offset, content.length)
+        return source
+
+    # потоково разбирает XML-файл VFS: хеширует и парсит его блоками за один проход.
+    @staticmethod
+    def _parse_xml(xml_path: str, make_mount: Callable[[str, PathParts], DirNode]) -> LoadedImage:
+        
+        try:
+            f = open(xml_path, 'rb')
+        except FileNotFoundError:
+            raise FileNotFoundError(f"VFS XML файл не найден: {xml_path}")
+
+        with f:
+            try:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # пустой файл нельзя отобразить в память
+                source = b''
+
+        hasher = hashlib.sha256()
+        parser = expat.ParserCreate()
+        builder = _VFSTreeBuilder(source, parser, make_mount,
+                                  os.path.dirname(os.path.abspath(xml_path)))
+        parser.buffer_text = True
+        parser.buffer_size = XML_READ_CHUNK_SIZE
+        parser.StartElementHandler = builder.start
+        parser.EndElementHandler = builder.end
+        parser.CharacterDataHandler = builder.data
+
+        try:
+            for pos in range(0, len(source), XML_READ_CHUNK_SIZE):
+                chunk = source[pos:pos + XML_READ_CHUNK_SIZE]
+                hasher.update(chunk)
+                parser.Parse(chunk, False)
+            parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            raise ValueError(f"Неверный формат XML: {e}")
+        finally:
+            # отображение держат только узлы, ссылающиеся на него
+            if not builder.mapped_files and isinstance(source, mmap.mmap):
+                source.close()
+
+        mapping = source if builder.mapped_files and isinstance(source, mmap.mmap) else None
+        # SHA-256 хеш содержимого файла
+        return LoadedImage(builder.root_name, hasher.hexdigest(), builder.tree, builder.store,
+                           'xml', mapping)
+
+    # возвращает информацию о VFS для команды vfs-info; with_hash - с текущим хешем Меркла.
+    def get_vfs_info(self, with_hash: bool = False) -> str:
+        
+        info = (
+            f"VFS Name: {self._root_name}\nSHA-256: {self._xml_sha256}\n"
+            f"Loaded from: {self._loaded_from}\n"
+        ) + self._dedup_info() + self._index_info() + self._mount_info() + self._journal_info()
+        if with_hash:
+            info += f"Root hash: {self.root_hash()}\n"
+        return info
+
+    # хеш Меркла текущего дерева: пересчитываются только изменённые директории.
+    def root_hash(self) -> str:
+        
+        return tree_digest(self._version.root).hex()
+
+    # различия с деревом другой VFS (self - старое дерево, other - новое).
+    def diff(self, other: 'VFSManager') -> Iterator[Tuple[str, str]]:
         
-        return f"VFS Name: {self._root_name}\nSHA-256: {self._xml_sha256}\n"
+        for status, parts in diff_trees(self._version.root, other.pin().root):
+            yield status, self._format_path(parts)
+
+    def _dedup_info(self) -> str:
+        stats = self._load_dedup
+        return (
+            f"Files: {stats['files']}, unique payloads: {stats['unique']}\n"
+            f"Dedup saved: {stats['saved_bytes']} of {stats['logical_bytes']} bytes\n"
+        )
+
+    def _index_info(self) -> str:
+        info = (f"Name index: {len(self._name_index)} entries, "
+                f"{self._name_index.name_count} names ({self._index_time * 1000:.1f} ms)\n")
+        if self._content_index is not None:
+            info += (f"Content index: {len(self._content_index)} payloads, "
+                     f"{self._content_index.ngram_count} n-grams\n")
+        return info
+
+    def _mount_info(self) -> str:
+        if not len(self._mounts):
+            return ""
+        stats = self._mounts.stats()
+        budget = stats['budget_nodes'] or 'unlimited'
+        return (f"Mounts: {stats['mounts']} ({stats['loaded']} loaded, "
+                f"{stats['loaded_nodes']} of {budget} nodes)\n")
+
+    def _journal_info(self) -> str:
+        if self._journal is None:
+            return ""
+        info = f"Journal: {self._journal.path} ({self._journal.records} records)\n"
+        if self._journal_note:
+            info += f"Journal note: {self._journal_note}\n"
+        return info
+
+    # подсчитывает каталоги и файлы дерева (обход без рекурсии), по умолчанию текущего.
+    # поддеревья, разделяемые после cp -r, хранятся один раз и считаются один раз.
+    # смонтированные образы не загружаются: точка монтирования считается директорией
+    def count_nodes(self, root: Optional[DirNode] = None) -> Tuple[int, int]:
+        
+        dirs = files = 0
+        seen = set()
+        stack = [self._version.root if root is None else root]
+        while stack:
+            node = stack.pop()
+            dirs += 1
+            for _, child in node.items():
+                if not child.is_dir:
+                    files += 1
+                elif isinstance(child, MountDir):
+                    dirs += 1
+                elif child.refs == 1:
+                    stack.append(child)
+                elif id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+        return dirs, files
+
+    # возвращает счётчики VFS для команды stats.
+    def get_stats(self) -> Dict[str, object]:
+        
+        dirs, files = self.count_nodes()
+        misses = self._resolve_calls - self._resolve_hits
+        return {
+            'load_ms': self._load_time * 1000,
+            'loaded_from': self._loaded_from,
+            'version': self._version.number,
+            'dirs': dirs,
+            'files': files,
+            'resolve_calls': self._resolve_calls,
+            'resolve_cache_hits': self._resolve_hits,
+            'resolve_depth_avg': self._resolve_depth_total / misses if misses else 0.0,
+            'resolve_depth_max': self._resolve_depth_max,
+            'payloads': self._store.stats(),
+            'mounts': self._mounts.stats(),
+            'index': {
+                'build_ms': self._index_time * 1000,
+                'entries': len(self._name_index),
+                'names': self._name_index.name_count,
+                'aliases': len(self._name_index.aliases),
+                'content_payloads': len(self._content_index) if self._content_index else None,
+                'content_ngrams': self._content_index.ngram_count if self._content_index else None,
+            },
+        }
+
+    # возвращает счётчики кеша декодированного содержимого.
+    def get_content_cache_stats(self) -> Dict[str, int]:
+        
+        return self._content_cache.stats()
+
+    # возвращает статистику кеша декодированного содержимого для команды cache-info.
+    def get_cache_info(self) -> str:
+        
+        stats = self._content_cache.stats()
+        return (
+            f"Entries: {stats['entries']}\n"
+            f"Used: {stats['used_bytes']} / {stats['budget_bytes']} bytes\n"
+            f"Hits: {stats['hits']}\n"
+            f"Misses: {stats['misses']}\n"
+            f"Evictions: {stats['evictions']}\n"
+        )
     
     # возвращает узел по пути (список имён).
-    def _get_node_at_path(self, path_parts: List[str]) -> Optional[Dict[str, Any]]:
+    # root - корень версии, по умолчанию текущей опубликованной.
+    def _get_node_at_path(self, path_parts: Sequence[str],
+                          root: Optional[DirNode] = None) -> Optional[Node]:
         
-        node = self._vfs_tree
+        node = self._version.root if root is None else root
         
         # пустой путь = корень VFS
-        if not path_parts:
-            return node
-        
         for part in path_parts:
-            if node['type'] != 'dir':
+            if not node.is_dir:
                 return None
-            if part not in node['children']:
+            node = node.children.get(part)
+            if node is None:
                 return None
-            node = node['children'][part]
         return node
 
-    # смена текущей директории.  '.', '..', и абсолютные пути.
-    def cd(self, path: str) -> str:
-        
+    # нормализует путь относительно cwd: отбрасывает '.', схлопывает '..'.
+    @staticmethod
+    def _normalize_path(path: str, cwd: PathParts) -> PathParts:
         
         if path.startswith('/'):
-            # абсолютный путь - начинаем с корня
-            if path == '/':
-                target_parts = []  # корень VFS
-            else:
-                target_parts = [p for p in path[1:].split('/') if p and p != '.']
+            resolved = []
         else:
-            # относительный путь от текущей директории
-            target_parts = self._current_path + [p for p in path.split('/') if p and p != '.']
-        
-        # обработка '..'
-        resolved = []
-        for part in target_parts:
+            resolved = list(cwd)
+
+        for part in path.split('/'):
+            if not part or part == '.':
+                continue
             if part == '..':
-                if resolved:  # Если есть куда возвращаться
+                # из корня подняться выше нельзя - остаемся в корне
+                if resolved:
                     resolved.pop()
-                # Если resolved пуст - остаемся в корне (это нормально)
             else:
                 resolved.append(part)
+        return tuple(resolved)
+
+    # единая точка разрешения путей для cd, ls, read_file, mkdir и cp.
+    # результат кешируется по (cwd, путь) в версии дерева (по умолчанию текущей),
+    # у новой версии кеш свой. счётчики при работе из нескольких потоков приблизительны
+    def resolve(self, path: str, version: Optional[TreeVersion] = None) -> ResolvedPath:
+        
+        version = version or self._version
+        cache = version.resolve_cache
+        cwd = self.context.cwd
+        # абсолютные пути не зависят от cwd и разделяют записи кеша
+        key = ((), path) if path.startswith('/') else (cwd, path)
+        self._resolve_calls += 1
+        cached = cache.get(key)
+        if cached is None and version.base_cache is not None:
+            cached = version.base_cache.get(key)
+            if cached is not None:
+                if self._is_changed(cached.parts, version.changed):
+                    cached = None
+                elif len(cache) < RESOLVE_CACHE_SIZE:
+                    cache[key] = cached
+        if cached is not None:
+            self._resolve_hits += 1
+            return cached
+
+        parts = self._normalize_path(path, cwd)
+        resolved = ResolvedPath(parts, self._get_node_at_path(parts, version.root))
+        # глубина считается только для реального обхода дерева
+        depth = len(parts)
+        self._resolve_depth_total += depth
+        if depth > self._resolve_depth_max:
+            self._resolve_depth_max = depth
+
+        if len(cache) >= RESOLVE_CACHE_SIZE:
+            cache.clear()
+        cache[key] = resolved
+        return resolved
+
+    # изменён ли в версии узел по пути parts или директория на пути к нему:
+    # путь совпадает с изменённым, лежит на нём или под ним
+    @staticmethod
+    def _is_changed(parts: PathParts, changed: Tuple[PathParts, ...]) -> bool:
+        
+        return any(parts[:len(path)] == path or path[:len(parts)] == parts for path in changed)
+
+    @staticmethod
+    def _format_path(parts: PathParts) -> str:
+        
+        return '/' + '/'.join(parts) if parts else '/'
+
+    # смена текущей директории.  '.', '..', и абсолютные пути.
+    def cd(self, path: str) -> str:
         
+        resolved, node = self.resolve(path)
+
         #проверка существования пути
-        node = self._get_node_at_path(resolved)
-        if not node:
-            # формирование читаемого пути для сообщения об ошибке
-            abs_path = '/' + '/'.join(resolved) if resolved else '/'
-            return f"Ошибка: директория не найдена: {abs_path}\n"
+        if node is None:
+            return f"Ошибка: директория не найдена: {self._format_path(resolved)}\n"
         
-        if node['type'] != 'dir':
-            abs_path = '/' + '/'.join(resolved) if resolved else '/'
-            return f"Ошибка: путь не является директорией: {abs_path}\n"
+        if not node.is_dir:
+            return f"Ошибка: путь не является директорией: {self._format_path(resolved)}\n"
         
         # если путь  корректен - обновляем текущий путь
-        self._current_path = resolved
+        self.context.cwd = resolved
         return ""
 
 
-    # возвращает список файлов и директорий в текущей директории.
-    def ls(self) -> str:
+    # возвращает список файлов и директорий в текущей директории или по указанному пути.
+    # постранично: limit имён после имени after (имена берутся из упорядоченного индекса
+    # директории, поэтому страница стоит O(log n + limit)). для файла выводится сам путь.
+    # несуществующий путь - FileNotFoundError
+    def ls(self, path: Optional[str] = None, limit: Optional[int] = None,
+           after: Optional[str] = None) -> str:
         
-        node = self._get_node_at_path(self._current_path)
-        if not node or node['type'] != 'dir':
-            return "Ошибка: текущая директория недоступна\n"
+        if path is not None:
+            resolved, node = self.resolve(path)
+            if node is None:
+                raise FileNotFoundError(f"директория не найдена: {self._format_path(resolved)}")
+            if not node.is_dir:
+                return path + "\n"
+        else:
+            node = self._get_node_at_path(self.context.cwd)
+        if node is None or not node.is_dir:
+            raise FileNotFoundError("текущая директория недоступна")
 
-        names = sorted(node['children'].keys())
-        if not names:
+        names = node.names()
+        start = node.names_after(after) if after is not None else 0
+        end = len(names) if limit is None else min(len(names), start + limit)
+        if start >= end:
             return ""
-        return "\n".join(names) + "\n"
+        output = "\n".join(names[start:end]) + "\n"
+        if end < len(names):
+            output += f"... ещё {len(names) - end} (следующая страница: --after {names[end - 1]})\n"
+        return output
+
+    # ls -R: содержимое директории и всех поддиректорий, по блоку на директорию.
+    # ошибки пути - сразу, при вызове
+    def iter_ls_recursive(self, path: Optional[str] = None) -> Iterator[str]:
+        
+        if path is None:
+            resolved = self.context.cwd
+            node = self._get_node_at_path(resolved)
+        else:
+            resolved, node = self.resolve(path)
+        if node is None:
+            raise FileNotFoundError(f"директория не найдена: {self._format_path(resolved)}")
+        if not node.is_dir:
+            return iter((path + "\n",))
+        return self._ls_recursive(resolved, node)
+
+    def _ls_recursive(self, parts: PathParts, node: DirNode) -> Iterator[str]:
+        separator = ""
+        for dir_parts, child in self._walk(parts, node):
+            if child.is_dir:
+                names = child.names()
+                listing = "\n".join(names) + "\n" if names else ""
+                yield f"{separator}{self._format_path(dir_parts)}:\n{listing}"
+                separator = "\n"
+
+    # раскрывает шаблон имён (glob: *, ?, [...]) в отсортированный список путей в том же
+    # виде, что и шаблон (абсолютные или относительные). в каждой директории имена
+    # выбираются диапазоном упорядоченного индекса по префиксу компонента до первого
+    # символа шаблона, а не перебором всех детей
+    def glob(self, pattern: str) -> List[str]:
+        
+        root = self.pin().root
+        if pattern.startswith('/'):
+            matches = [('/', ())]
+        else:
+            matches = [('', self.context.cwd)]
+        components = [part for part in pattern.split('/') if part]
+        dirs_only = pattern.endswith('/')
+        for depth, component in enumerate(components):
+            last = depth == len(components) - 1
+            found = []
+            for shown, parts in matches:
+                node = self._get_node_at_path(parts, root)
+                if node is None or not node.is_dir:
+                    continue
+                if not is_glob(component):
+                    # обычный компонент ('.', '..' и имена) проходится как в путях
+                    child_parts = self._normalize_path(component, parts)
+                    if self._get_node_at_path(child_parts, root) is not None:
+                        found.append((shown + component, child_parts))
+                    continue
+                prefix = re.split(r'[*?[]', component, 1)[0]
+                match = re.compile(fnmatch.translate(component)).match
+                for name in node.names_with_prefix(prefix):
+                    # как в shell: скрытые имена - только шаблоном, начинающимся с точки
+                    if name.startswith('.') and not component.startswith('.'):
+                        continue
+                    if match(name):
+                        found.append((shown + name, parts + (name,)))
+            if not last:
+                found = [(shown + '/', parts) for shown, parts in found]
+            matches = found
+            if not matches:
+                return []
+        if not components:
+            return []
+        if dirs_only:
+            matches = [(shown + '/', parts) for shown, parts in matches
+                       if self._get_node_at_path(parts, root).is_dir]
+        return sorted(shown for shown, _ in matches)
+
+    # варианты дополнения слова-пути для Tab: (общее продолжение, первые limit
+    # вариантов, всего вариантов). варианты - слово целиком, директории с '/' на конце
+    def complete(self, word: str, limit: int) -> Tuple[str, List[str], int]:
+        
+        head, _, prefix = word.rpartition('/')
+        directory = head + '/' if '/' in word else ''
+        node = self._get_node_at_path(self._normalize_path(directory, self.context.cwd)
+                                      if directory else self.context.cwd)
+        if node is None or not node.is_dir:
+            return word, [], 0
+        names = node.names_with_prefix(prefix)
+        if not prefix:
+            # скрытые имена предлагаются только после введённой точки; в индексе они
+            # идут одним диапазоном
+            low = bisect.bisect_left(names, '.')
+            names[low:bisect.bisect_left(names, '/', low)] = []
+        if not names:
+            return word, [], 0
+        common = os.path.commonprefix([names[0], names[-1]])
+        shown = [directory + name + ('/' if node.children[name].is_dir else '')
+                 for name in names[:limit]]
+        if len(names) == 1:
+            return shown[0], shown, 1
+        return directory + common, shown, len(names)
     
 
     # возвращает текущий путь в виде абсолютного пути (например: /home/user или /).
     def get_current_path_str(self) -> str:
         
-        if not self._current_path:
-            return "/"
-        return "/" + "/".join(self._current_path)
+        return self._format_path(self.context.cwd)
     
 
+    # возвращает узел файла по пути либо вызывает исключение.
+    def _resolve_file(self, path: str) -> FileNode:
+        
+        if path == '/':
+            raise ValueError("Невозможно прочитать корень как файл")
+
+        resolved, node = self.resolve(path)
+        if node is None:
+            raise FileNotFoundError(f"Файл не найден: /{'/'.join(resolved)}")
+
+        if node.is_dir:
+            raise ValueError(f"Путь не является файлом: /{'/'.join(resolved)}")
+        return node
+
     def read_file(self, path: str) -> str:
         
         # читает содержимое файла по относительному или абсолютному пути.
         # возвращает содержимое (декодированное из base64, если возможно), либо вызывает исключение.
         
-        if path.startswith('/'):
-            if path == '/':
-                raise ValueError("Невозможно прочитать корень как файл")
-            target_parts = [p for p in path[1:].split('/') if p and p != '.']
-        else:
-            target_parts = self._current_path + [p for p in path.split('/') if p and p != '.']
+        return self._read_node(self._resolve_file(path))
 
-        # обработка '..'
-        resolved = []
-        for part in target_parts:
-            if part == '..':
-                if resolved:
-                    resolved.pop()
-            else:
-                resolved.append(part)
+    def _read_node(self, node: FileNode) -> str:
+        
+        content = node.content
+        if isinstance(content, str) and (not content or node.encoding == ENCODING_TEXT):
+            return content
 
-        node = self._vfs_tree
-        for part in resolved:
-            if node['type'] != 'dir' or part not in node['children']:
-                raise FileNotFoundError(f"Файл не найден: /{'/'.join(resolved)}")
-            node = node['children'][part]
+        # содержимое декодируется один раз, дальше берётся из кеша.
+        # ключ - хеш содержимого: копии файла (cp) и одинаковые файлы разделяют одну запись.
+        # содержимое без хеша ещё не читалось (см. PayloadStore) и в кеше его нет
+        if node.blob.hashed:
+            cached = self._content_cache.get(node.digest)
+            if cached is not None:
+                return cached
+        raw = node.raw_bytes()
+        decoded = None
+        if node.encoding in COMPRESSIONS:
+            # повреждённое сжатое содержимое - ошибка чтения (ValueError)
+            decoded = decompress(base64.b64decode(raw), node.encoding).decode('utf-8', errors='replace')
+        elif node.encoding == ENCODING_BASE64:
+            try:
+                decoded = base64.b64decode(raw.translate(None, _XML_WHITESPACE),
+                                           validate=True).decode('utf-8')
+            except Exception:
+                pass
+        if decoded is None:
+            # если не base64/UTF-8 — возвращаем как есть (предполагаем текст)
+            decoded = raw.decode('utf-8')
+        self._content_cache.put(node.digest, decoded)
+        return decoded
 
-        if node['type'] != 'file':
-            raise ValueError(f"Путь не является файлом: /{'/'.join(resolved)}")
+    def iter_file_chunks(self, path: str) -> Iterator[str]:
+        
+        # потоково читает содержимое файла блоками текста; ошибки пути - сразу, при вызове.
+        # небольшие и уже закешированные файлы отдаются целиком через read_file,
+        # крупные декодируются блоками прямо из хранилища и не материализуются целиком
+        return self._node_chunks(self._resolve_file(path))
 
-        content = node['content']
-        if content:
+    def _read_whole(self, node: FileNode) -> bool:
+        # файл читается целиком через _read_node (с кешем). размер сжатого файла после
+        # распаковки заранее неизвестен, поэтому он читается потоково, если не в кеше
+        if node.blob.hashed and node.digest in self._content_cache:
+            return True
+        return node.size < STREAM_THRESHOLD and node.encoding not in COMPRESSIONS
+
+    def _node_chunks(self, node: FileNode) -> Iterator[str]:
+        if self._read_whole(node):
+            text = self._read_node(node)
+            return iter((text,) if text else ())
+        return self._decode_chunks(node)
+
+    def iter_file_lines_reversed(self, path: str) -> Iterator[List[str]]:
+        # строки файла (в смысле str.split('\n')) от последней к первой, пачками по блоку.
+        # крупные файлы читаются блоками с конца прямо из хранилища: в памяти
+        # держится один блок и незавершённая строка на его границе
+        node = self._resolve_file(path)
+        if self._read_whole(node):
+            text = self._read_node(node)
+            if not text:
+                return iter(())
+            lines = text.split('\n')
+            lines.reverse()
+            return iter((lines,))
+        return self._reversed_line_batches(self._reversed_blocks(node))
+
+    @classmethod
+    def _reversed_blocks(cls, node: FileNode) -> Iterator[bytes]:
+        # декодированное содержимое блоками от конца к началу
+        if node.encoding in COMPRESSIONS:
+            # сжатый поток читается только с начала: распакованные блоки копятся в байтах
+            # (без строки и без кеша) и отдаются с конца, освобождаясь по одному
+            blocks = list(cls._decoded_blocks(node))
+            while blocks:
+                yield blocks.pop()
+            return
+        if node.encoding == ENCODING_TEXT or not cls._is_base64_text(node):
+            yield from node.iter_raw_reversed(STREAM_CHUNK_SIZE)
+            return
+        # конец base64 выровнен по 4 символам: начало блока, не кратное 4 символам
+        # (после удаления переносов строк), переходит в предыдущий блок
+        carry = b''
+        for raw in node.iter_raw_reversed(STREAM_CHUNK_SIZE):
+            data = raw.translate(None, _XML_WHITESPACE) + carry
+            split = len(data) % 4
+            carry = data[:split]
+            if split < len(data):
+                yield base64.b64decode(data[split:])
+
+    @staticmethod
+    def _reversed_line_batches(blocks: Iterator[bytes]) -> Iterator[List[str]]:
+        carry: List[bytes] = []  # начало незавершённой строки, фрагменты в обратном порядке
+        for block in blocks:
+            pos = block.rfind(b'\n')
+            if pos < 0:
+                carry.append(block)
+                continue
+            # строки режутся по байту \n, который не встречается внутри многобайтовых
+            # символов UTF-8, поэтому каждая строка декодируется целиком
+            carry.append(block[pos + 1:])
+            lines = block[:pos].split(b'\n')
+            lines.append(b''.join(reversed(carry)))
+            # первая строка блока может продолжаться в предыдущем блоке
+            carry = [lines[0]]
+            yield b'\n'.join(lines[:0:-1]).decode('utf-8', errors='replace').split('\n')
+        if carry:
+            yield [b''.join(reversed(carry)).decode('utf-8', errors='replace')]
+
+    @classmethod
+    def _decoded_blocks(cls, node: FileNode) -> Iterator[bytes]:
+        # декодированное содержимое блоками от начала: base64 - по блокам, кратным
+        # 4 символам без переносов строк (_base64_blocks), сжатое - потоковой
+        # распаковкой, блоками не больше STREAM_CHUNK_SIZE
+        raw_chunks = node.iter_raw(STREAM_CHUNK_SIZE)
+        if node.encoding == ENCODING_TEXT:
+            return raw_chunks
+        if node.encoding in COMPRESSIONS:
+            return iter_decompressed(_base64_blocks(raw_chunks), node.encoding, STREAM_CHUNK_SIZE)
+        if node.size < STREAM_THRESHOLD:
+            # небольшое содержимое декодируется целиком, как в _read_node
+            raw = node.raw_bytes()
             try:
-                # попытка декодировать base64
-                decoded = base64.b64decode(content, validate=True)
-                return decoded.decode('utf-8')
-            except Exception:
-                # если не base64 — возвращаем как есть (предполагаем текст)
-                return content
-        return ""
+                decoded = base64.b64decode(raw.translate(None, _XML_WHITESPACE), validate=True)
+                decoded.decode('utf-8')
+            except ValueError:
+                decoded = raw
+            return iter((decoded,) if decoded else ())
+        if not cls._is_base64_text(node):
+            return raw_chunks
+        return _base64_blocks(raw_chunks)
+
+    @staticmethod
+    def _is_base64_text(node: FileNode) -> bool:
+        # как и в _read_node: похожее на base64 содержимое, которое не декодируется
+        # в UTF-8, - обычный текст. после начала потокового вывода к исходному тексту
+        # уже не вернуться, поэтому крупный файл проверяется отдельным проходом,
+        # без накопления декодированных блоков
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for block in _base64_blocks(node.iter_raw(STREAM_CHUNK_SIZE), validate=True):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except ValueError:
+            return False
+        return True
+
+    @classmethod
+    def _decode_chunks(cls, node: FileNode) -> Iterator[str]:
+        
+        # некорректный UTF-8 в потоке заменяется символом U+FFFD: вернуть файл
+        # "как есть", как read_file, после начала вывода уже нельзя
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for block in cls._decoded_blocks(node):
+            text = decoder.decode(block)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
     
+    # обходит поддерево node (путь parts) в порядке путей, включая сам узел.
+    # разделяемые после cp -r поддеревья обходятся в каждом месте: у них разные пути
+    @staticmethod
+    def _walk(parts: PathParts, node: Node) -> Iterator[Tuple[PathParts, Node]]:
+        
+        stack = [(parts, node)]
+        while stack:
+            parts, node = stack.pop()
+            yield parts, node
+            if node.is_dir:
+                stack.extend((parts + (name,), node.children[name])
+                             for name in reversed(node.names()))
+
+    # поиск узлов для команды find: под path (по умолчанию текущая директория), с именем
+    # pattern (точное имя или glob) и типом kind ('f' - файл, 'd' - директория).
+    # с шаблоном кандидаты берутся из индекса имён, без шаблона обходится поддерево path
+    def find(self, path: Optional[str] = None, pattern: Optional[str] = None,
+             kind: Optional[str] = None) -> List[str]:
+        
+        version = self.pin()
+        if path is None:
+            resolved = self.context.cwd
+            node = self._get_node_at_path(resolved, version.root)
+        else:
+            resolved, node = self.resolve(path, version)
+        if node is None:
+            raise FileNotFoundError(f"Путь не найден: {self._format_path(resolved)}")
+
+        if pattern is None:
+            found = self._walk(resolved, node)
+        elif not self._indexed:
+            # обход в прямом порядке по отсортированным именам даёт тот же порядок,
+            # что и сортировка путей из индекса
+            match = re.compile(fnmatch.translate(pattern)).match if is_glob(pattern) else pattern.__eq__
+            found = ((parts, child) for parts, child in self._walk(resolved, node)
+                     if parts and match(parts[-1]))
+        else:
+            size = len(resolved)
+            with self._indexed_mounts(resolved):
+                candidates = sorted(parts for parts in self._name_index.find(pattern)
+                                    if parts[:size] == resolved)
+            # пути, перенесённые псевдонимами cp -r, могут не существовать
+            found = ((parts, self._get_node_at_path(parts, version.root)) for parts in candidates)
+        want_dir = None if kind is None else kind == 'd'
+        return [self._format_path(parts) for parts, node in found
+                if node is not None and (want_dir is None or node.is_dir == want_dir)]
+
+    # поиск строк по регулярному выражению в файле path или во всех файлах под
+    # директорией path. с индексом содержимого для шаблона без метасимволов
+    # просматриваются только файлы, содержащие все его n-граммы
+    def grep(self, path: str, pattern: str) -> GrepResult:
+        
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"неверный шаблон: {e}")
+        version = self.pin()
+        resolved, node = self.resolve(path, version)
+        if node is None:
+            raise FileNotFoundError(f"Путь не найден: {self._format_path(resolved)}")
+        if not node.is_dir:
+            return GrepResult(False, 1, self._grep_files([(resolved, node)], regex))
+
+        digests = paths = None
+        literal = literal_pattern(pattern)
+        if self._content_index is not None and literal is not None:
+            with self._indexed_mounts(resolved):
+                hit = self._content_index.candidates(literal)
+                if hit is not None:
+                    digests, entries = hit
+                    if len(entries) * GREP_SELECTIVE_RATIO <= len(self._name_index):
+                        paths = sorted(self._name_index.expand(
+                            self._name_index.path(entry) for entry in entries))
+        if paths is not None:
+            # мало кандидатов: пути берутся из индекса, дерево не обходится
+            size = len(resolved)
+            files = []
+            for parts in paths:
+                if parts[:size] != resolved:
+                    continue
+                candidate = self._get_node_at_path(parts, version.root)
+                if candidate is not None and not candidate.is_dir and candidate.digest in digests:
+                    files.append((parts, candidate))
+        else:
+            # кандидатов много: дешевле обойти поддерево, но содержимое без всех
+            # n-грамм шаблона всё равно не просматривается
+            files = [(parts, child) for parts, child in self._walk(resolved, node)
+                     if not child.is_dir and (digests is None or child.digest in digests)]
+        return GrepResult(True, len(files), self._grep_files(files, regex))
+
+    def _grep_files(self, files: List[Tuple[PathParts, FileNode]], regex) -> Iterator[Tuple[str, str]]:
+        # совпадения отдаются по мере просмотра файла. одинаковое содержимое (один Blob
+        # хранилища: cp, типовые файлы) просматривается один раз за запрос: строки
+        # запоминаются только для содержимого, которое встретится ещё раз, не больше
+        # GREP_MEMO_LIMIT символов на все файлы, и забываются после последней копии
+        remaining = Counter(node.blob for _, node in files)
+        memo: Dict[Blob, List[str]] = {}
+        budget = GREP_MEMO_LIMIT
+        for parts, node in files:
+            blob = node.blob
+            path = self._format_path(parts)
+            remaining[blob] -= 1
+            lines = memo.pop(blob, None) if not remaining[blob] else memo.get(blob)
+            if lines is not None:
+                for line in lines:
+                    yield path, line
+                if not remaining[blob]:
+                    budget += sum(map(len, lines))
+                continue
+            collected: Optional[List[str]] = [] if remaining[blob] else None
+            for line in self._matching_lines(node, regex):
+                if collected is not None:
+                    if len(line) <= budget:
+                        budget -= len(line)
+                        collected.append(line)
+                    else:
+                        # не помещается: копии просматриваются заново
+                        budget += sum(map(len, collected))
+                        collected = None
+                yield path, line
+            if collected is not None:
+                memo[blob] = collected
+
+    def _matching_lines(self, node: FileNode, regex) -> Iterator[str]:
+        # строки файла как у grep: перевод строки в конце файла не даёт пустой строки
+        tail = ''
+        for chunk in self._node_chunks(node):
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                if regex.search(line):
+                    yield line
+        if tail and regex.search(tail):
+            yield tail
+
     #-------------------------------------------------------5--------------------------------------------------------
     def mkdir(self, path: str) -> str:
         # cоздает директорию по указанному пути.
         # путь может быть абсолютным или относительным.
         
-        if path.startswith('/'):
-            if path == '/':
-                return "Ошибка: невозможно создать корневую директорию\n"
-            target_parts = [p for p in path[1:].split('/') if p and p != '.']
-        else:
-            target_parts = self._current_path + [p for p in path.split('/') if p and p != '.']
+        if path == '/':
+            return "Ошибка: невозможно создать корневую директорию\n"
         
-        # обработка '..'
-        resolved = []
-        for part in target_parts:
-            if part == '..':
-                if resolved:
-                    resolved.pop()
-            else:
-                resolved.append(part)
-        
-        # проверяем, не пытаемся ли создать существующую директорию
-        existing_node = self._get_node_at_path(resolved)
-        if existing_node:
-            abs_path = '/' + '/'.join(resolved) if resolved else '/'
-            return f"Ошибка: директория уже существует: {abs_path}\n"
-        
-        # создаем директорию рекурсивно
         try:
-            self._create_directory_recursive(resolved)
+            # проверка и создание - в одной транзакции: другой писатель не успеет
+            # создать ту же директорию между ними
+            with self._transaction():
+                # проверяем, не пытаемся ли создать существующую директорию
+                resolved, existing_node = self.resolve(path)
+                if existing_node is not None:
+                    return f"Ошибка: директория уже существует: {self._format_path(resolved)}\n"
+
+                # создаем директорию рекурсивно
+                self._create_directory_recursive(resolved)
+                self._journal_append(OP_MKDIR, resolved)
             return ""
         except Exception as e:
             return f"Ошибка создания директории: {e}\n"
     
-    def _create_directory_recursive(self, path_parts: List[str]) -> None:
+    def _create_directory_recursive(self, path_parts: Sequence[str]) -> None:
         """Рекурсивно создает директории по указанному пути"""
-        current_node = self._vfs_tree
+        self._writable_node(path_parts, create=True)
+
+    def _writable_node(self, path_parts: Sequence[str], create: bool = False) -> Node:
+        # проходит путь для изменения в черновике транзакции: опубликованные директории
+        # на нём заменяются копиями, остальное дерево остаётся общим с версией, которую
+        # в это время читают. при create=True недостающие директории создаются
+        current_node = self._draft = self._own(self._draft)
+        self._changed.append(tuple(path_parts))
+        # хеши Меркла устаревают только у директорий на изменяемом пути
+        current_node.digest = None
         
-        for part in path_parts:
-            if current_node['type'] != 'dir':
+        for depth, part in enumerate(path_parts, 1):
+            if not current_node.is_dir:
                 raise ValueError("Промежуточный путь не является директорией")
             
-            if part not in current_node['children']:
+            child = current_node.get(part)
+            if child is None:
+                if not create:
+                    raise ValueError(f"Директория назначения не существует: {part}")
                 # создаем новую директорию
-                current_node['children'][part] = {'type': 'dir', 'children': {}}
+                child = DirNode()
+                self._owned.add(id(child))
+                current_node.add(part, child)
+                self._on_commit.append(partial(self._name_index.add, tuple(path_parts[:depth]), True))
+            elif isinstance(child, MountDir):
+                raise ValueError("директория смонтирована только для чтения: "
+                                 + self._format_path(tuple(path_parts[:depth])))
+            elif child.is_dir:
+                writable = self._own(child)
+                if writable is not child:
+                    current_node.add(part, writable)
+                    child = writable
             
-            current_node = current_node['children'][part]
+            current_node = child
+            if current_node.is_dir:
+                current_node.digest = None
+        return current_node
 
 
 
 
     
-    def cp(self, source: str, destination: str) -> str:
+    def cp(self, source: str, destination: str, recursive: bool = False) -> str:
         
         # копирует файл из source в destination.
-        # поддерживает только копирование файлов (не директорий).
+        # директории копируются только с recursive=True (cp -r): копия разделяет
+        # поддерево с источником и занимает O(1) времени и памяти.
+        # проверки и копирование - в одной транзакции, ошибка копирования её отменяет
+        try:
+            with self._transaction():
+                return self._cp(source, destination, recursive)
+        except Exception as e:
+            return f"Ошибка копирования: {e}\n"
+
+    def _cp(self, source: str, destination: str, recursive: bool) -> str:
         
         # получает исходный файл
-        if source.startswith('/'):
-            source_parts = [p for p in source[1:].split('/') if p and p != '.']
-        else:
-            source_parts = self._current_path + [p for p in source.split('/') if p and p != '.']
+        resolved_source, source_node = self.resolve(source)
+        if source_node is None:
+            return f"Ошибка: исходный файл не найден: {self._format_path(resolved_source)}\n"
         
-        # обработка '..' для source
-        resolved_source = []
-        for part in source_parts:
-            if part == '..':
-                if resolved_source:
-                    resolved_source.pop()
-            else:
-                resolved_source.append(part)
-        
-        source_node = self._get_node_at_path(resolved_source)
-        if not source_node:
-            abs_source = '/' + '/'.join(resolved_source) if resolved_source else '/'
-            return f"Ошибка: исходный файл не найден: {abs_source}\n"
-        
-        if source_node['type'] != 'file':
-            abs_source = '/' + '/'.join(resolved_source) if resolved_source else '/'
-            return f"Ошибка: исходный путь не является файлом: {abs_source}\n"
+        if source_node.is_dir and not recursive:
+            return f"Ошибка: исходный путь не является файлом: {self._format_path(resolved_source)}\n"
         
         # обрабатывает путь назначения
-        if destination.startswith('/'):
-            dest_parts = [p for p in destination[1:].split('/') if p and p != '.']
-        else:
-            dest_parts = self._current_path + [p for p in destination.split('/') if p and p != '.']
-        
-        # обработка '..' для destination
-        resolved_dest = []
-        for part in dest_parts:
-            if part == '..':
-                if resolved_dest:
-                    resolved_dest.pop()
-            else:
-                resolved_dest.append(part)
+        resolved_dest, dest_node = self.resolve(destination)
+
+        # общее поддерево внутри самого себя дало бы цикл
+        if source_node.is_dir and resolved_dest[:len(resolved_source)] == resolved_source:
+            return (f"Ошибка: нельзя скопировать директорию {self._format_path(resolved_source)} "
+                    f"в саму себя: {self._format_path(resolved_dest)}\n")
         
         # если destination - директория, используем исходное имя файла
-        dest_node = self._get_node_at_path(resolved_dest)
-        if dest_node and dest_node['type'] == 'dir':
+        if dest_node is not None and dest_node.is_dir:
             filename = resolved_source[-1]  # берем имя файла из source
-            resolved_dest.append(filename)
-            dest_node = None  # сбрасываем, т.к. путь изменился
+            resolved_dest = resolved_dest + (filename,)
+            dest_node = dest_node.get(filename)
         
         # проверяет, не перезаписываем ли существующий файл
-        existing_dest = self._get_node_at_path(resolved_dest)
-        if existing_dest:
-            abs_dest = '/' + '/'.join(resolved_dest) if resolved_dest else '/'
-            return f"Ошибка: файл назначения уже существует: {abs_dest}\n"
+        if dest_node is not None:
+            return f"Ошибка: файл назначения уже существует: {self._format_path(resolved_dest)}\n"
         
         # копируем файл
-        try:
-            self._copy_file(resolved_source, resolved_dest, source_node)
-            return ""
-        except Exception as e:
-            return f"Ошибка копирования: {e}\n"
+        self._copy_file(resolved_source, resolved_dest, source_node)
+        self._journal_append(OP_CP_DIR if source_node.is_dir else OP_CP,
+                             resolved_source, resolved_dest)
+        return ""
     
-    def _copy_file(self, source_parts: List[str], dest_parts: List[str], source_node: Dict[str, Any]) -> None:
-        # копирует файл из source_parts в dest_parts
-        # создаем директории для пути назначения
+    def _copy_file(self, source_parts: Sequence[str], dest_parts: Sequence[str], source_node: Node) -> None:
+        # копирует файл (или директорию, разделяя поддерево) из source_parts в dest_parts
         parent_dest_parts = dest_parts[:-1]
         filename = dest_parts[-1]
         
-        current_node = self._vfs_tree
-        
         # проходим по пути назначения (кроме последнего элемента - имени файла)
-        for part in parent_dest_parts:
-            if current_node['type'] != 'dir':
-                raise ValueError("Промежуточный путь не является директорией")
-            
-            if part not in current_node['children']:
-                raise ValueError(f"Директория назначения не существует: {part}")
-            
-            current_node = current_node['children'][part]
+        current_node = self._writable_node(parent_dest_parts)
         
         # создаем копию файла
-        if current_node['type'] != 'dir':
+        if not current_node.is_dir:
             raise ValueError("Путь назначения не является директорией")
         
-        current_node['children'][filename] = {
-            'type': 'file',
-            'content': source_node['content']
-        }
+        if source_node.is_dir:
+            current_node.add(filename, source_node.share())
+        else:
+            source_node = source_node.copy()
+            current_node.add(filename, source_node)
+        self._on_commit.append(partial(self._index_copy, tuple(source_parts), tuple(dest_parts),
+                                       source_node))
+
+    # индексирует копию после публикации транзакции: директория - псевдонимом, файл - записью.
+    def _index_copy(self, source_parts: PathParts, dest_parts: PathParts, node: Node) -> None:
+        
+        # копия ссылается на узлы образа: после его выгрузки она находится по его индексу
+        for mount in self._mounts.enclosing(source_parts):
+            mount.pinned = True
+        if node.is_dir:
+            self._name_index.add_alias(source_parts, dest_parts)
+        else:
+            entry = self._name_index.add(dest_parts)
+            if self._content_index is not None:
+                self._content_index.add_file(entry, node)
 
+
+    # монтирует XML-образ source (путь в файловой системе) в директорию path VFS:
+    # path не должен существовать или должен быть пустой директорией. образ не
+    # разбирается до первого входа в точку монтирования
+    def mount(self, source: str, path: str) -> str:
+        
+        if not os.path.isfile(source):
+            return f"Ошибка: образ не найден: {source}\n"
+        source = os.path.abspath(source)
+        try:
+            with self._transaction():
+                resolved, node = self.resolve(path)
+                if not resolved:
+                    return "Ошибка: невозможно смонтировать образ в корень\n"
+                if node is not None and (not node.is_dir or isinstance(node, MountDir)
+                                         or node.children):
+                    return f"Ошибка: точка монтирования занята: {self._format_path(resolved)}\n"
+                mount = self._attach(resolved, source)
+                base_dir = os.path.dirname(os.path.abspath(self._vfs_xml_path))
+                self._journal_append(OP_MOUNT, resolved,
+                                     tuple(relative_source(base_dir, source).split('/')))
+        except Exception as e:
+            return f"Ошибка монтирования: {e}\n"
+        # в таблицу - только опубликованная точка монтирования
+        self._mounts.register(mount)
+        return ""
+
+    def _attach(self, parts: PathParts, source: str) -> MountDir:
+        parent = self._writable_node(parts[:-1])
+        if not parent.is_dir:
+            raise ValueError("Путь назначения не является директорией")
+        mount = self._mounts.create(source, parts)
+        parent.add(parts[-1], mount)
+        self._on_commit.append(partial(self._name_index.add_mount, parts))
+        return mount
+
+    # таблица монтирования для команды mount: путь, образ, состояние.
+    # образы не загружаются
+    def mount_table(self) -> str:
+        
+        lines = []
+        for parts, mount in self._mounts.entries():
+            if mount.error is not None:
+                state = f"ошибка: {mount.error}"
+            elif mount.loaded:
+                state = f"загружен, узлов: {mount.nodes}, {mount.load_ms:.1f} мс"
+            else:
+                state = "не загружен"
+            lines.append(f"{self._format_path(parts)} <- {mount.source} ({state})\n")
+        return ''.join(lines)
+
+    # выгружает все загруженные смонтированные образы; возвращает их число.
+    # следующий вход в точку монтирования разберёт образ снова
+    def unload_mounts(self) -> int:
+        
+        return self._mounts.unload_all()
+
+    # индексирует смонтированные под parts (или содержащие parts) образы перед поиском
+    # по индексу: образы загружаются, вложенные точки монтирования - следом за ними.
+    # индекс дописывается только писателем, поэтому - под блокировкой писателей. она
+    # держится, пока вызывающий читает индексы: образ, выгруженный при индексации
+    # соседнего, иначе убрал бы из них другой поток (_apply_evictions) до чтения
+    @contextmanager
+    def _indexed_mounts(self, parts: PathParts) -> Iterator[None]:
+        
+        if not len(self._mounts):
+            yield
+            return
+        on_file = self._content_index.add_file if self._content_index is not None else None
+        with self._write_lock:
+            self._apply_evictions()
+            pending = self._name_index.take_mounts(parts)
+            while pending:
+                for mount_parts in pending:
+                    # последняя версия: точка могла появиться после версии запроса
+                    node = self._get_node_at_path(mount_parts)
+                    if node is not None and node.is_dir:
+                        self._name_index.add_tree(mount_parts, node, on_file)
+                pending = self._name_index.take_mounts(parts)
+            yield
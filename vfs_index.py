@@ -0,0 +1,317 @@
+import fnmatch
+import re
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from vfs_nodes import DirNode, FileNode
+from vfs_mount import MountDir
+
+# индексы для find и grep, строятся при загрузке VFS и обновляются mkdir и cp.
+#
+# индекс имён: каждый узел - запись (номер родителя, имя), путь восстанавливается
+# по цепочке родителей, поэтому запись занимает несколько байтов, а не кортеж пути.
+# cp -r не индексирует скопированное поддерево заново (копия стоит O(1)): копия
+# запоминается псевдонимом (источник, назначение), найденные в источнике пути при
+# запросе переносятся в назначение. псевдоним может дать путь, созданный в источнике
+# уже после копии, поэтому вызывающий проверяет найденные пути по дереву.
+#
+# индексы только дописываются (писатели VFS выполняются по одному), поэтому читатели
+# других потоков обходят их без блокировок: записи, добавленные во время запроса,
+# дают лишние кандидаты, которые вызывающий всё равно отсеивает по своей версии дерева.
+#
+# смонтированные образы не загружаются ради индекса: точка монтирования запоминается,
+# и её содержимое индексируется при первом поиске под ней (take_mounts, add_tree).
+# после выгрузки образа его записи убираются из поиска (evict), а точка снова ждёт
+# индексации; номера записей не переиспользуются, поэтому в массивах остаётся
+# несколько байтов на запись, а имена и списки записей освобождаются.
+#
+# индекс содержимого (необязательный): n-грамма декодированного текста -> номера
+# уникальных Blob; одинаковое содержимое после дедупликации индексируется один раз.
+
+PathParts = Tuple[str, ...]
+
+ROOT_ID = 0
+
+# длина n-граммы индекса содержимого: шаблоны короче ищутся без индекса
+NGRAM_SIZE = 3
+
+_GLOB_CHARS = re.compile(r'[*?[]')
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def is_glob(pattern: str) -> bool:
+    return _GLOB_CHARS.search(pattern) is not None
+
+
+def literal_pattern(pattern: str) -> Optional[str]:
+    # шаблон grep без метасимволов регулярных выражений - обычная строка
+    if any(char in _REGEX_CHARS for char in pattern):
+        return None
+    return pattern
+
+
+class NameIndex:
+    # имя -> записи узлов с этим именем; псевдонимы cp -r хранятся в порядке копирования
+
+    def __init__(self):
+        self._parents = array('i', [-1])
+        self._names: List[str] = ['']
+        self._by_name: Dict[str, List[int]] = {}
+        self._distinct: List[str] = []  # имена в порядке появления: glob перебирает их
+        self._dir_ids: Dict[PathParts, int] = {(): ROOT_ID}
+        self.aliases: List[Tuple[PathParts, PathParts]] = []
+        self._mounts: Dict[PathParts, None] = {}  # ещё не проиндексированные точки монтирования
+        self._trees: Dict[PathParts, Tuple[int, int]] = {}  # add_tree: путь -> диапазон записей
+        self._dropped = 0  # записей, убранных evict
+
+    @classmethod
+    def build(cls, root: DirNode,
+              on_file: Optional[Callable[[int, FileNode], None]] = None) -> 'NameIndex':
+        index = cls()
+        index.add_tree((), root, on_file)
+        return index
+
+    def add_tree(self, parts: PathParts, node: DirNode,
+                 on_file: Optional[Callable[[int, FileNode], None]] = None) -> None:
+        # индексирует содержимое директории node по пути parts обходом на явном стеке;
+        # on_file(запись, узел) - для каждого файла. в точки монтирования не спускается
+        start = len(self._names)
+        root_parts = parts
+        stack = [(parts, node)]
+        while stack:
+            parts, node = stack.pop()
+            parent_id = self._dir_id(parts)
+            for name, child in node.items():
+                child_parts = parts + (name,)
+                entry = self._append(parent_id, name)
+                if isinstance(child, MountDir):
+                    self._dir_ids[child_parts] = entry
+                    self._mounts[child_parts] = None
+                elif child.is_dir:
+                    self._dir_ids[child_parts] = entry
+                    stack.append((child_parts, child))
+                elif on_file is not None:
+                    on_file(entry, child)
+        self._trees[root_parts] = (start, len(self._names))
+
+    def __len__(self) -> int:
+        # число записей без корня и убранных
+        return len(self._names) - 1 - self._dropped
+
+    @property
+    def name_count(self) -> int:
+        return len(self._by_name)
+
+    @property
+    def pending_mounts(self) -> int:
+        return len(self._mounts)
+
+    def _append(self, parent_id: int, name: str) -> int:
+        entry = len(self._names)
+        self._parents.append(parent_id)
+        self._names.append(name)
+        entries = self._by_name.get(name)
+        if entries is None:
+            entries = self._by_name[name] = []
+            self._distinct.append(name)
+        entries.append(entry)
+        return entry
+
+    def _dir_id(self, parts: PathParts) -> int:
+        # запись директории; директории внутри копии cp -r регистрируются при первом обращении
+        entry = self._dir_ids.get(parts)
+        if entry is None:
+            entry = self._dir_ids[parts] = self._append(self._dir_id(parts[:-1]), parts[-1])
+        return entry
+
+    def add(self, parts: PathParts, is_dir: bool = False) -> int:
+        # новый узел по пути parts (mkdir, cp)
+        if is_dir:
+            return self._dir_id(parts)
+        return self._append(self._dir_id(parts[:-1]), parts[-1])
+
+    def add_alias(self, source: PathParts, dest: PathParts) -> None:
+        # cp -r: поддерево dest совпадает с поддеревом source на момент копирования
+        self._dir_id(dest)
+        self.aliases.append((source, dest))
+        # псевдоним переносит только проиндексированное: точки монтирования копии
+        # индексируются сами
+        size = len(source)
+        for parts in [parts for parts in self._mounts if parts[:size] == source]:
+            self._mounts[dest + parts[size:]] = None
+
+    def add_mount(self, parts: PathParts) -> None:
+        # новая точка монтирования (mount)
+        self._dir_id(parts)
+        self._mounts[parts] = None
+
+    def copies(self, parts: PathParts) -> Set[PathParts]:
+        # путь parts и пути, под которыми его поддерево видно через копии cp -r
+        found = {parts}
+        for source, dest in self.aliases:
+            size = len(source)
+            found.update([dest + path[size:] for path in found if path[:size] == source])
+        return found
+
+    def evict(self, parts: PathParts) -> Set[int]:
+        # образ, смонтированный в parts, выгружен: его записи (и записи вложенных образов
+        # и копий cp -r) убираются из поиска, точка монтирования снова ждёт индексации.
+        # возвращает номера убранных записей
+        dropped: Set[int] = set()
+        for copy in self.copies(parts):
+            size = len(copy)
+            for path in [path for path in self._trees if path[:size] == copy]:
+                start, end = self._trees.pop(path)
+                dropped.update(range(start, end))
+            for path in [path for path in self._dir_ids if len(path) > size and path[:size] == copy]:
+                del self._dir_ids[path]
+            for path in [path for path in self._mounts if len(path) > size and path[:size] == copy]:
+                del self._mounts[path]
+            self._mounts[copy] = None
+        self._dropped += len(dropped)
+        by_name: Dict[str, List[int]] = {}
+        for entry in dropped:
+            by_name.setdefault(self._names[entry], []).append(entry)
+            self._names[entry] = ''
+        emptied = False
+        for name, entries in by_name.items():
+            removed = set(entries)
+            # список заменяется, а не изменяется: читатели могут обходить старый
+            kept = [entry for entry in self._by_name.get(name, ()) if entry not in removed]
+            if kept:
+                self._by_name[name] = kept
+            else:
+                self._by_name.pop(name, None)
+                emptied = True
+        if emptied:
+            self._distinct = [name for name in self._distinct if name in self._by_name]
+        return dropped
+
+    def take_mounts(self, scope: PathParts) -> List[PathParts]:
+        # непроиндексированные точки монтирования под scope или содержащие scope;
+        # вызывающий индексирует их (add_tree), вложенные появятся при следующем вызове
+        size = len(scope)
+        found = [parts for parts in self._mounts
+                 if parts[:size] == scope or scope[:len(parts)] == parts]
+        for parts in found:
+            del self._mounts[parts]
+        return found
+
+    def path(self, entry: int) -> PathParts:
+        parts = []
+        while entry != ROOT_ID:
+            parts.append(self._names[entry])
+            entry = self._parents[entry]
+        parts.reverse()
+        return tuple(parts)
+
+    def expand(self, paths: Iterable[PathParts]) -> Set[PathParts]:
+        # добавляет пути, полученные копированием: псевдонимы применяются в порядке
+        # копирования, поэтому копия копии тоже находится
+        found = set(paths)
+        for source, dest in self.aliases:
+            size = len(source)
+            # сама директория source попадает в dest под другим именем, dest уже в индексе
+            copied = [dest + parts[size:] for parts in found
+                      if len(parts) > size and parts[:size] == source]
+            found.update(copied)
+        return found
+
+    def find(self, pattern: str) -> Set[PathParts]:
+        # пути-кандидаты узлов с именем pattern (точное имя или glob)
+        if is_glob(pattern):
+            match = re.compile(fnmatch.translate(pattern)).match
+            # список имён, а не словарь: его можно обходить, пока писатель дописывает
+            entries = [entry for name in self._distinct if match(name)
+                       for entry in self._by_name.get(name, ())]
+        else:
+            entries = self._by_name.get(pattern, ())
+        return self.expand(self.path(entry) for entry in entries)
+
+
+class ContentIndex:
+    # n-грамма -> номера Blob, Blob -> записи файлов в индексе имён
+
+    def __init__(self, decode: Callable[[FileNode], Iterable[str]]):
+        self._decode = decode  # декодированное содержимое файла блоками текста
+        self._blob_ids: Dict[bytes, int] = {}
+        self._digests: List[bytes] = []
+        self._files: List[array] = []
+        self._postings: Dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._blob_ids)
+
+    @property
+    def ngram_count(self) -> int:
+        return len(self._postings)
+
+    def add_file(self, entry: int, node: FileNode) -> None:
+        blob_id = self._blob_ids.get(node.digest)
+        if blob_id is None:
+            blob_id = self._blob_ids[node.digest] = len(self._digests)
+            self._digests.append(node.digest)
+            self._files.append(array('i'))
+            for gram in self._ngrams(self._decode(node)):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array('i')
+                postings.append(blob_id)
+        self._files[blob_id].append(entry)
+
+    def discard(self, entries: Set[int]) -> None:
+        # убирает записи файлов (выгруженный образ); Blob без файлов покидает индекс
+        # вместе со своими n-граммами. номер Blob не переиспользуется. массивы
+        # заменяются, а не изменяются: читатели могут обходить старые
+        if not entries:
+            return
+        emptied = set()
+        for blob_id, files in enumerate(self._files):
+            if any(entry in entries for entry in files):
+                kept = array('i', [entry for entry in files if entry not in entries])
+                self._files[blob_id] = kept
+                if not kept:
+                    emptied.add(blob_id)
+                    self._blob_ids.pop(self._digests[blob_id], None)
+                    self._digests[blob_id] = b''
+        if not emptied:
+            return
+        for gram, postings in list(self._postings.items()):
+            if any(blob_id in emptied for blob_id in postings):
+                kept = array('i', [blob_id for blob_id in postings if blob_id not in emptied])
+                if kept:
+                    self._postings[gram] = kept
+                else:
+                    del self._postings[gram]
+
+    @staticmethod
+    def _ngrams(chunks: Iterable[str]) -> Set[str]:
+        # n-граммы текста; хвост блока переносится, чтобы не потерять n-граммы на границе
+        grams: Set[str] = set()
+        tail = ''
+        for chunk in chunks:
+            text = tail + chunk
+            grams.update(text[pos:pos + NGRAM_SIZE]
+                         for pos in range(len(text) - NGRAM_SIZE + 1))
+            tail = text[-(NGRAM_SIZE - 1):]
+        return grams
+
+    def candidates(self, literal: str) -> Optional[Tuple[Set[bytes], List[int]]]:
+        # хеши содержимого, где есть все n-граммы строки, и записи их файлов;
+        # None - строка короче n-граммы, индекс не помогает
+        if len(literal) < NGRAM_SIZE:
+            return None
+        postings = []
+        for gram in {literal[pos:pos + NGRAM_SIZE]
+                     for pos in range(len(literal) - NGRAM_SIZE + 1)}:
+            found = self._postings.get(gram)
+            if found is None:
+                return set(), []
+            postings.append(found)
+        postings.sort(key=len)
+        blob_ids = set(postings[0])
+        for found in postings[1:]:
+            if not blob_ids:
+                break
+            blob_ids.intersection_update(found)
+        return ({self._digests[blob_id] for blob_id in blob_ids},
+                [entry for blob_id in blob_ids for entry in self._files[blob_id]])
@@ -0,0 +1,139 @@
+import os
+import shutil
+import struct
+import zlib
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+# журнал изменений VFS: заголовок | записи. журнал лежит рядом с XML-образом,
+# привязан к SHA-256 образа, к которому применяется, и только дописывается,
+# поэтому сохранение одной команды стоит O(1) независимо от размера образа.
+# при загрузке записи применяются поверх образа; с первой обрезанной, повреждённой
+# или не согласующейся с образом записи остаток журнала не применяется, а
+# откладывается в сторону (*.journal.stale), чтобы его можно было разобрать вручную.
+
+JOURNAL_SUFFIX = '.journal'
+STALE_SUFFIX = '.stale'
+JOURNAL_MAGIC = b'VFSJRNL1'
+
+# magic, SHA-256 базового образа
+_HEADER = struct.Struct('<8s32s')
+# операция, длина данных, CRC32 данных
+_RECORD = struct.Struct('<BII')
+
+OP_MKDIR = 1
+OP_CP = 2          # копия файла
+OP_CP_DIR = 3      # cp -r
+OP_MOUNT = 4       # mount: точка монтирования, путь образа относительно XML
+
+PathParts = Tuple[str, ...]
+
+
+class JournalRecord(NamedTuple):
+    op: int
+    paths: Tuple[PathParts, ...]  # нормализованные абсолютные пути
+    end: int                      # смещение конца записи в файле
+
+
+def journal_path(vfs_xml_path: str) -> str:
+    return vfs_xml_path + JOURNAL_SUFFIX
+
+
+def stale_path(path: str) -> str:
+    # свободное имя для отложенного журнала: <журнал>.stale, если оно занято -
+    # <образ>.N.journal.stale
+    candidate = path + STALE_SUFFIX
+    base = path[:-len(JOURNAL_SUFFIX)] if path.endswith(JOURNAL_SUFFIX) else path
+    num = 1
+    while os.path.exists(candidate):
+        candidate = f"{base}.{num}{JOURNAL_SUFFIX}{STALE_SUFFIX}"
+        num += 1
+    return candidate
+
+
+def save_tail(f: BinaryIO, start: int, xml_sha256: str, path: str) -> Optional[Tuple[str, int]]:
+    # записывает остаток журнала f после смещения start в отдельный журнал того же
+    # образа (заголовок и записи как есть); возвращает (его путь, байтов остатка)
+    # или None, если остатка нет
+    size = os.fstat(f.fileno()).st_size
+    if size <= start:
+        return None
+    target = stale_path(path)
+    f.seek(start)
+    with open(target, 'wb') as out:
+        out.write(_HEADER.pack(JOURNAL_MAGIC, bytes.fromhex(xml_sha256)))
+        shutil.copyfileobj(f, out)
+    return target, size - start
+
+
+def _encode_paths(paths: Tuple[PathParts, ...]) -> bytes:
+    # пути разделяются нулевым байтом, имена в пути - '/', как в командах
+    return b'\0'.join(('/' + '/'.join(parts)).encode('utf-8') for parts in paths)
+
+
+def _decode_paths(data: bytes) -> Tuple[PathParts, ...]:
+    return tuple(tuple(part for part in path.decode('utf-8').split('/') if part)
+                 for path in data.split(b'\0'))
+
+
+def read_header(f: BinaryIO) -> Optional[str]:
+    # SHA-256 базового образа или None, если это не журнал VFS
+    header = f.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        return None
+    magic, sha = _HEADER.unpack(header)
+    if magic != JOURNAL_MAGIC:
+        return None
+    return sha.hex()
+
+
+def iter_records(f: BinaryIO) -> Iterator[JournalRecord]:
+    # читает записи после заголовка до конца файла или первой повреждённой записи
+    pos = f.tell()
+    while True:
+        head = f.read(_RECORD.size)
+        if len(head) != _RECORD.size:
+            return
+        op, length, crc = _RECORD.unpack(head)
+        data = f.read(length)
+        if len(data) != length or zlib.crc32(data) != crc:
+            return
+        pos += _RECORD.size + length
+        yield JournalRecord(op, _decode_paths(data), pos)
+
+
+class JournalWriter:
+    # дописывает записи в журнал; каждая запись сбрасывается в ОС сразу после записи
+
+    def __init__(self, path: str, xml_sha256: str, valid_end: Optional[int] = None):
+        # valid_end - конец последней применённой записи существующего журнала:
+        # всё после него (обрезанный хвост) отбрасывается. None - начать новый журнал
+        self.path = path
+        self.records = 0
+        if valid_end is None:
+            self._file = open(path, 'wb')
+            self._write_header(xml_sha256)
+        else:
+            self._file = open(path, 'r+b')
+            self._file.truncate(valid_end)
+            self._file.seek(valid_end)
+
+    def _write_header(self, xml_sha256: str) -> None:
+        self._file.write(_HEADER.pack(JOURNAL_MAGIC, bytes.fromhex(xml_sha256)))
+        self._file.flush()
+
+    def append(self, op: int, *paths: PathParts) -> None:
+        data = _encode_paths(paths)
+        self._file.write(_RECORD.pack(op, len(data), zlib.crc32(data)) + data)
+        self._file.flush()
+        self.records += 1
+
+    def reset(self, xml_sha256: str) -> None:
+        # после сжатия журнал начинается заново для нового образа
+        self._file.seek(0)
+        self._file.truncate()
+        self._write_header(xml_sha256)
+        os.fsync(self._file.fileno())
+        self.records = 0
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,93 @@
+import hashlib
+from typing import Iterator, Optional, Tuple
+from vfs_nodes import DirNode, FileNode
+
+# дерево Меркла над VFS: хеш файла - хеш его содержимого в хранилище (PayloadStore),
+# хеш директории - SHA-256 отсортированного списка (имя, тип, хеш ребёнка).
+# хеши хранятся в узлах; изменение сбрасывает их только на изменённом пути,
+# поэтому пересчёт затрагивает лишь изменённые директории, а сравнение образов
+# спускается только в поддеревья с разными хешами.
+
+PathParts = Tuple[str, ...]
+
+DIFF_ADDED = '+'
+DIFF_REMOVED = '-'
+DIFF_MODIFIED = 'M'
+
+
+def file_digest(node: FileNode) -> bytes:
+    # вычислен при добавлении содержимого в хранилище
+    return node.digest
+
+
+def tree_digest(root: DirNode, load_mounts: bool = True) -> Optional[bytes]:
+    # пересчитывает хеши директорий без актуального хеша: обход в обратном порядке
+    # (дети раньше родителя) на явном стеке, директории с хешем не посещаются.
+    # load_mounts=False - незагруженные смонтированные образы не загружаются, хеши
+    # директорий над ними остаются неизвестными (None)
+    if root.digest is not None:
+        return root.digest
+    stack = [(root, False)]
+    while stack:
+        node, children_ready = stack.pop()
+        if not children_ready:
+            if node.digest is None:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values()
+                             if child.is_dir and child.digest is None
+                             and (load_mounts or child.loaded))
+            continue
+        hasher = hashlib.sha256()
+        # упорядоченный индекс имён строится здесь один раз и нужен потом ls и глобам
+        for name in node.names():
+            child = node.children[name]
+            hasher.update(name.encode('utf-8') + b'\0')
+            if not child.is_dir:
+                hasher.update(b'f' + file_digest(child))
+                continue
+            digest = child.digest
+            if digest is None and load_mounts:
+                # образ выгружен по бюджету, пока загружались соседние
+                digest = tree_digest(child)
+            if digest is None:
+                break
+            hasher.update(b'd' + digest)
+        else:
+            node.digest = hasher.digest()
+    return root.digest
+
+
+def _same(a, b) -> bool:
+    if a.is_dir != b.is_dir:
+        return False
+    if a.is_dir:
+        # хеш выгруженного по бюджету образа вычисляется заново
+        return tree_digest(a) == tree_digest(b)
+    return file_digest(a) == file_digest(b)
+
+
+def diff_trees(old: DirNode, new: DirNode) -> Iterator[Tuple[str, PathParts]]:
+    # различия двух деревьев в порядке путей: добавленные и удалённые узлы (поддерево
+    # целиком - одной строкой) и изменённые файлы. в совпадающие поддеревья не спускается
+    if tree_digest(old) == tree_digest(new):
+        return
+    # кадры стека: (путь, старый узел, новый узел); узел None - его нет в этом дереве
+    stack = [((), old, new)]
+    while stack:
+        parts, a, b = stack.pop()
+        if a is None:
+            yield DIFF_ADDED, parts
+        elif b is None:
+            yield DIFF_REMOVED, parts
+        elif not (a.is_dir and b.is_dir):
+            yield DIFF_MODIFIED, parts
+        else:
+            frames = []
+            for name in sorted(set(a.children).union(b.children)):
+                child_a = a.children.get(name)
+                child_b = b.children.get(name)
+                if child_a is None or child_b is None or not _same(child_a, child_b):
+                    frames.append((parts + (name,), child_a, child_b))
+            # обратный порядок на стеке - вывод в порядке имён
+            frames.reverse()
+            stack.extend(frames)
@@ -0,0 +1,231 @@
+import mmap
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from vfs_nodes import DirNode, Node
+
+# таблица монтирования: XML-образы, подключённые к директориям VFS элементом
+# <include name="..." src="..."/> в XML или командой mount. образ разбирается только
+# при первом входе в точку монтирования (обращении к её детям: разрешение пути внутрь,
+# ls, обход), до этого в памяти - только путь к образу. загруженное дерево - кеш:
+# когда в загруженных образах больше узлов, чем бюджет, давно не использованные
+# образы выгружаются и при следующем входе разбираются снова. при выгрузке VFS убирает
+# записи образа из своих кешей и индексов (on_unload), и на дерево образа и его
+# отображение в память не остаётся ссылок, кроме узлов у читателей, которые в этот
+# момент его обходят, и копий cp: отображение закрывается, как только они его отпустят.
+# смонтированные образы доступны только для чтения: изменения остаются в своём XML,
+# а vfs-compact записывает точку монтирования обратно элементом <include>.
+
+PathParts = Tuple[str, ...]
+
+# сколько узлов загруженных образов держится в памяти; 0 - без ограничения
+DEFAULT_MOUNT_BUDGET = 1_000_000
+
+
+def resolve_source(base_dir: str, src: str) -> str:
+    # путь образа из атрибута src (через '/', относительно директории включающего XML)
+    return os.path.normpath(os.path.join(base_dir, *src.split('/')))
+
+
+def relative_source(base_dir: str, source: str) -> str:
+    # обратное к resolve_source: путь для записи в src
+    try:
+        return os.path.relpath(source, base_dir).replace(os.sep, '/')
+    except ValueError:
+        # другой диск (Windows): относительного пути нет
+        return source.replace(os.sep, '/')
+
+
+class MountDir(DirNode):
+    # точка монтирования. children, names() и всё, что на них опирается, загружают
+    # образ; сама точка не изменяется и не копируется (clone), поэтому её дерево
+    # можно выгрузить в любой момент - читатели, уже взявшие его, дочитают своё
+    __slots__ = ('source', 'path', 'table', 'tree', 'mapping', 'nodes', 'load_ms', 'error',
+                 'last_used', 'pinned', 'lock')
+
+    def __init__(self, source: str, path: PathParts, table: 'MountTable'):
+        self.refs = 1
+        self._sorted = None
+        self.source = source     # абсолютный путь к XML-образу
+        self.path = path         # где смонтирован (для таблицы и индекса имён)
+        self.table = table
+        self.tree: Optional[DirNode] = None
+        self.mapping: Optional[mmap.mmap] = None  # отображение образа, на которое ссылаются файлы
+        self.nodes = 0           # узлов в загруженном образе
+        self.load_ms = 0.0
+        self.error: Optional[str] = None
+        self.last_used = 0.0
+        self.pinned = False      # узлы образа скопированы в дерево (cp): индекс образа остаётся
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.tree is not None
+
+    def load(self) -> DirNode:
+        tree = self.tree
+        if tree is None:
+            loaded = False
+            with self.lock:
+                tree = self.tree
+                if tree is None:
+                    tree = self.tree = self.table.load(self)
+                    loaded = True
+            if loaded:
+                # вне блокировки: выгрузка других образов берёт их блокировки
+                self.table.trim(keep=self)
+        self.last_used = time.monotonic()
+        return tree
+
+    def unload(self) -> Optional[DirNode]:
+        # выгруженное дерево; None - образ не был загружен.
+        # образ, который сейчас загружается, не выгружается
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            tree = self.tree
+            self.tree = self.mapping = None
+            self.error = None
+        finally:
+            self.lock.release()
+        return tree
+
+    @property
+    def children(self) -> Dict[str, Node]:
+        return self.load().children
+
+    @property
+    def digest(self) -> Optional[bytes]:
+        # хеш Меркла образа; None - не вычислен или образ не загружен
+        tree = self.tree
+        return tree.digest if tree is not None else None
+
+    @digest.setter
+    def digest(self, value: Optional[bytes]) -> None:
+        self.load().digest = value
+
+    def names(self) -> List[str]:
+        return self.load().names()
+
+    def add(self, name: str, node: Node) -> None:
+        raise ValueError("директория смонтирована только для чтения")
+
+    def clone(self) -> DirNode:
+        raise ValueError("директория смонтирована только для чтения")
+
+
+class MountTable:
+    # точки монтирования по пути и учёт загруженных образов.
+    # load_image(точка) -> (дерево образа, число узлов, отображение или None); ошибка
+    # загрузки не прерывает команду: точка монтирования выглядит пустой, а ошибка видна
+    # в таблице (mount). on_unload(точка, дерево) вызывается для выгруженного образа
+
+    def __init__(self, load_image: Callable[[MountDir], Tuple[DirNode, int, Optional[mmap.mmap]]],
+                 budget: int = DEFAULT_MOUNT_BUDGET,
+                 on_unload: Optional[Callable[[MountDir, DirNode], None]] = None):
+        self._load_image = load_image
+        self._on_unload = on_unload
+        self.budget = budget
+        self._mounts: Dict[PathParts, MountDir] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.unloads = 0
+
+    def __len__(self) -> int:
+        return len(self._mounts)
+
+    def create(self, source: str, path: PathParts) -> MountDir:
+        # точка монтирования, ещё не внесённая в таблицу (см. register)
+        return MountDir(source, path, self)
+
+    def register(self, mount: MountDir) -> None:
+        with self._lock:
+            self._mounts[mount.path] = mount
+
+    def entries(self) -> List[Tuple[PathParts, MountDir]]:
+        with self._lock:
+            return sorted(self._mounts.items())
+
+    def enclosing(self, parts: PathParts) -> List[MountDir]:
+        # точки монтирования, внутри образов которых лежит путь parts
+        with self._lock:
+            return [mount for path, mount in self._mounts.items()
+                    if len(path) < len(parts) and parts[:len(path)] == path]
+
+    def load(self, mount: MountDir) -> DirNode:
+        started = time.perf_counter()
+        try:
+            if self._mounted_above(mount):
+                raise ValueError(f"образ уже смонтирован выше по пути: {mount.source}")
+            tree, mount.nodes, mount.mapping = self._load_image(mount)
+            mount.error = None
+        except (OSError, ValueError) as e:
+            tree, mount.nodes, mount.mapping = DirNode(), 0, None
+            mount.error = str(e)
+        mount.load_ms = (time.perf_counter() - started) * 1000
+        self.loads += 1
+        return tree
+
+    def _mounted_above(self, mount: MountDir) -> bool:
+        # образ, включающий сам себя, дал бы бесконечное дерево
+        with self._lock:
+            return any(other.source == mount.source and mount.path[:len(parts)] == parts
+                       for parts, other in self._mounts.items() if parts != mount.path)
+
+    def trim(self, keep: Optional[MountDir] = None) -> int:
+        # выгружает давно не использованные образы, пока узлов больше бюджета.
+        # keep - только что загруженный образ: он и точки над ним остаются
+        if self.budget <= 0:
+            return 0
+        with self._lock:
+            loaded = [mount for mount in self._mounts.values() if mount.loaded]
+        used = sum(mount.nodes for mount in loaded)
+        unloaded = 0
+        for mount in sorted(loaded, key=lambda mount: mount.last_used):
+            if used <= self.budget:
+                break
+            if keep is not None and keep.path[:len(mount.path)] == mount.path:
+                continue
+            if self.unload(mount):
+                used -= mount.nodes
+                unloaded += 1
+        return unloaded
+
+    def unload(self, mount: MountDir) -> bool:
+        tree = mount.unload()
+        if tree is None:
+            return False
+        self.unloads += 1
+        # вложенные точки выгруженного образа создаются заново при его загрузке;
+        # их загруженные образы выгружаются раньше него, от вложенных к внешним
+        size = len(mount.path)
+        with self._lock:
+            nested = sorted((parts, other) for parts, other in self._mounts.items()
+                            if len(parts) > size and parts[:size] == mount.path)
+            for parts, _ in nested:
+                del self._mounts[parts]
+        for _, other in reversed(nested):
+            self._release(other, other.unload())
+        self._release(mount, tree)
+        return True
+
+    def _release(self, mount: MountDir, tree: Optional[DirNode]) -> None:
+        # убирает выгруженный образ из кешей VFS
+        if tree is not None and self._on_unload is not None:
+            self._on_unload(mount, tree)
+
+    def unload_all(self) -> int:
+        # образы выгружаются от вложенных к внешним
+        return sum(self.unload(mount) for _, mount in reversed(self.entries()) if mount.loaded)
+
+    def stats(self) -> Dict[str, int]:
+        entries = self.entries()
+        return {
+            'mounts': len(entries),
+            'loaded': sum(1 for _, mount in entries if mount.loaded),
+            'loaded_nodes': sum(mount.nodes for _, mount in entries if mount.loaded),
+            'budget_nodes': self.budget,
+            'loads': self.loads,
+            'unloads': self.unloads,
+        }
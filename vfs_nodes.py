@@ -0,0 +1,452 @@
+import bisect
+import hashlib
+import mmap
+import sys
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# содержимое короче этого порога хранится в узле строкой: ссылка на отображение
+# для него не экономит память
+MAP_THRESHOLD = 256
+
+# размер блока, которым содержимое читается для хеширования
+HASH_CHUNK_SIZE = 1 << 20
+
+# метка кодировки входит в хеш: одинаковые байты в base64 и тексте - разное содержимое
+_ENCODING_TAGS = {'text': b't', 'base64': b'b'}
+
+# директория больше этого числа детей хранит их по частям (ChildMap), упорядоченный
+# индекс имён (SortedNames) делится на части того же размера
+CHUNK_SIZE = 256
+
+# держит vfs-compact, пока переносит содержимое из закрываемого отображения образа:
+# читатель, попавший на закрытое отображение, ждёт конца переноса (Blob._slice)
+remap_lock = threading.Lock()
+
+
+class PayloadSegment:
+    # диапазон байтов содержимого в отображённом в память файле (XML-образ или снимок).
+    # source - bytes у содержимого, скопированного из закрытого отображения
+    __slots__ = ('source', 'offset', 'length')
+
+    def __init__(self, source: Union[mmap.mmap, bytes], offset: int, length: int):
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def read(self) -> bytes:
+        return self.source[self.offset:self.offset + self.length]
+
+
+class Blob:
+    # содержимое файла в хранилище с адресацией по содержимому: исходные данные,
+    # способ их хранения (base64/text) и хеш. одинаковое содержимое хранится одним
+    # объектом, refs - число файлов, ссылающихся на него.
+    # content - строка либо PayloadSegment, тогда байты читаются из отображения по запросу
+    __slots__ = ('content', 'encoding', '_digest', 'refs')
+
+    def __init__(self, content: Union[str, PayloadSegment], encoding: str,
+                 digest: Optional[bytes] = None):
+        self.content = content
+        self.encoding = encoding
+        self._digest = digest
+        self.refs = 0
+
+    @property
+    def digest(self) -> bytes:
+        # SHA-256 содержимого вычисляется при первом обращении (см. PayloadStore)
+        digest = self._digest
+        if digest is None:
+            digest = self._digest = content_digest(self)
+        return digest
+
+    @property
+    def hashed(self) -> bool:
+        # хеш уже вычислен (или получен из снимка)
+        return self._digest is not None
+
+    @property
+    def size(self) -> int:
+        # размер исходного содержимого (для строки - в символах)
+        content = self.content
+        if isinstance(content, str):
+            return len(content)
+        return content.length
+
+    def _slice(self, start: int, end: int) -> bytes:
+        # байты [start, end) содержимого из отображения. vfs-compact заменяет сегмент
+        # Blob и закрывает прежнее отображение: тогда диапазон читается из нового
+        content = self.content
+        try:
+            return content.source[content.offset + start:content.offset + end]
+        except ValueError:
+            with remap_lock:
+                content = self.content
+            return content.source[content.offset + start:content.offset + end]
+
+    def raw_bytes(self) -> bytes:
+        # исходное (не декодированное) содержимое файла
+        content = self.content
+        if isinstance(content, str):
+            return content.encode('utf-8')
+        return self._slice(0, content.length)
+
+    def iter_raw(self, chunk_size: int) -> Iterator[bytes]:
+        # исходное содержимое блоками: из отображения читается только текущий блок
+        content = self.content
+        if isinstance(content, str):
+            for pos in range(0, len(content), chunk_size):
+                yield content[pos:pos + chunk_size].encode('utf-8')
+            return
+        length = content.length
+        for pos in range(0, length, chunk_size):
+            yield self._slice(pos, min(pos + chunk_size, length))
+
+    def same_content(self, other: 'Blob') -> bool:
+        # побайтовое сравнение без хеширования (см. PayloadStore)
+        if self.encoding != other.encoding:
+            return False
+        mine, theirs = self.content, other.content
+        if isinstance(mine, str) and isinstance(theirs, str):
+            return mine == theirs
+        if isinstance(mine, str) or isinstance(theirs, str):
+            return self.raw_bytes() == other.raw_bytes()
+        # оба в отображении: крупное содержимое сравнивается блоками одинаковых границ
+        if mine.length != theirs.length:
+            return False
+        if mine.length <= HASH_CHUNK_SIZE:
+            return self.raw_bytes() == other.raw_bytes()
+        return all(a == b for a, b in zip(self.iter_raw(HASH_CHUNK_SIZE),
+                                          other.iter_raw(HASH_CHUNK_SIZE)))
+
+    def iter_raw_reversed(self, chunk_size: int) -> Iterator[bytes]:
+        # исходное содержимое блоками от конца к началу. границы блоков
+        # отсчитываются от начала содержимого и кратны chunk_size, поэтому
+        # при chunk_size, кратном 4, каждый блок base64 декодируется отдельно
+        content = self.content
+        length = self.size
+        start = (length - 1) // chunk_size * chunk_size
+        for pos in range(start, -1, -chunk_size):
+            end = min(pos + chunk_size, length)
+            if isinstance(content, str):
+                yield content[pos:end].encode('utf-8')
+            else:
+                yield self._slice(pos, end)
+
+
+def content_digest(blob: Blob) -> bytes:
+    hasher = hashlib.sha256(_ENCODING_TAGS.get(blob.encoding, blob.encoding.encode()))
+    for chunk in blob.iter_raw(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    return hasher.digest()
+
+
+class FileNode:
+    # файл VFS: только ссылка на содержимое в хранилище (Blob), поэтому
+    # тысячи одинаковых файлов хранят и декодируют содержимое один раз
+    __slots__ = ('blob',)
+    is_dir = False
+
+    def __init__(self, blob: Blob):
+        self.blob = blob
+        blob.refs += 1
+
+    @property
+    def content(self) -> Union[str, PayloadSegment]:
+        return self.blob.content
+
+    @property
+    def encoding(self) -> str:
+        return self.blob.encoding
+
+    @property
+    def digest(self) -> Optional[bytes]:
+        return self.blob.digest
+
+    @property
+    def size(self) -> int:
+        return self.blob.size
+
+    def raw_bytes(self) -> bytes:
+        return self.blob.raw_bytes()
+
+    def iter_raw(self, chunk_size: int) -> Iterator[bytes]:
+        return self.blob.iter_raw(chunk_size)
+
+    def iter_raw_reversed(self, chunk_size: int) -> Iterator[bytes]:
+        return self.blob.iter_raw_reversed(chunk_size)
+
+    def copy(self) -> 'FileNode':
+        # содержимое неизменяемо, поэтому копия ссылается на тот же Blob
+        return FileNode(self.blob)
+
+
+class ChildMap:
+    # словарь детей крупной директории, разбитый по хешу имени на части (словари).
+    # копия (copy) для новой версии дерева разделяет части с оригиналом и копирует
+    # только их список, а часть копируется при первом изменении в копии (_owned - id
+    # частей, которые принадлежат только этому словарю). частей
+    # становится больше вместе с директорией, так что и части, и их список порядка
+    # √n: изменение директории из n имён в новой версии стоит O(√n), а не O(n)
+    __slots__ = ('_parts', '_mask', '_owned', '_len')
+
+    def __init__(self, children: Dict[str, 'Node']):
+        count = 1
+        while len(children) > count * max(CHUNK_SIZE, count):
+            count *= 2
+        self._fill(count, children.items())
+        self._len = len(children)
+
+    def _fill(self, count: int, items) -> None:
+        # раскладывает детей по count частям; части принадлежат только этому словарю
+        mask = count - 1
+        parts: List[Dict[str, 'Node']] = [{} for _ in range(count)]
+        for name, node in items:
+            parts[hash(name) & mask][name] = node
+        self._parts = parts
+        self._mask = mask
+        self._owned = {id(part) for part in parts}
+
+    def get(self, name: str, default=None):
+        return self._parts[hash(name) & self._mask].get(name, default)
+
+    def __getitem__(self, name: str) -> 'Node':
+        return self._parts[hash(name) & self._mask][name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._parts[hash(name) & self._mask]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        for part in self._parts:
+            yield from part
+
+    def values(self) -> Iterator['Node']:
+        for part in self._parts:
+            yield from part.values()
+
+    def items(self) -> Iterator[Tuple[str, 'Node']]:
+        for part in self._parts:
+            yield from part.items()
+
+    def __setitem__(self, name: str, node: 'Node') -> None:
+        index = hash(name) & self._mask
+        part = self._parts[index]
+        if id(part) not in self._owned:
+            part = self._parts[index] = dict(part)
+            self._owned.add(id(part))
+        size = len(part)
+        part[name] = node
+        if len(part) > size:
+            self._len += 1
+            count = len(self._parts)
+            if self._len > count * max(CHUNK_SIZE, count):
+                self._fill(count * 2, self.items())
+
+    def copy(self) -> 'ChildMap':
+        # части становятся общими: и копия, и оригинал копируют часть перед изменением
+        clone = ChildMap.__new__(ChildMap)
+        clone._parts = self._parts[:]
+        clone._mask = self._mask
+        clone._len = self._len
+        clone._owned = set()
+        self._owned = set()
+        return clone
+
+
+class SortedNames:
+    # упорядоченный индекс имён директории: отсортированные части не длиннее
+    # 2 * CHUNK_SIZE и максимумы частей. вставка - двоичный поиск части по максимумам
+    # и вставка в неё: O(log n + CHUNK_SIZE) вместо сдвига всего списка. копия, как у
+    # ChildMap, разделяет части с оригиналом и копирует часть при изменении.
+    # ведёт себя как неизменяемая последовательность строк (len, итерация, срезы)
+    __slots__ = ('_lists', '_maxes', '_owned', '_len')
+
+    def __init__(self, names: List[str] = ()):
+        # names - уже отсортированные имена
+        self._lists = [names[pos:pos + CHUNK_SIZE] for pos in range(0, len(names), CHUNK_SIZE)]
+        self._maxes = [part[-1] for part in self._lists]
+        self._owned = {id(part) for part in self._lists}  # как у ChildMap
+        self._len = len(names)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        for part in self._lists:
+            yield from part
+
+    def __reversed__(self) -> Iterator[str]:
+        for part in reversed(self._lists):
+            yield from reversed(part)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            result: List[str] = []
+            i, pos = self._locate(start)
+            while start < stop and i < len(self._lists):
+                part = self._lists[i]
+                chunk = part[pos:pos + stop - start]
+                result.extend(chunk)
+                start += len(chunk)
+                i, pos = i + 1, 0
+            return result
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("индекс вне диапазона")
+        i, pos = self._locate(index)
+        return self._lists[i][pos]
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        # (номер части, позиция в ней) для позиции index во всей последовательности
+        for i, part in enumerate(self._lists):
+            if index < len(part):
+                return i, index
+            index -= len(part)
+        return len(self._lists), 0
+
+    def _position(self, i: int, pos: int) -> int:
+        return sum(map(len, self._lists[:i])) + pos
+
+    def bisect_left(self, name: str) -> int:
+        i = bisect.bisect_left(self._maxes, name)
+        if i == len(self._lists):
+            return self._len
+        return self._position(i, bisect.bisect_left(self._lists[i], name))
+
+    def bisect_right(self, name: str) -> int:
+        i = bisect.bisect_right(self._maxes, name)
+        if i == len(self._lists):
+            return self._len
+        return self._position(i, bisect.bisect_right(self._lists[i], name))
+
+    def add(self, name: str) -> None:
+        # имени ещё нет в индексе
+        lists = self._lists
+        self._len += 1
+        if not lists:
+            lists.append([name])
+            self._maxes.append(name)
+            self._owned.add(id(lists[0]))
+            return
+        i = min(bisect.bisect_left(self._maxes, name), len(lists) - 1)
+        part = lists[i]
+        if id(part) not in self._owned:
+            part = lists[i] = part[:]
+            self._owned.add(id(part))
+        bisect.insort(part, name)
+        self._maxes[i] = part[-1]
+        if len(part) > 2 * CHUNK_SIZE:
+            half = len(part) // 2
+            lists[i:i + 1] = halves = [part[:half], part[half:]]
+            self._maxes[i:i + 1] = [part[half - 1], part[-1]]
+            self._owned.discard(id(part))
+            self._owned.update(map(id, halves))
+
+    def copy(self) -> 'SortedNames':
+        clone = SortedNames.__new__(SortedNames)
+        clone._lists = self._lists[:]
+        clone._maxes = self._maxes[:]
+        clone._len = self._len
+        clone._owned = set()
+        self._owned = set()
+        return clone
+
+
+class DirNode:
+    # директория VFS: имена дочерних узлов интернируются,
+    # чтобы одинаковые имена в миллионах директорий хранились один раз.
+    # refs - сколько родителей ссылаются на узел в последней версии дерева: после
+    # cp -r поддерево общее, и это учитывается при подсчёте узлов.
+    # узлы опубликованной версии не изменяются: писатель изменяет копии (clone).
+    # digest - хеш Меркла поддерева; None - устарел после изменения и будет пересчитан.
+    # _sorted - упорядоченный индекс имён (SortedNames): строится при первом обращении
+    # и дальше поддерживается вставкой, а не сортируется при каждом ls.
+    # дети крупной директории (больше CHUNK_SIZE) при первом копировании (clone)
+    # переходят в ChildMap: дальше копия для новой версии копирует части, а не всех детей
+    __slots__ = ('children', 'refs', 'digest', '_sorted')
+    is_dir = True
+    loaded = True  # дети в памяти; у точки монтирования (MountDir) - после загрузки образа
+
+    def __init__(self):
+        self.children: Union[Dict[str, 'Node'], ChildMap] = {}
+        self.refs = 1
+        self.digest: Optional[bytes] = None
+        self._sorted: Optional[SortedNames] = None
+
+    def get(self, name: str) -> Optional['Node']:
+        return self.children.get(name)
+
+    def add(self, name: str, node: 'Node') -> None:
+        name = sys.intern(name)
+        if self._sorted is not None and name not in self.children:
+            self._sorted.add(name)
+        self.children[name] = node
+
+    def names(self) -> SortedNames:
+        # имена дочерних узлов в отсортированном порядке; последовательность - сам индекс
+        if self._sorted is None:
+            self._sorted = SortedNames(sorted(self.children))
+        return self._sorted
+
+    def names_with_prefix(self, prefix: str) -> List[str]:
+        # имена, начинающиеся с prefix, за O(log n + k): диапазон в упорядоченном индексе
+        names = self.names()
+        if not prefix:
+            return names[:]
+        low = names.bisect_left(prefix)
+        try:
+            # первая строка больше всех строк с этим префиксом
+            bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        except ValueError:
+            high = len(names)
+        else:
+            high = names.bisect_left(bound)
+        return names[low:high]
+
+    def names_after(self, name: str) -> int:
+        # позиция первого имени после name в упорядоченном индексе
+        return self.names().bisect_right(name)
+
+    def items(self) -> Iterator[Tuple[str, 'Node']]:
+        children = self.children
+        if type(children) is dict:
+            return iter(children.items())
+        # порядок частей зависит от хешей строк в процессе: крупная директория
+        # отдаётся по именам, чтобы снимок и записанный XML не зависели от запуска
+        return ((name, children[name]) for name in self.names())
+
+    def share(self) -> 'DirNode':
+        # ещё одна ссылка на то же поддерево: копирование за O(1)
+        self.refs += 1
+        return self
+
+    def clone(self) -> 'DirNode':
+        # копия директории для новой версии дерева: опубликованные версии не изменяются.
+        # копируется только словарь детей (у крупной директории - список его частей),
+        # дочерние узлы общие и копируются при своём изменении. refs описывает последнюю версию: если узел был общим после cp -r,
+        # одна ссылка переходит на копию, а у его детей становится на родителя больше
+        children = self.children
+        if type(children) is dict and len(children) > CHUNK_SIZE:
+            # один раз за O(n); словарь, который сейчас читают, не изменяется
+            children = self.children = ChildMap(children)
+        clone = DirNode()
+        clone.children = children.copy()
+        clone.digest = self.digest
+        if self._sorted is not None:
+            clone._sorted = self._sorted.copy()
+        if self.refs > 1:
+            self.refs -= 1
+            for child in clone.children.values():
+                if child.is_dir:
+                    child.refs += 1
+        return clone
+
+
+Node = Union[DirNode, FileNode]
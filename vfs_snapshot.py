@@ -0,0 +1,211 @@
+import mmap
+import os
+import struct
+from typing import Callable, Dict, Optional, Tuple
+from vfs_nodes import MAP_THRESHOLD, DirNode, PayloadSegment
+from vfs_merkle import file_digest, tree_digest
+from vfs_mount import MountDir, relative_source, resolve_source
+from payload_store import PayloadStore
+
+# бинарный снимок VFS: заголовок | область содержимого файлов | индекс директорий.
+# снимок пишется рядом с XML после первой загрузки и привязан к SHA-256 образа;
+# размер и mtime XML в заголовке позволяют проверить актуальность без чтения XML.
+# при загрузке снимок отображается в память, и крупные файлы ссылаются на свои
+# диапазоны в области содержимого, не копируясь в кучу.
+# в индексе хранятся хеши Меркла узлов, поэтому после загрузки из снимка
+# их не нужно пересчитывать по всему содержимому. одинаковое содержимое
+# записывается в область содержимого один раз.
+# точка монтирования записывается путём своего образа и не загружается: хеши
+# директорий над незагруженным образом неизвестны и пишутся нулями.
+
+SNAPSHOT_SUFFIX = '.snap'
+SNAPSHOT_MAGIC = b'VFSSNAP3'
+
+# magic, размер XML, mtime XML (нс), SHA-256, смещение и длина индекса, длина имени VFS
+_HEADER = struct.Struct('<8sQQ32sQQI')
+# тип записи индекса, длина имени
+_RECORD = struct.Struct('<BI')
+# число дочерних узлов директории, хеш Меркла
+_DIR_TAIL = struct.Struct('<I32s')
+# кодировка, смещение и длина содержимого файла в области содержимого, хеш содержимого
+_FILE_TAIL = struct.Struct('<BQQ32s')
+# длина пути образа точки монтирования (относительно снимка, через '/')
+_MOUNT_TAIL = struct.Struct('<I')
+
+_TYPE_DIR = 0
+_TYPE_FILE = 1
+_TYPE_MOUNT = 2
+
+_UNKNOWN_DIGEST = b'\0' * 32
+
+PathParts = Tuple[str, ...]
+
+_ENCODINGS = ('text', 'base64', 'zlib', 'lzma', 'bz2')
+
+
+def snapshot_path(vfs_xml_path: str) -> str:
+    return vfs_xml_path + SNAPSHOT_SUFFIX
+
+
+def write_snapshot(path: str, tree: DirNode, root_name: str, xml_sha256: str,
+                   xml_stat: os.stat_result) -> None:
+    # записывает снимок атомарно: во временный файл, затем os.replace.
+    # обход дерева итеративный, в порядке pre-order с числом детей у директорий
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    root_name_bytes = root_name.encode('utf-8')
+    index = bytearray()
+    base_dir = os.path.dirname(os.path.abspath(path))
+    tree_digest(tree, load_mounts=False)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * (_HEADER.size + len(root_name_bytes)))
+            payload_start = f.tell()
+            offset = 0
+            written: Dict[bytes, Tuple[int, int]] = {}  # хеш -> (смещение, длина)
+
+            stack = [('', tree)]
+            while stack:
+                name, node = stack.pop()
+                name_bytes = name.encode('utf-8')
+                if isinstance(node, MountDir):
+                    src = relative_source(base_dir, node.source).encode('utf-8')
+                    index += _RECORD.pack(_TYPE_MOUNT, len(name_bytes)) + name_bytes
+                    index += _MOUNT_TAIL.pack(len(src)) + src
+                elif node.is_dir:
+                    index += _RECORD.pack(_TYPE_DIR, len(name_bytes)) + name_bytes
+                    index += _DIR_TAIL.pack(len(node.children), node.digest or _UNKNOWN_DIGEST)
+                    # дети кладутся в обратном порядке, чтобы извлекаться в исходном
+                    stack.extend(reversed(list(node.items())))
+                else:
+                    digest = file_digest(node)
+                    location = written.get(digest)
+                    if location is None:
+                        data = node.raw_bytes()
+                        f.write(data)
+                        location = written[digest] = (offset, len(data))
+                        offset += len(data)
+                    index += _RECORD.pack(_TYPE_FILE, len(name_bytes)) + name_bytes
+                    index += _FILE_TAIL.pack(_ENCODINGS.index(node.encoding), *location, digest)
+
+            index_offset = payload_start + offset
+            f.write(index)
+            f.seek(0)
+            f.write(_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                xml_stat.st_size,
+                xml_stat.st_mtime_ns,
+                bytes.fromhex(xml_sha256),
+                index_offset,
+                len(index),
+                len(root_name_bytes),
+            ))
+            f.write(root_name_bytes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_snapshot(path: str, xml_stat: os.stat_result,
+                  make_mount: Callable[[str, PathParts], DirNode]
+                  ) -> Optional[Tuple[str, str, DirNode, PayloadStore, Optional[mmap.mmap]]]:
+    # возвращает (имя VFS, SHA-256 XML, дерево, хранилище содержимого, отображение снимка
+    # или None, если на него не ссылается ни один файл) либо None, если снимка нет,
+    # он устарел относительно XML или повреждён.
+    # make_mount(путь образа, путь в дереве) создаёт точку монтирования
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                return None
+            (magic, xml_size, xml_mtime_ns, sha, index_offset,
+             index_len, root_name_len) = _HEADER.unpack(header)
+            if (magic != SNAPSHOT_MAGIC or xml_size != xml_stat.st_size
+                    or xml_mtime_ns != xml_stat.st_mtime_ns):
+                return None
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        payload_start = _HEADER.size + root_name_len
+        if index_offset < payload_start or index_offset + index_len != len(source):
+            raise ValueError("Неверные границы индекса снимка")
+        root_name = source[_HEADER.size:payload_start].decode('utf-8')
+        store = PayloadStore()
+        tree, mapped_files = _build_tree(source, index_offset, payload_start, store,
+                                         os.path.dirname(os.path.abspath(path)), make_mount)
+    except (struct.error, ValueError, IndexError, UnicodeDecodeError):
+        source.close()
+        return None
+
+    # отображение держат только узлы, ссылающиеся на него
+    if not mapped_files:
+        source.close()
+        return root_name, sha.hex(), tree, store, None
+    return root_name, sha.hex(), tree, store, source
+
+
+def _build_tree(source: mmap.mmap, pos: int, payload_start: int, store: PayloadStore,
+                base_dir: str, make_mount: Callable[[str, PathParts], DirNode]
+                ) -> Tuple[DirNode, int]:
+    payload_end = pos
+    mapped_files = 0
+    kind, name_len = _RECORD.unpack_from(source, pos)
+    pos += _RECORD.size + name_len
+    if kind != _TYPE_DIR:
+        raise ValueError("Корень снимка должен быть директорией")
+    count, digest = _DIR_TAIL.unpack_from(source, pos)
+    pos += _DIR_TAIL.size
+
+    root = DirNode()
+    root.digest = digest if digest != _UNKNOWN_DIGEST else None
+    # стек: (директория, сколько её детей ещё не прочитано, путь)
+    stack = [[root, count, ()]]
+    while stack:
+        frame = stack[-1]
+        if not frame[1]:
+            stack.pop()
+            continue
+        frame[1] -= 1
+
+        kind, name_len = _RECORD.unpack_from(source, pos)
+        pos += _RECORD.size
+        name = source[pos:pos + name_len].decode('utf-8')
+        pos += name_len
+
+        if kind == _TYPE_DIR:
+            count, digest = _DIR_TAIL.unpack_from(source, pos)
+            pos += _DIR_TAIL.size
+            node = DirNode()
+            node.digest = digest if digest != _UNKNOWN_DIGEST else None
+            frame[0].add(name, node)
+            stack.append([node, count, frame[2] + (name,)])
+        elif kind == _TYPE_FILE:
+            encoding, offset, length, digest = _FILE_TAIL.unpack_from(source, pos)
+            pos += _FILE_TAIL.size
+            offset += payload_start
+            if offset + length > payload_end:
+                raise ValueError("Содержимое файла выходит за границы снимка")
+            if length >= MAP_THRESHOLD:
+                content = PayloadSegment(source, offset, length)
+                mapped_files += 1
+            else:
+                content = source[offset:offset + length].decode('utf-8')
+            frame[0].add(name, store.add(content, _ENCODINGS[encoding], digest))
+        elif kind == _TYPE_MOUNT:
+            (src_len,) = _MOUNT_TAIL.unpack_from(source, pos)
+            pos += _MOUNT_TAIL.size
+            src = source[pos:pos + src_len].decode('utf-8')
+            pos += src_len
+            frame[0].add(name, make_mount(resolve_source(base_dir, src), frame[2] + (name,)))
+        else:
+            raise ValueError(f"Неизвестный тип записи снимка: {kind}")
+
+    if pos != len(source):
+        raise ValueError("Лишние данные в индексе снимка")
+    return root, mapped_files
@@ -0,0 +1,80 @@
+import hashlib
+import os
+from typing import Callable, Dict, Optional
+from xml.sax.saxutils import quoteattr
+from vfs_nodes import Blob, DirNode
+from vfs_mount import MountDir, relative_source
+
+# размер блока при записи крупного содержимого файлов
+WRITE_CHUNK_SIZE = 1 << 20
+
+
+def _escape_bytes(data: bytes) -> bytes:
+    return data.replace(b'&', b'&amp;').replace(b'<', b'&lt;').replace(b'>', b'&gt;')
+
+
+def write_vfs_xml(path: str, tree: DirNode, root_name: str,
+                  placed: Optional[Dict[Blob, int]] = None,
+                  replace: Callable[[str, str], None] = os.replace) -> str:
+    # записывает дерево VFS в XML-образ атомарно (временный файл, затем replace)
+    # и возвращает SHA-256 записанного образа. содержимое файлов пишется в исходном
+    # виде (base64 или текст), крупное - блоками прямо из хранилища.
+    # поддеревья, разделяемые после cp -r, записываются в каждом месте.
+    # точки монтирования записываются элементом <include> и не загружаются.
+    # placed - куда записать смещения в образе содержимого из отображения, записанного
+    # байт в байт (без экранирования): по ним его можно отобразить из нового образа
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    hasher = hashlib.sha256()
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            def write(data: bytes) -> None:
+                hasher.update(data)
+                f.write(data)
+
+            write(f'<vfs name={quoteattr(root_name)}>\n'.encode('utf-8'))
+            # кадры стека: (имя, узел, глубина); None вместо имени - закрытие директории
+            stack = [(name, node, 1) for name, node in reversed(list(tree.items()))]
+            while stack:
+                name, node, depth = stack.pop()
+                indent = '    ' * depth
+                if name is None:
+                    write(f'{indent}</dir>\n'.encode('utf-8'))
+                elif isinstance(node, MountDir):
+                    src = relative_source(base_dir, node.source)
+                    write(f'{indent}<include name={quoteattr(name)} src={quoteattr(src)}/>\n'
+                          .encode('utf-8'))
+                elif node.is_dir:
+                    write(f'{indent}<dir name={quoteattr(name)}>\n'.encode('utf-8'))
+                    stack.append((None, None, depth))
+                    stack.extend((child_name, child, depth + 1)
+                                 for child_name, child in reversed(list(node.items())))
+                else:
+                    is_text = node.encoding == 'text'
+                    # у сжатого содержимого кодировка - способ сжатия, данные - base64
+                    compression = '' if is_text or node.encoding == 'base64' else \
+                        f' compression={quoteattr(node.encoding)}'
+                    write(f'{indent}<file name={quoteattr(name)}{compression}>'.encode('utf-8'))
+                    start = f.tell()
+                    verbatim = True
+                    for chunk in node.iter_raw(WRITE_CHUNK_SIZE):
+                        # &, < и > - ASCII и не встречаются внутри многобайтовых символов,
+                        # поэтому текст экранируется по блокам
+                        if is_text:
+                            escaped = _escape_bytes(chunk)
+                            verbatim = verbatim and len(escaped) == len(chunk)
+                            chunk = escaped
+                        write(chunk)
+                    if placed is not None and verbatim and not isinstance(node.content, str):
+                        placed.setdefault(node.blob, start)
+                    write(b'</file>\n')
+            write(b'</vfs>\n')
+        replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return hasher.hexdigest()